@@ -1,37 +1,85 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-import sqlite3
-import jwt
-import qrcode
-import io
 import base64
-from datetime import datetime, timedelta
+import csv
+import io
+import json
+import time
+from datetime import datetime
 import os
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
-import joblib
-import pandas as pd
-import numpy as np
 from dotenv import load_dotenv
+from db import DB_CONFIG, get_db_connection, release_thread_connection, pool_stats
+from migrations import migrate
+from fraud import FraudBatcher, score_transactions, transfer_features
+from qr import (QR_MIMETYPES, NonceStore, QRPayloadError, decode_qr_payload, encode_qr_payload,
+                qr_signing_key, render_qr)
+from workers import PoolSaturated, pool_from_env
+from ledger import IN_CHUNK_SIZE, SnapshotCompactor, TransferError, balance_at
+from shards import OutboxRelay, shard_set
+from velocity import VelocityStore, VelocitySync
+from auth import auth_stats, generate_token, token_required
+from balance_cache import BalanceCache
+from money import InvalidAmount, to_major, to_minor
+from ratelimit import LimiterTimings
+import metrics
+from metrics import METRICS_ENABLED, span
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-QR-Data'])
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
-# Rate limiting setup
+# Per-route latency hooks go first so they also time the rate limiter (METRICS=true)
+metrics.init_app(app)
+
+# Rate limiting setup; the default sqlite:// storage (ratelimit.py) shares
+# counters between gunicorn workers, memory:// keeps them per process
+RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', 'sqlite:///ratelimit.db')
+DEFAULT_LIMITS = ["200 per day", "50 per hour"]
+READ_LIMIT = "50 per minute"
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"]
+    default_limits=DEFAULT_LIMITS,
+    storage_uri=RATELIMIT_STORAGE_URI,
+    storage_options={'purge_interval': float(os.getenv('RATELIMIT_PURGE_INTERVAL', 30))}
+    if RATELIMIT_STORAGE_URI.startswith('sqlite://') else {},
+    strategy=os.getenv('RATELIMIT_STRATEGY', 'sliding-window-counter'),
+    enabled=os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
 )
+limiter_timings = LimiterTimings()
+if limiter.enabled:
+    limiter_timings.instrument(limiter.limiter)
+
+# Return any pooled connection a handler did not close (e.g. on an exception path)
+app.teardown_appcontext(release_thread_connection)
+
+# Database initialization; every shard file gets the full schema (shards.py)
+_db_state = {'ready': False}
 
-# Database initialization
 def init_db():
-    conn = sqlite3.connect('sme_wallet.db')
+    for shard in range(shard_set.count):
+        conn = shard_set.connect_shard(shard)
+        create_tables(conn)
+        conn.close()
+    shard_set.load_map()
+    _db_state['ready'] = True
+
+# Under gunicorn/WSGI nothing calls init_db() at start-up, and until the map
+# is loaded every user routes to shard 0; this runs before the first request
+# is dispatched (Flask holds the others back). Safe to race across workers.
+@app.before_first_request
+def prepare_database():
+    if not _db_state['ready']:
+        init_db()
+
+def create_tables(conn):
     c = conn.cursor()
     
     # Users table
@@ -76,81 +124,323 @@ def init_db():
                   FOREIGN KEY (receiver_id) REFERENCES users(id))''')
     
     conn.commit()
-    conn.close()
+    
+    # Indexes and later schema changes are versioned in migrations.py
+    migrate(conn)
 
 # Load fraud detection model
+FRAUD_MODEL_PATH = os.getenv('FRAUD_MODEL_PATH', 'fraud_model.pkl')
+# Flattened forest written by `python forest.py fraud_model.pkl fraud_model.npz`
+FRAUD_MODEL_COMPILED_PATH = os.getenv('FRAUD_MODEL_COMPILED_PATH', 'fraud_model.npz')
+
 def load_fraud_model():
+    # numpy, joblib and scikit-learn are imported here, not at module import
+    if os.path.exists(FRAUD_MODEL_COMPILED_PATH):
+        from forest import CompiledForest
+        return CompiledForest.load(FRAUD_MODEL_COMPILED_PATH, mmap=True)
     try:
-        model = joblib.load('fraud_model.pkl')
+        import joblib
+        model = joblib.load(FRAUD_MODEL_PATH)
+        # Request-sized inputs only pay for joblib's thread pool start-up
+        if hasattr(model, 'n_jobs'):
+            model.n_jobs = 1
         return model
     except FileNotFoundError:
         print("Fraud model not found. Using rule-based detection.")
         return None
 
-fraud_model = load_fraud_model()
+# Micro-batching for concurrent single-transaction fraud checks
+FRAUD_MICRO_BATCHING = os.getenv('FRAUD_MICRO_BATCHING', 'true').lower() == 'true'
+fraud_batcher = FraudBatcher(
+    None,
+    max_batch_size=int(os.getenv('FRAUD_BATCH_MAX_SIZE', 32)),
+    max_wait_ms=float(os.getenv('FRAUD_BATCH_MAX_WAIT_MS', 2.0)),
+    latency_budget_ms=float(os.getenv('FRAUD_LATENCY_BUDGET_MS', 50.0))
+)
 
-# Helper functions
-def get_db_connection():
-    conn = sqlite3.connect('sme_wallet.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def generate_token(user_id):
-    payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(hours=24)
+# The model is loaded by the first request that scores a transfer, so
+# workers start fast. APP_PRELOAD=true loads it (and the QR renderer) at
+# import instead: with `gunicorn --preload` that happens once in the master
+# and forked workers share the pages copy-on-write.
+APP_PRELOAD = os.getenv('APP_PRELOAD', 'false').lower() == 'true'
+_fraud_model_lock = threading.Lock()
+_fraud_model_state = {'loaded': False, 'model': None, 'load_ms': None}
+
+def get_fraud_model():
+    if not _fraud_model_state['loaded']:
+        with _fraud_model_lock:
+            if not _fraud_model_state['loaded']:
+                started = time.perf_counter()
+                model = load_fraud_model()
+                fraud_batcher.model = model
+                _fraud_model_state['model'] = model
+                _fraud_model_state['load_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                _fraud_model_state['loaded'] = True
+    return _fraud_model_state['model']
+
+def fraud_model_stats():
+    model = _fraud_model_state['model']
+    return {
+        'loaded': _fraud_model_state['loaded'],
+        'type': type(model).__name__ if model is not None else None,
+        'load_ms': _fraud_model_state['load_ms'],
+        'preload': APP_PRELOAD
     }
-    return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
 
-def verify_token(token):
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        return payload['user_id']
-    except jwt.ExpiredSignatureError:
+def preload():
+    get_fraud_model()
+    import qrcode.image.svg  # noqa: F401 (render_qr imports it per call)
+
+if APP_PRELOAD:
+    preload()
+
+# QR payloads are signed (see qr.py), valid for QR_VALIDITY_WINDOW seconds and
+# each one pays once. Every code carries a fresh nonce, so no two renders are
+# alike and images are not cached.
+QR_VALIDITY_WINDOW = int(os.getenv('QR_VALIDITY_WINDOW', 300))
+QR_SIGNING_KEY = qr_signing_key(os.getenv('QR_SIGNING_KEY') or app.config['SECRET_KEY'])
+qr_nonces = NonceStore(get_db_connection)
+
+# Hot wallet balances; every committed transfer writes through or invalidates.
+# The generation board is a file next to the database so that every worker
+# process sees every other worker's invalidations.
+BALANCE_CACHE_ENABLED = os.getenv('BALANCE_CACHE', 'true').lower() == 'true'
+balance_cache = BalanceCache(
+    max_entries=int(os.getenv('BALANCE_CACHE_SIZE', 10000)),
+    slots=int(os.getenv('BALANCE_CACHE_SLOTS', 65536)),
+    shared_name=os.getenv('BALANCE_CACHE_SHARED') or None,
+    board_path=os.getenv('BALANCE_CACHE_BOARD', DB_CONFIG['path'] + '-gen') or None
+)
+
+# Folds new ledger entries into per-wallet snapshots (0 disables the thread)
+snapshot_compactor = SnapshotCompactor(
+    [shard_pool.acquire for shard_pool in shard_set.pools],
+    interval=float(os.getenv('LEDGER_SNAPSHOT_INTERVAL', 60)),
+    min_entries=int(os.getenv('LEDGER_SNAPSHOT_MIN_ENTRIES', 1000))
+)
+
+# Retries cross-shard credits a crash or a busy shard left in the outbox (DB_SHARDS > 1)
+outbox_relay = OutboxRelay(shard_set, interval=float(os.getenv('OUTBOX_RELAY_INTERVAL', 5)))
+if BALANCE_CACHE_ENABLED:
+    shard_set.on_delivered = balance_cache.invalidate
+
+# Per-sender velocity features for fraud scoring (see velocity.py); routes
+# record their own commits, the sync thread rebuilds and tails the rest
+VELOCITY_FEATURES = os.getenv('VELOCITY_FEATURES', 'true').lower() == 'true'
+velocity_store = VelocityStore(shard_set.shard_of)
+velocity_sync = VelocitySync(
+    velocity_store,
+    [shard_pool.acquire for shard_pool in shard_set.pools],
+    interval=float(os.getenv('VELOCITY_SYNC_INTERVAL', 5))
+)
+
+def sender_velocity(sender_id, amount):
+    return velocity_store.features(sender_id, amount) if VELOCITY_FEATURES else None
+
+def sender_velocity_projection(sender_id, planned):
+    # For scoring a list item by item: ``planned`` are the (receiver_id, amount) accepted so far
+    if not VELOCITY_FEATURES:
         return None
-    except jwt.InvalidTokenError:
+    projection = velocity_store.projection(sender_id)
+    for receiver_id, amount in planned:
+        projection.add(receiver_id, amount)
+    return projection
+
+def record_velocity(sender_id, transaction_ids, transfers):
+    # ``transfers`` as passed to shard_set.apply_transfers; ids are on the sender's shard
+    if VELOCITY_FEATURES:
+        velocity_store.record_many(shard_set.shard_of(sender_id), sender_id, transaction_ids, transfers)
+
+def publish_transfer(sender_id, receiver_id, amount, description, result, generations):
+    # Side effects of a committed transfer. They must not fail the request:
+    # the money has moved, and process_qr must not hand the code back
+    try:
+        record_velocity(sender_id, [result['transaction_id']], [(receiver_id, amount, description, result['timestamp'])])
+    except Exception:
+        app.logger.exception('Recording velocity for transaction %s failed', result['transaction_id'])
+    if BALANCE_CACHE_ENABLED:
+        try:
+            balance_cache.write_through(result['wallets'], generations)
+        except Exception:
+            app.logger.exception('Publishing balances for transaction %s failed', result['transaction_id'])
+
+@app.before_first_request
+def start_background_jobs():
+    snapshot_compactor.start()
+    outbox_relay.start()
+    if VELOCITY_FEATURES:
+        velocity_sync.start()
+
+# CPU-bound work (QR rasterisation, password KDFs) runs off the request thread
+qr_pool = pool_from_env('qr', default_workers=2, default_queue=16)
+auth_pool = pool_from_env('auth', default_workers=2, default_queue=32)
+
+def render_qr_offloaded(payload, image_format):
+    with span('qr_render'):
+        return qr_pool.run(render_qr, payload, image_format)
+
+@app.errorhandler(PoolSaturated)
+def handle_pool_saturated(e):
+    response = jsonify({'error': 'Server busy, please retry', 'pool': e.pool_name})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+# Transfers per /api/transact/batch request
+BATCH_TRANSFER_MAX_ITEMS = int(os.getenv('BATCH_TRANSFER_MAX_ITEMS', 1000))
+
+# Helper functions
+def resolve_user_ids(conn, emails):
+    """{email: user_id} for the given emails, one IN query per 500; unknown emails are omitted."""
+    emails = list(emails)
+    user_ids = {}
+    for start in range(0, len(emails), IN_CHUNK_SIZE):
+        chunk = emails[start:start + IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(f'SELECT id, email FROM users WHERE email IN ({placeholders})', chunk).fetchall()
+        user_ids.update((row['email'], row['id']) for row in rows)
+    return user_ids
+
+def plan_transfers(txs, sender_id, balances):
+    """Decide, in order, which transfers from one sender can be applied.
+
+    ``txs`` are mappings with 'id', 'receiver_id' and 'amount' (offline queue
+    rows or batch items). Works purely on the ``balances`` snapshot (read
+    under the write lock), so the outcome matches applying the entries one by
+    one. Fraud features for the whole list are scored in one batch, projected
+    as if every affordable earlier entry goes through (balances and the
+    sender's velocity alike); when an entry is rejected the projection no
+    longer holds, so the remainder is re-scored. Returns (accepted, failed).
+    """
+    sender_balance = balances.get(sender_id)
+    receiver_balances = dict(balances)
+    accepted = []
+    failed = []
+    
+    pending = list(txs)
+    while pending:
+        projected = []
+        projected_sender = sender_balance
+        projected_receivers = dict(receiver_balances)
+        velocity = sender_velocity_projection(sender_id, [(tx['receiver_id'], tx['amount']) for tx in accepted])
+        for tx in pending:
+            receiver_id = tx['receiver_id']
+            if projected_sender is None or projected_sender < tx['amount']:
+                projected.append((None, 'Insufficient balance'))
+            elif receiver_id not in projected_receivers:
+                projected.append((None, 'Receiver wallet not found'))
+            else:
+                projected.append((transfer_features(tx['amount'], projected_sender, projected_receivers[receiver_id],
+                                                    velocity=velocity.features(tx['amount']) if velocity is not None else None), None))
+                projected_sender -= tx['amount']
+                projected_receivers[receiver_id] += tx['amount']
+                if velocity is not None:
+                    velocity.add(receiver_id, tx['amount'])
+        
+        fraud_results = iter(detect_fraud_batch([features for features, _ in projected if features is not None]))
+        remaining = []
+        
+        for index, (tx, (transaction_data, reason)) in enumerate(zip(pending, projected)):
+            if transaction_data is None:
+                failed.append({'id': tx['id'], 'reason': reason})
+                continue
+            
+            fraud_result = next(fraud_results)
+            
+            if fraud_result['is_fraud'] and fraud_result['confidence'] > 0.7:
+                failed.append({'id': tx['id'], 'reason': 'Flagged as fraudulent'})
+                remaining = pending[index + 1:]
+                break
+            
+            accepted.append(tx)
+            sender_balance -= tx['amount']
+            receiver_balances[tx['receiver_id']] += tx['amount']
+        
+        pending = remaining
+    
+    return accepted, failed
+
+# Statement export: each branch walks one (sender_id|receiver_id, timestamp)
+# index in order and SQLite merges the two, so rows stream without a sort
+STATEMENT_EXPORT_QUERY = '''
+    SELECT t.id, t.timestamp, 'sent' AS direction, t.transaction_type, t.status, -t.amount AS amount,
+           u.name AS counterparty_name, u.email AS counterparty_email, t.description
+    FROM transactions t JOIN users u ON u.id = t.receiver_id
+    WHERE t.sender_id = ? AND t.timestamp >= ? AND t.timestamp < ?{filters}
+    UNION ALL
+    SELECT t.id, t.timestamp, 'received', t.transaction_type, t.status, t.amount,
+           u.name, u.email, t.description
+    FROM transactions t JOIN users u ON u.id = t.sender_id
+    WHERE t.receiver_id = ? AND t.sender_id <> ? AND t.timestamp >= ? AND t.timestamp < ?{filters}
+    ORDER BY 2, 1
+'''
+STATEMENT_COLUMNS = [
+    'id', 'timestamp', 'direction', 'transaction_type', 'status', 'amount',
+    'counterparty_name', 'counterparty_email', 'description'
+]
+EXPORT_FETCH_ROWS = int(os.getenv('EXPORT_FETCH_ROWS', 1000))
+
+def format_statement_rows(rows, export_format):
+    if export_format == 'ndjson':
+        return ''.join(
+            json.dumps(dict(zip(STATEMENT_COLUMNS, row), amount=to_major(row['amount']))) + '\n' for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        values = list(row)
+        values[5] = f'{to_major(row["amount"]):.2f}'
+        writer.writerow(values)
+    return buffer.getvalue()
+
+# Transaction history queries
+TRANSACTIONS_OFFSET_QUERY = '''
+    SELECT t.*, 
+           sender.name as sender_name, sender.email as sender_email,
+           receiver.name as receiver_name, receiver.email as receiver_email
+    FROM transactions t
+    JOIN users sender ON t.sender_id = sender.id
+    JOIN users receiver ON t.receiver_id = receiver.id
+    WHERE (t.sender_id = ? OR t.receiver_id = ?){filters}
+    ORDER BY t.timestamp DESC, t.id DESC LIMIT ? OFFSET ?
+'''
+
+TRANSACTIONS_KEYSET_BRANCH = '''
+    SELECT * FROM (SELECT * FROM transactions WHERE {column} = ?{filters}
+                   ORDER BY timestamp DESC, id DESC LIMIT ?)
+'''
+
+TRANSACTIONS_KEYSET_QUERY = '''
+    SELECT t.*,
+           sender.name as sender_name, sender.email as sender_email,
+           receiver.name as receiver_name, receiver.email as receiver_email
+    FROM ({sender_branch} UNION {receiver_branch}) t
+    JOIN users sender ON t.sender_id = sender.id
+    JOIN users receiver ON t.receiver_id = receiver.id
+    ORDER BY t.timestamp DESC, t.id DESC LIMIT ?
+'''
+
+def encode_cursor(timestamp, tx_id):
+    return base64.urlsafe_b64encode(f'{timestamp}|{tx_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, tx_id = base64.urlsafe_b64decode(padded.encode()).decode().rsplit('|', 1)
+        return timestamp, int(tx_id)
+    except (ValueError, UnicodeDecodeError):
         return None
 
 def detect_fraud(transaction_data):
-    if fraud_model is None:
-        # Rule-based fraud detection
-        amount = transaction_data.get('amount', 0)
-        if amount > 100000:
-            return {'is_fraud': True, 'confidence': 0.8, 'reason': 'Large amount'}
-        elif amount <= 0:
-            return {'is_fraud': True, 'confidence': 0.9, 'reason': 'Invalid amount'}
-        else:
-            return {'is_fraud': False, 'confidence': 0.1, 'reason': 'Normal transaction'}
-    else:
-        # ML model fraud detection
-        try:
-            features = [[
-                transaction_data.get('amount', 0),
-                transaction_data.get('oldbalanceOrg', 0),
-                transaction_data.get('newbalanceOrig', 0),
-                transaction_data.get('oldbalanceDest', 0),
-                transaction_data.get('newbalanceDest', 0),
-                transaction_data.get('type_TRANSFER', 0),
-                transaction_data.get('type_PAYMENT', 0),
-                transaction_data.get('type_CASH_OUT', 0),
-                transaction_data.get('type_CASH_IN', 0),
-                transaction_data.get('amountToOldBalanceOrg', 0),
-                transaction_data.get('amountToOldBalanceDest', 0),
-                transaction_data.get('balanceChangeOrig', 0),
-                transaction_data.get('balanceChangeDest', 0),
-                transaction_data.get('hour', datetime.utcnow().hour),
-                transaction_data.get('day', datetime.utcnow().day)
-            ]]
-            prediction = fraud_model.predict(features)[0]
-            probability = fraud_model.predict_proba(features)[0][1]
-            return {
-                'is_fraud': bool(prediction),
-                'confidence': probability,
-                'reason': 'ML model prediction'
-            }
-        except Exception as e:
-            print(f"Fraud detection error: {e}")
-            return {'is_fraud': False, 'confidence': 0.1, 'reason': 'Model error'}
+    with span('fraud'):
+        if get_fraud_model() is not None and FRAUD_MICRO_BATCHING:
+            return fraud_batcher.score(transaction_data)
+        return score_transactions(get_fraud_model(), [transaction_data])[0]
+
+def detect_fraud_batch(transactions):
+    # One predict_proba pass for the whole batch (see fraud.py)
+    with span('fraud'):
+        return score_transactions(get_fraud_model(), transactions)
 
 # API Routes
 @app.route('/api/register', methods=['POST'])
@@ -175,7 +465,7 @@ def register():
         conn.close()
         return jsonify({'error': 'User already exists'}), 409
     
-    hashed_password = generate_password_hash(password)
+    hashed_password = auth_pool.run(generate_password_hash, password)
     created_at = datetime.utcnow().isoformat()
     
     cursor = conn.execute(
@@ -184,10 +474,8 @@ def register():
     )
     user_id = cursor.lastrowid
     
-    conn.execute(
-        'INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
-        (user_id, 0.0, created_at)
-    )
+    # The wallet goes on the user's home shard
+    shard_set.add_user(conn, user_id, email, name, created_at)
     
     conn.commit()
     conn.close()
@@ -215,7 +503,7 @@ def login():
     user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
     conn.close()
     
-    if not user or not check_password_hash(user['password'], password):
+    if not user or not auth_pool.run(check_password_hash, user['password'], password):
         return jsonify({'error': 'Invalid credentials'}), 401
     
     token = generate_token(user['id'])
@@ -228,189 +516,217 @@ def login():
 
 @app.route('/api/generate_qr', methods=['POST'])
 @limiter.limit("20 per minute")
-def generate_qr():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Missing or invalid token'}), 401
-    
-    token = auth_header.split(' ')[1]
-    user_id = verify_token(token)
-    
-    if not user_id:
-        return jsonify({'error': 'Invalid or expired token'}), 401
-    
+@token_required
+def generate_qr(user_id):
     data = request.get_json()
-    amount = data.get('amount', 0)
     description = data.get('description', '')
     
+    try:
+        amount = to_minor(data.get('amount', 0))
+    except InvalidAmount as e:
+        return jsonify({'error': e.message}), 400
+    
     if amount <= 0:
         return jsonify({'error': 'Amount must be greater than 0'}), 400
     
-    qr_data = {
-        'user_id': user_id,
-        'amount': amount,
-        'description': description,
-        'timestamp': datetime.utcnow().isoformat()
-    }
+    image_format = data.get('format', 'data_uri')
+    if image_format not in ('data_uri', 'png', 'svg'):
+        return jsonify({'error': 'format must be one of data_uri, png, svg'}), 400
     
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(str(qr_data))
-    qr.make(fit=True)
+    expires_at = int(time.time()) + QR_VALIDITY_WINDOW
+    try:
+        qr_data = encode_qr_payload(QR_SIGNING_KEY, user_id, amount, expires_at, description)
+    except QRPayloadError as e:
+        return jsonify({'error': e.message}), 400
+    
+    if image_format != 'data_uri':
+        image = render_qr_offloaded(qr_data, image_format)
+        return Response(image, mimetype=QR_MIMETYPES[image_format], headers={'X-QR-Data': json.dumps(qr_data)})
     
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    img_str = base64.b64encode(render_qr_offloaded(qr_data, 'png')).decode()
     
     return jsonify({
         'qr_code': f'data:image/png;base64,{img_str}',
-        'qr_data': qr_data
+        'qr_data': qr_data,
+        'expires_at': datetime.utcfromtimestamp(expires_at).isoformat()
     }), 200
 
 @app.route('/api/process_qr', methods=['POST'])
 @limiter.limit("20 per minute")
-def process_qr():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Missing or invalid token'}), 401
-    
-    token = auth_header.split(' ')[1]
-    sender_id = verify_token(token)
-    
-    if not sender_id:
-        return jsonify({'error': 'Invalid or expired token'}), 401
-    
+@token_required
+def process_qr(sender_id):
     data = request.get_json()
     qr_data = data.get('qr_data')
     
-    if not qr_data:
+    if not qr_data or not isinstance(qr_data, str):
         return jsonify({'error': 'Missing QR code data'}), 400
     
     try:
-        qr_data = eval(qr_data)  # Safely parse QR data
-        receiver_id = qr_data.get('user_id')
-        amount = qr_data.get('amount')
-        description = qr_data.get('description', '')
-        
-        if amount <= 0:
-            return jsonify({'error': 'Invalid amount in QR code'}), 400
-        
-        if sender_id == receiver_id:
-            return jsonify({'error': 'Cannot send money to yourself'}), 400
-        
-        conn = get_db_connection()
-        
-        sender_wallet = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (sender_id,)).fetchone()
-        if not sender_wallet or sender_wallet['balance'] < amount:
-            conn.close()
-            return jsonify({'error': 'Insufficient balance'}), 400
-        
-        receiver = conn.execute('SELECT id FROM users WHERE id = ?', (receiver_id,)).fetchone()
-        if not receiver:
-            conn.close()
-            return jsonify({'error': 'Receiver not found'}), 404
-        
-        # Fraud detection
-        sender_wallet_data = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (sender_id,)).fetchone()
-        receiver_wallet_data = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (receiver_id,)).fetchone()
-        
-        transaction_data = {
-            'amount': amount,
-            'oldbalanceOrg': sender_wallet_data['balance'],
-            'newbalanceOrig': sender_wallet_data['balance'] - amount,
-            'oldbalanceDest': receiver_wallet_data['balance'],
-            'newbalanceDest': receiver_wallet_data['balance'] + amount,
-            'type_TRANSFER': 1,
-            'amountToOldBalanceOrg': amount / (sender_wallet_data['balance'] + 1),
-            'amountToOldBalanceDest': amount / (receiver_wallet_data['balance'] + 1),
-            'balanceChangeOrig': -amount,
-            'balanceChangeDest': amount,
-            'hour': datetime.utcnow().hour,
-            'day': datetime.utcnow().day
-        }
-        
-        fraud_result = detect_fraud(transaction_data)
-        
-        if fraud_result['is_fraud'] and fraud_result['confidence'] > 0.7:
-            conn.close()
-            return jsonify({
-                'error': 'Transaction flagged as potentially fraudulent',
-                'reason': fraud_result['reason']
-            }), 400
-        
-        timestamp = datetime.utcnow().isoformat()
-        
-        conn.execute('UPDATE wallets SET balance = balance - ? WHERE user_id = ?', (amount, sender_id))
-        conn.execute('UPDATE wallets SET balance = balance + ? WHERE user_id = ?', (amount, receiver_id))
-        
-        conn.execute('''
-            INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (sender_id, receiver_id, amount, timestamp, 'completed', 'qr_payment', description))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'message': 'QR payment completed successfully',
-            'amount': amount,
-            'timestamp': timestamp,
-            'fraud_check': fraud_result
-        }), 200
-    except Exception as e:
-        return jsonify({'error': f'Invalid QR code data: {str(e)}'}), 400
+        payload = decode_qr_payload(QR_SIGNING_KEY, qr_data)
+    except QRPayloadError as e:
+        return jsonify({'error': e.message}), 400
+    
+    if payload.amount <= 0:
+        return jsonify({'error': 'Invalid amount in QR code'}), 400
+    
+    if sender_id == payload.user_id:
+        return jsonify({'error': 'Cannot send money to yourself'}), 400
+    
+    # Claimed before paying, so two scans racing each other cannot both pay;
+    # handed back if the payment does not go through. Nothing in pay_qr
+    # raises once the transfer has committed (see publish_transfer), so an
+    # exception here always means no money moved
+    if not qr_nonces.claim(payload.nonce, payload.expires_at):
+        return jsonify({'error': 'QR code has already been used'}), 409
+    
+    try:
+        body, status = pay_qr(sender_id, payload)
+    except Exception:
+        qr_nonces.release(payload.nonce)
+        raise
+    if status != 200:
+        qr_nonces.release(payload.nonce)
+    return jsonify(body), status
 
-@app.route('/api/wallet', methods=['GET'])
-@limiter.limit("50 per minute")
-def get_wallet():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Missing or invalid token'}), 401
+def pay_qr(sender_id, payload):
+    receiver_id = payload.user_id
+    amount = payload.amount
+    conn = shard_set.connect(sender_id)
     
-    token = auth_header.split(' ')[1]
-    user_id = verify_token(token)
+    balances = shard_set.get_balances(conn, sender_id, receiver_id)
+    if sender_id not in balances or balances[sender_id] < amount:
+        conn.close()
+        return {'error': 'Insufficient balance'}, 400
     
-    if not user_id:
-        return jsonify({'error': 'Invalid or expired token'}), 401
+    if receiver_id not in balances:
+        conn.close()
+        return {'error': 'Receiver not found'}, 404
+    
+    # Fraud detection
+    transaction_data = transfer_features(amount, balances[sender_id], balances[receiver_id],
+                                         velocity=sender_velocity(sender_id, amount))
+    
+    fraud_result = detect_fraud(transaction_data)
+    
+    if fraud_result['is_fraud'] and fraud_result['confidence'] > 0.7:
+        conn.close()
+        return {
+            'error': 'Transaction flagged as potentially fraudulent',
+            'reason': fraud_result['reason']
+        }, 400
+    
+    generations = balance_cache.generations(sender_id, receiver_id)
+    try:
+        result = shard_set.transfer(conn, sender_id, receiver_id, amount, 'qr_payment', payload.description)
+    except TransferError as e:
+        conn.close()
+        return {'error': e.message}, e.status_code
     
-    conn = get_db_connection()
-    wallet = conn.execute('SELECT * FROM wallets WHERE user_id = ?', (user_id,)).fetchone()
     conn.close()
+    publish_transfer(sender_id, receiver_id, amount, payload.description, result, generations)
+    timestamp = result['timestamp']
     
-    if not wallet:
+    return {
+        'message': 'QR payment completed successfully',
+        'amount': to_major(amount),
+        'timestamp': timestamp,
+        'balance': to_major(result['sender_balance']),
+        'fraud_check': fraud_result
+    }, 200
+
+@app.route('/api/wallet', methods=['GET'])
+@limiter.limit(READ_LIMIT)
+@token_required
+def get_wallet(user_id):
+    as_of = request.args.get('as_of')
+    if as_of:
+        body, status = get_wallet_history(user_id, as_of)
+        return jsonify(body), status
+    
+    wallet = load_wallet(user_id)
+    if wallet is None:
         return jsonify({'error': 'Wallet not found'}), 404
     
-    return jsonify({
-        'balance': wallet['balance'],
-        'wallet_id': wallet['id']
-    }), 200
+    etag = wallet_etag(wallet)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    response = jsonify({
+        'balance': to_major(wallet['balance']),
+        'wallet_id': wallet['wallet_id']
+    })
+    response.set_etag(etag)
+    return response, 200
 
-@app.route('/api/transact', methods=['POST'])
-@limiter.limit("20 per minute")
-def transact():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Missing or invalid token'}), 401
+# The read helpers below take no request state, so asgi.py serves the same
+# routes from coroutines by running them on its DB executor
+def load_wallet(user_id):
+    wallet = balance_cache.get(user_id) if BALANCE_CACHE_ENABLED else None
+    if wallet is None:
+        # Read the generation first so a transfer committing mid-read makes this entry stale
+        generation = balance_cache.generation(user_id)
+        conn = shard_set.connect(user_id)
+        row = conn.execute('SELECT id, balance, version FROM wallets WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        
+        wallet = {'wallet_id': row['id'], 'balance': row['balance'], 'version': row['version']}
+        if BALANCE_CACHE_ENABLED:
+            balance_cache.put(user_id, row['id'], row['balance'], row['version'], generation)
+    return wallet
+
+def wallet_etag(wallet):
+    # The wallet row version changes with every balance write
+    return f"{wallet['wallet_id']}-{wallet['version']}"
+
+def get_wallet_history(user_id, as_of):
+    try:
+        as_of = datetime.fromisoformat(as_of).isoformat()
+    except ValueError:
+        return {'error': 'Invalid as_of timestamp'}, 400
     
-    token = auth_header.split(' ')[1]
-    sender_id = verify_token(token)
+    conn = shard_set.connect(user_id)
+    wallet = conn.execute('SELECT id FROM wallets WHERE user_id = ?', (user_id,)).fetchone()
+    if not wallet:
+        conn.close()
+        return {'error': 'Wallet not found'}, 404
     
-    if not sender_id:
-        return jsonify({'error': 'Invalid or expired token'}), 401
+    # Historical balances come from the ledger: nearest snapshot plus the entries after it
+    balance = balance_at(conn, wallet['id'], as_of)
+    conn.close()
     
+    return {
+        'balance': to_major(balance),
+        'wallet_id': wallet['id'],
+        'as_of': as_of
+    }, 200
+
+@app.route('/api/transact', methods=['POST'])
+@limiter.limit("20 per minute")
+@token_required
+def transact(sender_id):
     data = request.get_json()
     
     if not data or not all(key in data for key in ['receiver_email', 'amount']):
         return jsonify({'error': 'Missing required fields'}), 400
     
     receiver_email = data['receiver_email'].lower().strip()
-    amount = float(data['amount'])
     description = data.get('description', '')
     
+    try:
+        amount = to_minor(data['amount'])
+    except InvalidAmount as e:
+        return jsonify({'error': e.message}), 400
+    
     if amount <= 0:
         return jsonify({'error': 'Amount must be greater than 0'}), 400
     
-    conn = get_db_connection()
+    # Every shard has the users table, so the sender's shard can resolve the receiver
+    conn = shard_set.connect(sender_id)
     
     receiver = conn.execute('SELECT id FROM users WHERE email = ?', (receiver_email,)).fetchone()
     if not receiver:
@@ -423,29 +739,14 @@ def transact():
         conn.close()
         return jsonify({'error': 'Cannot send money to yourself'}), 400
     
-    sender_wallet = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (sender_id,)).fetchone()
-    if not sender_wallet or sender_wallet['balance'] < amount:
+    balances = shard_set.get_balances(conn, sender_id, receiver_id)
+    if sender_id not in balances or balances[sender_id] < amount:
         conn.close()
         return jsonify({'error': 'Insufficient balance'}), 400
     
     # Fraud detection
-    sender_wallet_data = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (sender_id,)).fetchone()
-    receiver_wallet_data = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (receiver_id,)).fetchone()
-    
-    transaction_data = {
-        'amount': amount,
-        'oldbalanceOrg': sender_wallet_data['balance'],
-        'newbalanceOrig': sender_wallet_data['balance'] - amount,
-        'oldbalanceDest': receiver_wallet_data['balance'],
-        'newbalanceDest': receiver_wallet_data['balance'] + amount,
-        'type_TRANSFER': 1,
-        'amountToOldBalanceOrg': amount / (sender_wallet_data['balance'] + 1),
-        'amountToOldBalanceDest': amount / (receiver_wallet_data['balance'] + 1),
-        'balanceChangeOrig': -amount,
-        'balanceChangeDest': amount,
-        'hour': datetime.utcnow().hour,
-        'day': datetime.utcnow().day
-    }
+    transaction_data = transfer_features(amount, balances[sender_id], balances.get(receiver_id, 0),
+                                         velocity=sender_velocity(sender_id, amount))
     
     fraud_result = detect_fraud(transaction_data)
     
@@ -456,73 +757,197 @@ def transact():
             'reason': fraud_result['reason']
         }), 400
     
-    timestamp = datetime.utcnow().isoformat()
-    
-    conn.execute('UPDATE wallets SET balance = balance - ? WHERE user_id = ?', (amount, sender_id))
-    conn.execute('UPDATE wallets SET balance = balance + ? WHERE user_id = ?', (amount, receiver_id))
-    
-    conn.execute('''
-        INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, description)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (sender_id, receiver_id, amount, timestamp, 'completed', description))
+    generations = balance_cache.generations(sender_id, receiver_id)
+    try:
+        result = shard_set.transfer(conn, sender_id, receiver_id, amount, 'transfer', description)
+    except TransferError as e:
+        conn.close()
+        return jsonify({'error': e.message}), e.status_code
     
-    conn.commit()
     conn.close()
+    publish_transfer(sender_id, receiver_id, amount, description, result, generations)
+    timestamp = result['timestamp']
     
     return jsonify({
         'message': 'Transaction completed successfully',
-        'amount': amount,
+        'amount': to_major(amount),
         'timestamp': timestamp,
+        'balance': to_major(result['sender_balance']),
         'fraud_check': fraud_result
     }), 200
 
-@app.route('/api/transactions', methods=['GET'])
-@limiter.limit("50 per minute")
-def get_transactions():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Missing or invalid token'}), 401
+@app.route('/api/transact/batch', methods=['POST'])
+@limiter.limit("10 per minute")
+@token_required
+def transact_batch(sender_id):
+    data = request.get_json()
     
-    token = auth_header.split(' ')[1]
-    user_id = verify_token(token)
+    if not data or not isinstance(data.get('transfers'), list) or not data['transfers']:
+        return jsonify({'error': 'transfers must be a non-empty list'}), 400
     
-    if not user_id:
-        return jsonify({'error': 'Invalid or expired token'}), 401
+    if len(data['transfers']) > BATCH_TRANSFER_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_TRANSFER_MAX_ITEMS} transfers per batch'}), 400
     
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 10))
-    status_filter = request.args.get('status', None)
-    type_filter = request.args.get('type', None)
+    # atomic: every transfer goes through or none does; partial: apply the valid ones
+    mode = data.get('mode', 'atomic')
+    if mode not in ('atomic', 'partial'):
+        return jsonify({'error': 'mode must be atomic or partial'}), 400
     
-    conn = get_db_connection()
+    items = []
+    errors = {}
+    for index, item in enumerate(data['transfers']):
+        if not isinstance(item, dict) or not all(key in item for key in ['receiver_email', 'amount']):
+            errors[index] = 'Missing required fields'
+            continue
+        try:
+            amount = to_minor(item['amount'])
+        except InvalidAmount as e:
+            errors[index] = e.message
+            continue
+        if amount <= 0:
+            errors[index] = 'Amount must be greater than 0'
+            continue
+        items.append({
+            'id': index,
+            'receiver_email': str(item['receiver_email']).lower().strip(),
+            'amount': amount,
+            'description': item.get('description', '')
+        })
     
-    query = '''
-        SELECT t.*, 
-               sender.name as sender_name, sender.email as sender_email,
-               receiver.name as receiver_name, receiver.email as receiver_email
-        FROM transactions t
-        JOIN users sender ON t.sender_id = sender.id
-        JOIN users receiver ON t.receiver_id = receiver.id
-        WHERE t.sender_id = ? OR t.receiver_id = ?
-    '''
-    params = [user_id, user_id]
+    conn = shard_set.connect(sender_id)
     
-    if status_filter:
-        query += ' AND t.status = ?'
-        params.append(status_filter)
+    receiver_ids = resolve_user_ids(conn, {item['receiver_email'] for item in items})
+    candidates = []
+    for item in items:
+        receiver_id = receiver_ids.get(item['receiver_email'])
+        if receiver_id is None:
+            errors[item['id']] = 'Receiver not found'
+        elif receiver_id == sender_id:
+            errors[item['id']] = 'Cannot send money to yourself'
+        else:
+            item['receiver_id'] = receiver_id
+            candidates.append(item)
     
-    if type_filter:
-        query += ' AND t.transaction_type = ?'
-        params.append(type_filter)
+    if errors and mode == 'atomic':
+        conn.close()
+        return batch_transfer_response(data['transfers'], items, errors, {}, mode, None, 400)
     
-    query += ' ORDER BY t.timestamp DESC LIMIT ? OFFSET ?'
-    params.extend([per_page, (page - 1) * per_page])
+    # Balances are read under the write lock, so the plan cannot go stale
+    conn.execute('BEGIN IMMEDIATE')
+    balances = shard_set.get_balances(conn, sender_id, *(item['receiver_id'] for item in candidates))
+    accepted, failed = plan_transfers(candidates, sender_id, balances)
+    errors.update((tx['id'], tx['reason']) for tx in failed)
+    
+    if errors and mode == 'atomic':
+        conn.rollback()
+        conn.close()
+        return batch_transfer_response(data['transfers'], items, errors, {}, mode, None, 400)
+    
+    timestamp = datetime.utcnow().isoformat()
+    transfers = [(item['receiver_id'], item['amount'], item['description'], timestamp) for item in accepted]
+    try:
+        posted = shard_set.apply_transfers(conn, sender_id, transfers, 'batch_transfer')
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': f'Batch transfer failed: {str(e)}'}), 500
+    
+    conn.commit()
+    conn.close()
+    record_velocity(sender_id, posted['transaction_ids'], transfers)
+    if posted['outbox']:
+        shard_set.deliver_pending(sender_id)
+    if BALANCE_CACHE_ENABLED and accepted:
+        balance_cache.invalidate(sender_id, *{item['receiver_id'] for item in accepted})
+    
+    transaction_ids = dict(zip((item['id'] for item in accepted), posted['transaction_ids']))
+    return batch_transfer_response(data['transfers'], items, errors, transaction_ids, mode, posted['sender_balance'], 200)
+
+def batch_transfer_response(transfers, items, errors, transaction_ids, mode, balance, status):
+    # One NDJSON line per requested transfer, in request order, then a summary line
+    amounts = {item['id']: item['amount'] for item in items}
+    
+    def generate():
+        total = 0
+        for index, item in enumerate(transfers):
+            line = {'index': index, 'receiver_email': item.get('receiver_email') if isinstance(item, dict) else None}
+            if index in transaction_ids:
+                total += amounts[index]
+                line.update(status='completed', transaction_id=transaction_ids[index], amount=to_major(amounts[index]))
+            elif index in errors:
+                line.update(status='failed', error=errors[index])
+            else:
+                line.update(status='not_applied')
+            yield json.dumps(line) + '\n'
+        yield json.dumps({'summary': {
+            'mode': mode,
+            'committed': bool(transaction_ids),
+            'completed': len(transaction_ids),
+            'failed': len(errors),
+            'total_amount': to_major(total),
+            'balance': to_major(balance) if balance is not None else None
+        }}) + '\n'
+    
+    return Response(generate(), status=status, mimetype='application/x-ndjson')
+
+@app.route('/api/transactions', methods=['GET'])
+@limiter.limit(READ_LIMIT)
+@token_required
+def get_transactions(user_id):
+    body, status = list_transactions(user_id, request.args)
+    return jsonify(body), status
+
+def list_transactions(user_id, args):
+    page = int(args.get('page', 1))
+    per_page = int(args.get('per_page', 10))
+    status_filter = args.get('status', None)
+    type_filter = args.get('type', None)
+    
+    # Passing `after` (empty for the first page) switches to keyset pagination
+    cursor_mode = 'after' in args
+    after = None
+    if cursor_mode and args['after']:
+        after = decode_cursor(args['after'])
+        if after is None:
+            return {'error': 'Invalid cursor'}, 400
+    
+    filters = ''
+    filter_params = []
+    if status_filter:
+        filters += ' AND status = ?'
+        filter_params.append(status_filter)
+    if type_filter:
+        filters += ' AND transaction_type = ?'
+        filter_params.append(type_filter)
+    
+    conn = shard_set.connect(user_id)
+    
+    if cursor_mode:
+        # Each branch walks one (sender_id|receiver_id, timestamp) index backwards
+        # from the cursor, so the cost does not grow with page depth
+        keyset = ''
+        keyset_params = []
+        if after:
+            keyset = ' AND (timestamp < ? OR (timestamp = ? AND id < ?))'
+            keyset_params = [after[0], after[0], after[1]]
+        query = TRANSACTIONS_KEYSET_QUERY.format(
+            sender_branch=TRANSACTIONS_KEYSET_BRANCH.format(column='sender_id', filters=filters + keyset),
+            receiver_branch=TRANSACTIONS_KEYSET_BRANCH.format(column='receiver_id', filters=filters + keyset)
+        )
+        branch_params = filter_params + keyset_params + [per_page + 1]
+        params = [user_id] + branch_params + [user_id] + branch_params + [per_page + 1]
+    else:
+        query = TRANSACTIONS_OFFSET_QUERY.format(filters=filters.replace(' AND ', ' AND t.'))
+        params = [user_id, user_id] + filter_params + [per_page + 1, (page - 1) * per_page]
     
     transactions = conn.execute(query, params).fetchall()
+    has_more = len(transactions) > per_page
+    transactions = transactions[:per_page]
     
+    # Counters are maintained by triggers on `transactions` (see migrations.py)
     total = conn.execute(
-        'SELECT COUNT(*) FROM transactions WHERE sender_id = ? OR receiver_id = ?',
-        (user_id, user_id)
+        'SELECT COALESCE(SUM(count), 0) FROM transaction_counters WHERE user_id = ?' + filters,
+        [user_id] + filter_params
     ).fetchone()[0]
     
     conn.close()
@@ -531,7 +956,7 @@ def get_transactions():
     for tx in transactions:
         transaction_list.append({
             'id': tx['id'],
-            'amount': tx['amount'],
+            'amount': to_major(tx['amount']),
             'timestamp': tx['timestamp'],
             'status': tx['status'],
             'description': tx['description'],
@@ -541,41 +966,93 @@ def get_transactions():
             'receiver': {'name': tx['receiver_name'], 'email': tx['receiver_email']}
         })
     
-    return jsonify({
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor(transactions[-1]['timestamp'], transactions[-1]['id'])
+    
+    response = {
         'transactions': transaction_list,
         'total': total,
-        'page': page,
         'per_page': per_page,
-        'total_pages': (total + per_page - 1) // per_page
-    }), 200
+        'total_pages': (total + per_page - 1) // per_page,
+        'next_cursor': next_cursor
+    }
+    if not cursor_mode:
+        response['page'] = page
+    
+    return response, 200
+
+@app.route('/api/transactions/export', methods=['GET'])
+@limiter.limit("5 per minute")
+@token_required
+def export_transactions(user_id):
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    
+    # `from` is inclusive, `to` exclusive; both ISO dates or timestamps
+    try:
+        start = datetime.fromisoformat(request.args['from']).isoformat() if request.args.get('from') else ''
+        end = datetime.fromisoformat(request.args['to']).isoformat() if request.args.get('to') else '9999'
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates'}), 400
+    
+    filters = ''
+    filter_params = []
+    if request.args.get('status'):
+        filters += ' AND t.status = ?'
+        filter_params.append(request.args['status'])
+    if request.args.get('type'):
+        filters += ' AND t.transaction_type = ?'
+        filter_params.append(request.args['type'])
+    
+    query = STATEMENT_EXPORT_QUERY.format(filters=filters)
+    params = [user_id, start, end] + filter_params + [user_id, user_id, start, end] + filter_params
+    
+    def generate():
+        # The connection is taken when streaming starts, after the request
+        # context is gone, and held only while rows are being read
+        conn = shard_set.connect(user_id)
+        cursor = conn.execute(query, params)
+        try:
+            if export_format == 'csv':
+                yield ','.join(STATEMENT_COLUMNS) + '\r\n'
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                yield format_statement_rows(rows, export_format)
+        finally:
+            cursor.close()
+            conn.close()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f'statement-{user_id}.{export_format}'
+    return Response(generate(), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/api/offline_transactions', methods=['POST'])
 @limiter.limit("20 per minute")
-def save_offline_transaction():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Missing or invalid token'}), 401
-    
-    token = auth_header.split(' ')[1]
-    sender_id = verify_token(token)
-    
-    if not sender_id:
-        return jsonify({'error': 'Invalid or expired token'}), 401
-    
+@token_required
+def save_offline_transaction(sender_id):
     data = request.get_json()
     
     if not data or not all(key in data for key in ['receiver_email', 'amount', 'qr_data']):
         return jsonify({'error': 'Missing required fields'}), 400
     
     receiver_email = data['receiver_email'].lower().strip()
-    amount = float(data['amount'])
     description = data.get('description', '')
     qr_data = data.get('qr_data')
     
+    try:
+        amount = to_minor(data['amount'])
+    except InvalidAmount as e:
+        return jsonify({'error': e.message}), 400
+    
     if amount <= 0:
         return jsonify({'error': 'Amount must be greater than 0'}), 400
     
-    conn = get_db_connection()
+    # Every shard has the users table, so the sender's shard can resolve the receiver
+    conn = shard_set.connect(sender_id)
     
     receiver = conn.execute('SELECT id FROM users WHERE email = ?', (receiver_email,)).fetchone()
     if not receiver:
@@ -600,77 +1077,45 @@ def save_offline_transaction():
     
     return jsonify({
         'message': 'Offline transaction queued successfully',
-        'amount': amount,
+        'amount': to_major(amount),
         'timestamp': timestamp
     }), 201
 
 @app.route('/api/sync_offline_transactions', methods=['POST'])
 @limiter.limit("20 per minute")
-def sync_offline_transactions():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Missing or invalid token'}), 401
+@token_required
+def sync_offline_transactions(sender_id):
+    conn = shard_set.connect(sender_id)
     
-    token = auth_header.split(' ')[1]
-    sender_id = verify_token(token)
+    # Hold the write lock for the whole sync so the balance snapshot below
+    # cannot be invalidated by a concurrent transfer
+    conn.execute('BEGIN IMMEDIATE')
     
-    if not sender_id:
-        return jsonify({'error': 'Invalid or expired token'}), 401
-    
-    conn = get_db_connection()
+    offline_txs = conn.execute(
+        'SELECT * FROM offline_transactions WHERE sender_id = ? ORDER BY id', (sender_id,)
+    ).fetchall()
+    balances = shard_set.get_balances(conn, sender_id, *(tx['receiver_id'] for tx in offline_txs))
     
-    offline_txs = conn.execute('SELECT * FROM offline_transactions WHERE sender_id = ?', (sender_id,)).fetchall()
+    accepted, failed = plan_transfers(offline_txs, sender_id, balances)
     
-    synced = []
-    failed = []
-    
-    for tx in offline_txs:
-        try:
-            sender_wallet = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (sender_id,)).fetchone()
-            receiver_wallet = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (tx['receiver_id'],)).fetchone()
-            
-            if not sender_wallet or sender_wallet['balance'] < tx['amount']:
-                failed.append({'id': tx['id'], 'reason': 'Insufficient balance'})
-                continue
-            
-            # Fraud detection
-            transaction_data = {
-                'amount': tx['amount'],
-                'oldbalanceOrg': sender_wallet['balance'],
-                'newbalanceOrig': sender_wallet['balance'] - tx['amount'],
-                'oldbalanceDest': receiver_wallet['balance'],
-                'newbalanceDest': receiver_wallet['balance'] + tx['amount'],
-                'type_TRANSFER': 1,
-                'amountToOldBalanceOrg': tx['amount'] / (sender_wallet['balance'] + 1),
-                'amountToOldBalanceDest': tx['amount'] / (receiver_wallet['balance'] + 1),
-                'balanceChangeOrig': -tx['amount'],
-                'balanceChangeDest': tx['amount'],
-                'hour': datetime.utcnow().hour,
-                'day': datetime.utcnow().day
-            }
-            
-            fraud_result = detect_fraud(transaction_data)
-            
-            if fraud_result['is_fraud'] and fraud_result['confidence'] > 0.7:
-                failed.append({'id': tx['id'], 'reason': 'Flagged as fraudulent'})
-                continue
-            
-            conn.execute('UPDATE wallets SET balance = balance - ? WHERE user_id = ?', (tx['amount'], sender_id))
-            conn.execute('UPDATE wallets SET balance = balance + ? WHERE user_id = ?', (tx['amount'], tx['receiver_id']))
-            
-            conn.execute('''
-                INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (sender_id, tx['receiver_id'], tx['amount'], tx['timestamp'], 'completed', 'offline_sync', tx['description']))
-            
-            conn.execute('DELETE FROM offline_transactions WHERE id = ?', (tx['id'],))
-            
-            synced.append({'id': tx['id'], 'amount': tx['amount'], 'timestamp': tx['timestamp']})
-        except Exception as e:
-            failed.append({'id': tx['id'], 'reason': str(e)})
+    transfers = [(tx['receiver_id'], tx['amount'], tx['description'], tx['timestamp']) for tx in accepted]
+    try:
+        posted = shard_set.apply_transfers(conn, sender_id, transfers, 'offline_sync')
+        conn.executemany('DELETE FROM offline_transactions WHERE id = ?', [(tx['id'],) for tx in accepted])
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': f'Offline sync failed: {str(e)}'}), 500
     
     conn.commit()
     conn.close()
+    record_velocity(sender_id, posted['transaction_ids'], transfers)
+    if posted['outbox']:
+        shard_set.deliver_pending(sender_id)
+    if BALANCE_CACHE_ENABLED and accepted:
+        balance_cache.invalidate(sender_id, *{tx['receiver_id'] for tx in accepted})
+    
+    synced = [{'id': tx['id'], 'amount': to_major(tx['amount']), 'timestamp': tx['timestamp']} for tx in accepted]
     
     return jsonify({
         'message': 'Offline transactions synced',
@@ -678,9 +1123,48 @@ def sync_offline_transactions():
         'failed': failed
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled (set METRICS=true)'}), 404
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# Scrape-time gauges from the same stats() /api/health reports
+metrics.register_gauges('wallet_db_pool', 'SQLite connection pool state.', ('stat',), pool_stats)
+metrics.register_gauges('wallet_fraud_batcher', 'Fraud micro-batcher counters.', ('stat',), lambda: fraud_batcher.stats())
+metrics.register_gauges('wallet_shards', 'Shard routing and cross-shard outbox counters.', ('stat',), lambda: shard_set.stats())
+metrics.register_gauges('wallet_velocity', 'Velocity feature store counters.', ('stat',), lambda: velocity_store.stats())
+metrics.register_gauges('wallet_balance_cache', 'Wallet balance cache counters.', ('stat',), lambda: balance_cache.stats())
+metrics.register_gauges('wallet_worker_pool', 'CPU worker pool counters.', ('pool', 'stat'), lambda: {
+    (name, stat): value for name, pool in (('qr', qr_pool), ('auth', auth_pool)) for stat, value in pool.stats().items()
+})
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()}), 200
+    return jsonify(health_report()), 200
+
+def health_report():
+    return {
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'db_pool': pool_stats(),
+        'fraud_model': fraud_model_stats(),
+        'fraud_batcher': fraud_batcher.stats(),
+        'qr_nonces': qr_nonces.stats(),
+        'balance_cache': balance_cache.stats() if BALANCE_CACHE_ENABLED else None,
+        'ledger_snapshots': snapshot_compactor.stats(),
+        'velocity': dict(velocity_store.stats(), sync=velocity_sync.stats()) if VELOCITY_FEATURES else None,
+        'shards': dict(shard_set.stats(), relay=outbox_relay.stats()) if shard_set.count > 1 else None,
+        'worker_pools': {'qr': qr_pool.stats(), 'auth': auth_pool.stats()},
+        'auth': auth_stats(),
+        'rate_limiter': {
+            'enabled': limiter.enabled,
+            'storage': limiter.limiter.storage.stats()
+            if limiter.enabled and hasattr(limiter.limiter.storage, 'stats') else None,
+            'routes': limiter_timings.stats()
+        }
+    }
 
 if __name__ == '__main__':
     init_db()
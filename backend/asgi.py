@@ -0,0 +1,212 @@
+"""ASGI serving mode: ``uvicorn asgi:application --workers 4``.
+
+GET /api/wallet, /api/transactions and /api/health are served by native
+coroutines. The event loop handles the protocol work: parsing requests,
+checking tokens and writing responses. Each request then makes exactly one
+hop to db_executor, a thread pool sized to the SQLite connection pool
+(DB_POOL_SIZE). That hop does the rate-limit hit and the queries, so blocking
+sqlite3 calls never run on the loop and never queue for a connection while
+holding a thread.
+
+Every other route is the Flask app behind asgiref's WsgiToAsgi, unchanged,
+run on wsgi_executor (ASGI_WSGI_THREADS). CPU work there still goes through
+the app's QR/auth worker pools and the fraud batcher.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from limits import parse_many
+
+import app as wallet_app
+from auth import verify_token
+from db import DB_CONFIG, release_thread_connection
+from metrics import METRICS_ENABLED, current_route, observe_request, span
+from ratelimit import limiter_route
+
+DB_THREADS = int(os.getenv('ASGI_DB_THREADS', DB_CONFIG['pool_size']))
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='asgi-db')
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 32))
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread (thread_sensitive), which
+    # serialises the Flask routes and answers the next request on a keep-alive
+    # connection with "would deadlock". The app is thread-safe, so use a pool.
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False,
+                                 executor=wsgi_executor)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+flask_asgi = PooledWsgiToAsgi(wallet_app.app)
+
+_metrics = {'requests': 0, 'in_flight': 0, 'in_flight_max': 0, 'delegated': 0}
+
+
+class AsyncRequest:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        # First value wins, as with request.args.get()
+        self.args = {}
+        for name, value in parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True):
+            self.args.setdefault(name, value)
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else '127.0.0.1'
+
+
+def etag_matches(if_none_match, etag):
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/').strip('"') == etag for tag in tags)
+
+
+def wallet_view(request, user_id):
+    as_of = request.args.get('as_of')
+    if as_of:
+        body, status = wallet_app.get_wallet_history(user_id, as_of)
+        return body, status, []
+
+    wallet = wallet_app.load_wallet(user_id)
+    if wallet is None:
+        return {'error': 'Wallet not found'}, 404, []
+
+    etag = wallet_app.wallet_etag(wallet)
+    headers = [('etag', f'"{etag}"')]
+    if etag_matches(request.headers.get('if-none-match', ''), etag):
+        return None, 304, headers
+    return {'balance': wallet_app.to_major(wallet['balance']), 'wallet_id': wallet['wallet_id']}, 200, headers
+
+
+def transactions_view(request, user_id):
+    body, status = wallet_app.list_transactions(user_id, request.args)
+    return body, status, []
+
+
+def health_view(request, user_id):
+    report = wallet_app.health_report()
+    report['asgi'] = dict(_metrics, db_threads=DB_THREADS, wsgi_threads=WSGI_THREADS)
+    return report, 200, []
+
+
+class AsyncRoute:
+    def __init__(self, endpoint, limits, view, authenticated=True):
+        # Same endpoint names and limits as the Flask routes, so both modes share counters
+        self.endpoint = endpoint
+        self.limits = parse_many(';'.join(limits))
+        self.view = view
+        self.authenticated = authenticated
+
+
+ASYNC_ROUTES = {
+    '/api/wallet': AsyncRoute('get_wallet', [wallet_app.READ_LIMIT], wallet_view),
+    '/api/transactions': AsyncRoute('get_transactions', [wallet_app.READ_LIMIT], transactions_view),
+    '/api/health': AsyncRoute('health_check', wallet_app.DEFAULT_LIMITS, health_view, authenticated=False),
+}
+
+
+def authenticate(request):
+    auth_header = request.headers.get('authorization')
+    if not (auth_header and auth_header.startswith('Bearer ')):
+        return None, 'Missing or invalid token'
+    # Cached tokens are a dict lookup; a miss is one HMAC, cheap enough for the loop
+    with span('auth'), wallet_app.app.app_context():
+        user_id = verify_token(auth_header.split(' ')[1])
+    return user_id, 'Invalid or expired token'
+
+
+def serve(route, request, user_id, auth_error):
+    """Runs on db_executor: rate limit first (as Flask-Limiter does), then the view."""
+    try:
+        if wallet_app.limiter.enabled:
+            for item in route.limits:
+                if not wallet_app.limiter.limiter.hit(item, request.remote_addr, route.endpoint):
+                    return {'error': f'Rate limit exceeded: {item}'}, 429, []
+        if route.authenticated and not user_id:
+            return {'error': auth_error}, 401, []
+        return route.view(request, user_id)
+    finally:
+        # Same clean-up Flask's teardown does for a handler that leaked a connection
+        release_thread_connection()
+
+
+async def run_db(fn, *args):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, partial(context.run, fn, *args))
+
+
+async def send_json(send, request, body, status, headers):
+    payload = b'' if body is None else (json.dumps(body, sort_keys=True, separators=(',', ':')) + '\n').encode()
+    raw_headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    if body is not None:
+        raw_headers += [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    # Mirrors CORS(app, expose_headers=['X-QR-Data'])
+    if 'origin' in request.headers:
+        raw_headers += [(b'access-control-allow-origin', b'*'), (b'access-control-expose-headers', b'X-QR-Data')]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await run_db(wallet_app.init_db)
+            wallet_app.start_background_jobs()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            wallet_app.snapshot_compactor.stop()
+            wallet_app.outbox_relay.stop()
+            wallet_app.velocity_sync.stop()
+            wallet_app.qr_pool.shutdown()
+            wallet_app.auth_pool.shutdown()
+            db_executor.shutdown(wait=False)
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = ASYNC_ROUTES.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    if route is None:
+        _metrics['delegated'] += 1
+        return await flask_asgi(scope, receive, send)
+
+    _metrics['requests'] += 1
+    _metrics['in_flight'] += 1
+    _metrics['in_flight_max'] = max(_metrics['in_flight_max'], _metrics['in_flight'])
+    started = time.perf_counter()
+    try:
+        request = AsyncRequest(scope)
+        limiter_route.set(route.endpoint)
+        current_route.set(scope['path'])
+        user_id, auth_error = authenticate(request) if route.authenticated else (None, None)
+        body, status, headers = await run_db(serve, route, request, user_id, auth_error)
+        await send_json(send, request, body, status, headers)
+        if METRICS_ENABLED:
+            observe_request(scope['path'], 'GET', status, time.perf_counter() - started)
+    finally:
+        _metrics['in_flight'] -= 1
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run('asgi:application', host=os.getenv('HOST', '0.0.0.0'), port=int(os.getenv('PORT', 5000)),
+                workers=int(os.getenv('WEB_CONCURRENCY', 1)))
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+import jwt
+from flask import current_app, jsonify, request
+
+from metrics import METRICS_ENABLED, observe_span
+
+TOKEN_CACHE_ENABLED = os.getenv('AUTH_TOKEN_CACHE', 'true').lower() == 'true'
+
+
+class TokenCache:
+    """Bounded LRU of tokens that already passed full JWT verification.
+
+    Keyed by a SHA-256 digest of the token (the raw token is never stored);
+    each entry remembers the token's ``exp`` and is dropped once it passes,
+    so a cached token is accepted exactly as long as jwt.decode would accept it.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._metrics['misses'] += 1
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._metrics['expirations'] += 1
+                self._metrics['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._metrics['hits'] += 1
+            return user_id
+
+    def put(self, token, user_id, expires_at):
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (user_id, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._metrics['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['misses']
+            return dict(
+                self._metrics,
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                hit_rate=round(self._metrics['hits'] / lookups, 4) if lookups else 0.0,
+            )
+
+
+token_cache = TokenCache(max_entries=int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 1024)))
+_auth_timing = {'requests': 0, 'rejected': 0, 'time_total': 0.0}
+_auth_timing_lock = threading.Lock()
+
+
+def generate_token(user_id):
+    payload = {
+        'user_id': user_id,
+        'exp': datetime.utcnow() + timedelta(hours=24)
+    }
+    return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+
+def decode_token(token):
+    try:
+        return jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        return None
+
+
+def verify_token(token):
+    if TOKEN_CACHE_ENABLED:
+        user_id = token_cache.get(token)
+        if user_id is not None:
+            return user_id
+
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    if TOKEN_CACHE_ENABLED and 'exp' in payload:
+        token_cache.put(token, payload['user_id'], payload['exp'])
+    return payload['user_id']
+
+
+def token_required(f):
+    """Reject the request with 401 unless it carries a valid Bearer token.
+
+    The authenticated user id is passed to the view as its first argument.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        started = time.perf_counter()
+        auth_header = request.headers.get('Authorization')
+        user_id = None
+        error = 'Missing or invalid token'
+        if auth_header and auth_header.startswith('Bearer '):
+            user_id = verify_token(auth_header.split(' ')[1])
+            error = 'Invalid or expired token'
+
+        elapsed = time.perf_counter() - started
+        with _auth_timing_lock:
+            _auth_timing['requests'] += 1
+            _auth_timing['time_total'] += elapsed
+            if not user_id:
+                _auth_timing['rejected'] += 1
+        if METRICS_ENABLED:
+            observe_span('auth', elapsed)
+        if not user_id:
+            return jsonify({'error': error}), 401
+        return f(user_id, *args, **kwargs)
+    return decorated
+
+
+def auth_stats():
+    with _auth_timing_lock:
+        timing = dict(_auth_timing)
+    requests = timing['requests']
+    return {
+        'requests': requests,
+        'rejected': timing['rejected'],
+        'avg_auth_us': round(timing['time_total'] * 1e6 / requests, 2) if requests else 0.0,
+        'token_cache': token_cache.stats() if TOKEN_CACHE_ENABLED else None,
+    }
@@ -0,0 +1,208 @@
+"""Read-through cache for wallet balances with generation-based invalidation.
+
+Every user id maps to a generation slot. Readers note the slot's generation
+*before* reading SQLite and store it with the entry; writers bump the slot
+*after* committing. An entry is only served while its generation is current,
+so a committed transfer can never be followed by a stale read, even when the
+fill raced with the write.
+
+Entries are per-process, so under gunicorn or ``uvicorn --workers`` the
+generation board must be shared: a commit in one worker has to invalidate
+the other workers' entries. Given ``board_path`` the board is a file mapped
+into every process that opens it (the app puts it next to the database, like
+SQLite's own -shm file); given ``shared_name`` it is a POSIX shared-memory
+segment. Only with neither does it live in process memory, which is safe for
+a single process alone.
+"""
+import atexit
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+_GENERATION_SIZE = 8
+
+
+class _LocalBoard:
+    def __init__(self, slots):
+        self.slots = slots
+        self._generations = [0] * slots
+        self._lock = threading.Lock()
+
+    def get(self, slot):
+        return self._generations[slot]
+
+    def bump(self, slots):
+        with self._lock:
+            for slot in slots:
+                self._generations[slot] += 1
+
+
+class _SharedBoard:
+    def __init__(self, name, slots):
+        import fcntl
+        from multiprocessing import resource_tracker, shared_memory
+
+        self.slots = slots
+        self._fcntl = fcntl
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=slots * _GENERATION_SIZE)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # The segment outlives any single worker; don't let the tracker unlink it
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._generations = self._shm.buf.cast('q')
+        atexit.register(self.close)
+        # Increments must not be lost between processes; readers need no lock
+        self._lock_file = open(os.path.join('/tmp', f'{name}.lock'), 'a+')
+        self._thread_lock = threading.Lock()
+
+    def get(self, slot):
+        return self._generations[slot]
+
+    def bump(self, slots):
+        with self._thread_lock:
+            self._fcntl.flock(self._lock_file, self._fcntl.LOCK_EX)
+            try:
+                for slot in slots:
+                    self._generations[slot] += 1
+            finally:
+                self._fcntl.flock(self._lock_file, self._fcntl.LOCK_UN)
+
+    def close(self):
+        self._generations.release()
+        self._shm.close()
+
+
+class _FileBoard:
+    def __init__(self, path, slots):
+        import fcntl
+
+        self.slots = slots
+        self._fcntl = fcntl
+        size = slots * _GENERATION_SIZE
+        # Generations only ever grow, so a board left by an earlier run is as good as a new one
+        self._file = open(path, 'a+b')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._generations = memoryview(self._map).cast('q')
+        self._path = path
+        self._pid = os.getpid()
+        self._thread_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _lock_file(self):
+        # flock() is per open file, and a forked worker shares its parent's;
+        # each process needs its own for bumps to exclude one another
+        if self._pid != os.getpid():
+            self._file = open(self._path, 'a+b')
+            self._pid = os.getpid()
+        return self._file
+
+    def get(self, slot):
+        return self._generations[slot]
+
+    def bump(self, slots):
+        with self._thread_lock:
+            lock_file = self._lock_file()
+            self._fcntl.flock(lock_file, self._fcntl.LOCK_EX)
+            try:
+                for slot in slots:
+                    self._generations[slot] += 1
+            finally:
+                self._fcntl.flock(lock_file, self._fcntl.LOCK_UN)
+
+    def close(self):
+        self._generations.release()
+        self._map.close()
+        self._file.close()
+
+
+class BalanceCache:
+    def __init__(self, max_entries=10000, slots=65536, shared_name=None, board_path=None):
+        self.max_entries = max_entries
+        if shared_name:
+            self._board = _SharedBoard(shared_name, slots)
+        elif board_path:
+            self._board = _FileBoard(board_path, slots)
+        else:
+            self._board = _LocalBoard(slots)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _slot(self, user_id):
+        return user_id % self._board.slots
+
+    def generation(self, user_id):
+        """Read before querying SQLite; pass the result to put()."""
+        return self._board.get(self._slot(user_id))
+
+    def generations(self, *user_ids):
+        return {user_id: self.generation(user_id) for user_id in user_ids}
+
+    def get(self, user_id):
+        """Cached {'wallet_id', 'balance', 'version'} or None."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self._metrics['misses'] += 1
+                return None
+            wallet, generation = entry
+            if generation != self._board.get(self._slot(user_id)):
+                del self._entries[user_id]
+                self._metrics['stale'] += 1
+                self._metrics['misses'] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._metrics['hits'] += 1
+            return wallet
+
+    def put(self, user_id, wallet_id, balance, version, generation):
+        with self._lock:
+            current = self._entries.get(user_id)
+            # Never let a slower writer replace a newer balance
+            if current is not None and current[0]['version'] > version:
+                return
+            self._entries[user_id] = ({'wallet_id': wallet_id, 'balance': balance, 'version': version}, generation)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._metrics['evictions'] += 1
+
+    def invalidate(self, *user_ids):
+        """Call after commit for every wallet the transaction changed."""
+        self._board.bump({self._slot(user_id) for user_id in user_ids})
+        with self._lock:
+            self._metrics['invalidations'] += len(user_ids)
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def write_through(self, wallets, generations):
+        """Publish the committed state of the wallets a transfer changed.
+
+        ``wallets`` is [(user_id, wallet_id, balance, version)] and
+        ``generations`` maps each user id to generation() read before the
+        transaction began. Entries are stored against the generation our own
+        bump produces, so if any other writer touched the slot in between
+        they are born stale and the next read goes to SQLite.
+        """
+        self.invalidate(*(user_id for user_id, _, _, _ in wallets))
+        for user_id, wallet_id, balance, version in wallets:
+            self.put(user_id, wallet_id, balance, version, generations[user_id] + 1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['misses']
+            return dict(
+                self._metrics,
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                shared=not isinstance(self._board, _LocalBoard),
+                hit_rate=round(self._metrics['hits'] / lookups, 4) if lookups else 0.0,
+            )
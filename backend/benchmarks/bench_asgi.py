@@ -0,0 +1,180 @@
+"""Load test: threaded Flask server vs the ASGI serving mode (asgi.py).
+
+Seeds a scratch database with --users wallets and a transaction history,
+then starts each server in turn on this machine:
+
+  threaded  app.run(threaded=True), the current development server
+  asgi      uvicorn asgi:application
+
+and drives each one with --concurrency connections for --duration seconds,
+kept alive where the server allows it. The development server closes after
+every response, so its clients reconnect. The request mix is GET
+/api/wallet, /api/transactions and /api/health. Reports requests/sec and
+p50/p99 latency. The load generator is a single asyncio process on the same
+host, so absolute numbers are a floor; compare the rows. Rate limiting is
+disabled so every request is served.
+
+    python benchmarks/bench_asgi.py --concurrency 8 64 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'threaded': [sys.executable, '-c',
+                 'import os, app; app.app.run(host="127.0.0.1", port=int(os.environ["PORT"]), threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+             '--port', '{port}', '--log-level', 'warning', '--no-access-log'],
+}
+PATHS = ['/api/wallet', '/api/transactions?per_page=20', '/api/transactions?after=', '/api/health']
+
+
+def seed(conn, users, history):
+    now = '2025-01-01T00:00:00'
+    for i in range(users):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'load{i}@example.com', 'x', f'Load {i}', now)
+        ).lastrowid
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)', (user_id, 10 ** 8, now))
+    rng = random.Random(0)
+    conn.executemany('''
+        INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
+        VALUES (?, ?, ?, ?, 'completed', 'transfer', 'load test')
+    ''', (
+        (rng.randint(1, users), rng.randint(1, users), rng.randint(100, 50000), f'2025-01-{1 + i % 28:02d}T{i % 24:02d}:00:00')
+        for i in range(users * history)
+    ))
+    conn.commit()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+async def read_response(reader):
+    version, status = (await reader.readline()).split()[:2]
+    # Werkzeug's development server answers HTTP/1.0 and closes every connection
+    length, close = 0, version == b'HTTP/1.0'
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            close = value.strip().lower() == 'close'
+    await reader.readexactly(length)
+    return status, close
+
+
+async def client(port, tokens, deadline, latencies, errors, rng):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            request = (f'GET {rng.choice(PATHS)} HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                       f'Authorization: Bearer {rng.choice(tokens)}\r\n\r\n').encode()
+            started = time.perf_counter()
+            writer.write(request)
+            status, close = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status != b'200':
+                errors.append(status)
+            if close:
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    finally:
+        writer.close()
+
+
+async def drive(port, tokens, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, tokens, deadline, latencies, errors, random.Random(i)) for i in range(concurrency)
+    ))
+    return latencies, errors, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=50, help='Transactions per user')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_asgi_')
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(scratch, 'bench.db'),
+        RATELIMIT_ENABLED='false',
+        LEDGER_SNAPSHOT_INTERVAL='0',
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'bench-secret'),
+    )
+    os.environ.update(env)
+    sys.path.insert(0, BACKEND_DIR)
+
+    import app as wallet_app
+    from db import get_db_connection
+
+    wallet_app.init_db()
+    conn = get_db_connection()
+    seed(conn, args.users, args.history)
+    conn.close()
+    with wallet_app.app.app_context():
+        tokens = [wallet_app.generate_token(user_id) for user_id in range(1, args.users + 1)]
+
+    print(f'{"server":>10}{"conns":>7}{"requests":>10}{"req/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    for name in args.servers:
+        for concurrency in args.concurrency:
+            port = free_port()
+            command = [part.format(port=port) for part in SERVERS[name]]
+            server = subprocess.Popen(command, cwd=BACKEND_DIR, env=dict(env, PORT=str(port)),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(port)
+                # Warm caches and connection pools before measuring
+                asyncio.run(drive(port, tokens, concurrency, 1.0))
+                latencies, errors, elapsed = asyncio.run(drive(port, tokens, concurrency, args.duration))
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+                    server.wait()
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            print(f'{name:>10}{concurrency:>7}{len(latencies):>10}{len(latencies) / elapsed:>10.0f}'
+                  f'{p50:>9.2f}{p99:>9.2f}{len(errors):>8}')
+
+
+if __name__ == '__main__':
+    main()
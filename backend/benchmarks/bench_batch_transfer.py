@@ -0,0 +1,75 @@
+"""Payroll throughput: /api/transact/batch vs one /api/transact call per payee.
+
+Seeds a scratch database with one employer and N staff wallets, pays every
+staff member through the single-transfer route, then pays them again with
+one batch request, and reports transfers per second for both.
+
+    python benchmarks/bench_batch_transfer.py --sizes 10 100 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench_batch_'), 'bench.db')
+    os.environ.setdefault('BATCH_TRANSFER_MAX_ITEMS', str(max(args.sizes)))
+    sys.path.insert(0, BACKEND_DIR)
+
+    import app as wallet_app
+    from db import get_db_connection
+    from ledger import reconcile
+
+    wallet_app.limiter.enabled = False
+    wallet_app.init_db()
+    conn = get_db_connection()
+    now = '2025-01-01T00:00:00'
+    staff = max(args.sizes)
+    for i in range(staff + 1):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'staff{i}@example.com', 'x', f'Staff {i}', now)
+        ).lastrowid
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
+                     (user_id, 10 ** 12 if i == 0 else 0, now))
+    conn.commit()
+    conn.close()
+    with wallet_app.app.app_context():
+        headers = {'Authorization': f'Bearer {wallet_app.generate_token(1)}'}
+    client = wallet_app.app.test_client()
+
+    print(f'{"payees":>8}{"single s":>12}{"single tx/s":>14}{"batch s":>12}{"batch tx/s":>14}{"speedup":>10}')
+    for size in args.sizes:
+        payees = [{'receiver_email': f'staff{i}@example.com', 'amount': 1500.25, 'description': 'salary'}
+                  for i in range(1, size + 1)]
+
+        started = time.perf_counter()
+        for payee in payees:
+            response = client.post('/api/transact', json=payee, headers=headers)
+            assert response.status_code == 200, response.get_json()
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = client.post('/api/transact/batch', json={'transfers': payees}, headers=headers)
+        lines = response.get_data(as_text=True).splitlines()
+        batched = time.perf_counter() - started
+        assert response.status_code == 200, lines[-1]
+        assert len(lines) == size + 1
+
+        print(f'{size:>8}{single:>12.4f}{size / single:>14.1f}{batched:>12.4f}{size / batched:>14.1f}{single / batched:>9.1f}x')
+
+    conn = get_db_connection()
+    assert not reconcile(conn), 'wallet balances disagree with the ledger'
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Statement export throughput and memory on a large history.
+
+Seeds a scratch database with one merchant and --rows transactions (default
+1M, half sent, half received), then streams /api/transactions/export as CSV
+and NDJSON. Reports rows/sec and the peak RSS growth while streaming, next
+to a fetchall() of the same query for contrast.
+
+    python benchmarks/bench_export.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import psutil
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PeakRSS:
+    """Samples this process's RSS every few ms while the block runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+
+    def __enter__(self):
+        self.baseline = self.peak = self.process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    @property
+    def growth_mb(self):
+        return (self.peak - self.baseline) / 2 ** 20
+
+
+def seed(conn, rows, counterparties):
+    now = '2025-01-01T00:00:00'
+    for i in range(counterparties + 1):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'party{i}@example.com', 'x', f'Party {i}', now)
+        ).lastrowid
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)', (user_id, 0, now))
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1)
+    conn.executemany('''
+        INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
+        VALUES (?, ?, ?, ?, 'completed', 'transfer', 'invoice')
+    ''', (
+        (1, rng.randint(2, counterparties + 1), rng.randint(100, 500000), (start + timedelta(seconds=i * 30)).isoformat())
+        if i % 2 else
+        (rng.randint(2, counterparties + 1), 1, rng.randint(100, 500000), (start + timedelta(seconds=i * 30)).isoformat())
+        for i in range(rows)
+    ))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--counterparties', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench_export_'), 'bench.db')
+    # Memory-mapped database pages count towards RSS; read through the page cache instead
+    os.environ.setdefault('DB_MMAP_SIZE', '0')
+    sys.path.insert(0, BACKEND_DIR)
+
+    import app as wallet_app
+    from db import get_db_connection
+
+    wallet_app.limiter.enabled = False
+    wallet_app.init_db()
+    conn = get_db_connection()
+    started = time.perf_counter()
+    seed(conn, args.rows, args.counterparties)
+    print(f'Seeded {args.rows} transactions in {time.perf_counter() - started:.1f}s')
+    with wallet_app.app.app_context():
+        headers = {'Authorization': f'Bearer {wallet_app.generate_token(1)}'}
+    client = wallet_app.app.test_client()
+
+    print(f'{"mode":>10}{"rows":>10}{"seconds":>10}{"rows/s":>12}{"MB out":>10}{"peak RSS +MB":>15}')
+    for export_format in ('csv', 'ndjson'):
+        with PeakRSS() as rss:
+            started = time.perf_counter()
+            response = client.get(f'/api/transactions/export?format={export_format}', headers=headers, buffered=False)
+            lines = size = 0
+            for chunk in response.response:
+                lines += chunk.count(b'\n')
+                size += len(chunk)
+            response.close()
+            elapsed = time.perf_counter() - started
+        rows = lines - 1 if export_format == 'csv' else lines
+        assert rows == args.rows, f'{rows} rows exported, expected {args.rows}'
+        print(f'{export_format:>10}{rows:>10}{elapsed:>10.2f}{rows / elapsed:>12.0f}{size / 2 ** 20:>10.1f}{rss.growth_mb:>15.1f}')
+
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        query = wallet_app.STATEMENT_EXPORT_QUERY.format(filters='')
+        rows = conn.execute(query, [1, '', '9999', 1, 1, '', '9999']).fetchall()
+        body = wallet_app.format_statement_rows(rows, 'csv')
+        elapsed = time.perf_counter() - started
+    print(f'{"fetchall":>10}{len(rows):>10}{elapsed:>10.2f}{len(rows) / elapsed:>12.0f}'
+          f'{len(body) / 2 ** 20:>10.1f}{rss.growth_mb:>15.1f}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Per-row vs batched fraud scoring throughput.
+
+Uses backend/fraud_model.pkl when present, otherwise trains a RandomForest
+with the same hyperparameters as ml/fraud_detection.ipynb on synthetic data.
+
+    python benchmarks/bench_fraud.py --rows 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fraud import FEATURE_COLUMNS, build_feature_matrix, score_transactions, transfer_features  # noqa: E402
+
+
+def load_or_train_model(path):
+    import joblib
+    if os.path.exists(path):
+        print(f'Using model from {path}')
+        return joblib.load(path)
+
+    from sklearn.ensemble import RandomForestClassifier
+    print('fraud_model.pkl not found; training a notebook-equivalent RandomForest on synthetic data')
+    rng = np.random.default_rng(42)
+    X = rng.random((20000, len(FEATURE_COLUMNS))) * 1000
+    y = (X[:, 0] > X[:, 1] * 0.9).astype(int)
+    model = RandomForestClassifier(n_estimators=100, max_depth=20, min_samples_split=2, random_state=42, n_jobs=-1)
+    model.fit(X, y)
+    return model
+
+
+def synthetic_transactions(count, seed=0):
+    rng = np.random.default_rng(seed)
+    # Minor units, as stored in the database
+    amounts = rng.integers(100, 5000000, count)
+    senders = rng.integers(0, 20000000, count)
+    receivers = rng.integers(0, 20000000, count)
+    return [transfer_features(int(a), int(s), int(r)) for a, s, r in zip(amounts, senders, receivers)]
+
+
+def per_row(model, transactions):
+    # The original detect_fraud(): one-row list, predict() then predict_proba()
+    for tx in transactions:
+        features = build_feature_matrix([tx])
+        model.predict(features)[0]
+        model.predict_proba(features)[0][1]
+
+
+def batched(model, transactions):
+    score_transactions(model, transactions)
+
+
+def timed(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fraud_model.pkl'))
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    model = load_or_train_model(args.model)
+    # sklearn's thread pool only adds overhead for request-sized inputs
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = 1
+    transactions = synthetic_transactions(args.rows)
+
+    # Sanity check: the batched label must match predict() on every row
+    matrix = build_feature_matrix(transactions)
+    expected = model.predict(matrix).astype(bool)
+    got = np.array([result['is_fraud'] for result in score_transactions(model, transactions)])
+    assert (expected == got).all(), 'batched labels diverge from predict()'
+
+    per_row_time = timed(per_row, model, transactions, repeat=args.repeat)
+    batched_time = timed(batched, model, transactions, repeat=args.repeat)
+
+    print(f'{"mode":<10}{"rows":>8}{"seconds":>12}{"rows/sec":>14}')
+    print(f'{"per-row":<10}{args.rows:>8}{per_row_time:>12.4f}{args.rows / per_row_time:>14.1f}')
+    print(f'{"batched":<10}{args.rows:>8}{batched_time:>12.4f}{args.rows / batched_time:>14.1f}')
+    print(f'Speedup: {per_row_time / batched_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
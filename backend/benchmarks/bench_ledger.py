@@ -0,0 +1,105 @@
+"""Concurrency stress test for ledger.transfer().
+
+Hammers a scratch database with random transfers from many threads, then
+checks that no wallet went negative, that money was conserved, that every
+successful transfer left exactly one transactions row and that the ledger
+entries reconcile with the stored balances.
+
+    python benchmarks/bench_ledger.py --threads 8 --transfers 5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wallets', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--transfers', type=int, default=5000, help='Total transfer attempts')
+    parser.add_argument('--initial-balance', type=int, default=100000, help='Minor units')
+    parser.add_argument('--max-amount', type=int, default=40000, help='Minor units')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_ledger_')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+    os.environ['DB_POOL_SIZE'] = str(args.threads)
+    sys.path.insert(0, BACKEND_DIR)
+
+    from app import init_db
+    from db import get_db_connection, pool_stats
+    from ledger import TransferError, reconcile, transfer
+
+    init_db()
+    conn = get_db_connection()
+    now = '2025-01-01T00:00:00'
+    for i in range(args.wallets):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'bench{i}@example.com', 'x', f'Bench {i}', now)
+        ).lastrowid
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
+                     (user_id, args.initial_balance, now))
+    conn.commit()
+    user_ids = [row['user_id'] for row in conn.execute('SELECT user_id FROM wallets')]
+    conn.close()
+
+    counts = {'ok': 0, 'rejected': 0}
+    counts_lock = threading.Lock()
+    per_thread = args.transfers // args.threads
+
+    def worker(seed):
+        rng = random.Random(seed)
+        ok = rejected = 0
+        for _ in range(per_thread):
+            sender_id, receiver_id = rng.sample(user_ids, 2)
+            amount = rng.randint(100, args.max_amount)
+            conn = get_db_connection()
+            try:
+                transfer(conn, sender_id, receiver_id, amount)
+                ok += 1
+            except TransferError:
+                rejected += 1
+            finally:
+                conn.close()
+        with counts_lock:
+            counts['ok'] += ok
+            counts['rejected'] += rejected
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = get_db_connection()
+    min_balance, total = conn.execute('SELECT MIN(balance), SUM(balance) FROM wallets').fetchone()
+    recorded = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+    mismatches = reconcile(conn)
+    conn.close()
+
+    attempts = counts['ok'] + counts['rejected']
+    print(f'{attempts} attempts from {args.threads} threads in {elapsed:.2f}s')
+    print(f'  completed: {counts["ok"]} ({counts["ok"] / elapsed:.1f} transfers/sec)')
+    print(f'  rejected (insufficient balance): {counts["rejected"]}')
+    print(f'  min balance: {min_balance}, total: {total}, transactions rows: {recorded}')
+    print(f'  pool: {pool_stats()}')
+
+    expected_total = args.wallets * args.initial_balance
+    assert min_balance >= 0, f'overdraft detected: min balance {min_balance}'
+    assert total == expected_total, f'money not conserved: {total} != {expected_total}'
+    assert recorded == counts['ok'], f'{recorded} transaction rows for {counts["ok"]} completed transfers'
+    assert not mismatches, f'wallet balances disagree with the ledger: {mismatches}'
+    print('OK: no overdrafts, balances conserved, ledger reconciles')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Point-in-time balance queries as the ledger grows.
+
+Appends synthetic postings to a scratch database in stages (default up to
+3 million entries), runs the snapshot compactor after each stage, and times
+ledger.balance_at() for the current balance and for random historical
+timestamps. With snapshots the cost tracks the snapshot interval, not the
+history length; the full-history SUM is timed alongside for comparison.
+
+    python benchmarks/bench_ledger_history.py --stages 10000 100000 1000000 3000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EPOCH = datetime(2025, 1, 1)
+
+
+def posted_at(entry_id):
+    return (EPOCH + timedelta(seconds=entry_id)).strftime('%Y-%m-%dT%H:%M:%S.000')
+
+
+def append_entries(conn, start, count, wallets, rng):
+    conn.executemany('''
+        INSERT INTO ledger_entries (id, wallet_id, transaction_id, entry_type, amount, posted_at)
+        VALUES (?, ?, NULL, 'adjustment', ?, ?)
+    ''', (
+        (entry_id, rng.randint(1, wallets), rng.randint(-5000, 5000), posted_at(entry_id))
+        for entry_id in range(start, start + count)
+    ))
+    conn.commit()
+
+
+def timed_us(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1e6
+
+
+def full_scan_balance(conn, wallet_id, as_of):
+    return conn.execute(
+        'SELECT COALESCE(SUM(amount), 0) FROM ledger_entries WHERE wallet_id = ? AND posted_at <= ?',
+        (wallet_id, as_of)
+    ).fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', type=int, nargs='+', default=[10000, 100000, 1000000, 3000000],
+                        help='Total ledger entries after each stage')
+    parser.add_argument('--wallets', type=int, default=100)
+    parser.add_argument('--snapshot-every', type=int, default=1000,
+                        help='Entries per wallet between snapshots (LEDGER_SNAPSHOT_MIN_ENTRIES)')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench_history_'), 'bench.db')
+    sys.path.insert(0, BACKEND_DIR)
+
+    from app import init_db
+    from db import get_db_connection
+    from ledger import balance_at, snapshot_balances
+
+    init_db()
+    conn = get_db_connection()
+    now = EPOCH.isoformat()
+    for i in range(args.wallets):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'bench{i}@example.com', 'x', f'Bench {i}', now)
+        ).lastrowid
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)', (user_id, 0, now))
+    conn.commit()
+
+    rng = random.Random(0)
+    total = 0
+    print(f'{"entries":>10}{"snapshots":>11}{"snap pass s":>13}{"current us":>12}'
+          f'{"historical us":>15}{"full scan us":>14}')
+    for target in args.stages:
+        append_entries(conn, total + 1, target - total, args.wallets, rng)
+        total = target
+
+        started = time.perf_counter()
+        snapshot_balances(conn, args.snapshot_every)
+        snapshot_pass = time.perf_counter() - started
+        snapshots = conn.execute('SELECT COUNT(*) FROM ledger_snapshots').fetchone()[0]
+
+        wallet_ids = [rng.randint(1, args.wallets) for _ in range(args.queries)]
+        points = [posted_at(rng.randint(1, total)) for _ in range(args.queries)]
+
+        current_us = timed_us(lambda: [balance_at(conn, w) for w in wallet_ids])
+        historical_us = timed_us(lambda: [balance_at(conn, w, t) for w, t in zip(wallet_ids, points)])
+        sample = min(args.queries, 20)
+        scan_us = timed_us(lambda: [full_scan_balance(conn, w, t) for w, t in zip(wallet_ids[:sample], points)])
+
+        for wallet_id, point in zip(wallet_ids[:sample], points):
+            expected = full_scan_balance(conn, wallet_id, point)
+            assert balance_at(conn, wallet_id, point) == expected, (wallet_id, point)
+
+        print(f'{total:>10}{snapshots:>11}{snapshot_pass:>13.3f}{current_us / args.queries:>12.1f}'
+              f'{historical_us / args.queries:>15.1f}{scan_us / sample:>14.1f}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+"""Reproducible load test for the wallet API, with JSON results to compare runs.
+
+Seeds a scratch database, which is never sme_wallet.db, with --users users
+and wallets and --history transactions per user. Every user gets the same
+password hash. The script then starts one server and drives it with
+--concurrency keep-alive connections, each sending a weighted mix of
+operations:
+
+  login         POST /api/login
+  wallet        GET  /api/wallet
+  transactions  GET  /api/transactions
+  transact      POST /api/transact          (small amounts, random receiver)
+  generate_qr   POST /api/generate_qr
+  sync_offline  POST /api/offline_transactions, then
+                POST /api/sync_offline_transactions
+
+Each connection draws its operations from its own seeded RNG, so a given
+--seed and --mix replay the same request sequence. --requests fixes the
+amount of work. Without it the run lasts --duration seconds. The server
+runs with RATELIMIT_ENABLED=false and METRICS=true. /metrics is scraped
+before and after the measured run, which gives DB lock wait (the
+db.lock_wait span, i.e. BEGIN IMMEDIATE), pool wait and SQLite busy errors
+for exactly that window.
+
+The report has throughput, p50/p95/p99 and error counts per endpoint and
+overall. --output writes it as JSON. --compare checks a run against an
+earlier JSON file and exits 1 when an endpoint's throughput or p99 is worse
+by more than --tolerance.
+
+    python benchmarks/bench_load.py --concurrency 16 --requests 20000 --output base.json
+    python benchmarks/bench_load.py --concurrency 16 --requests 20000 --compare base.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from bench_asgi import SERVERS, free_port, read_response, wait_for_port
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_VERSION = 1
+PASSWORD = 'bench-password'
+DEFAULT_MIX = 'wallet=35,transactions=20,transact=20,generate_qr=10,sync_offline=10,login=5'
+SPANS = ('db.lock_wait', 'db.pool_wait', 'db.commit')
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}; choose from {", ".join(OPERATIONS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def seed(conn, users, history, seed_value):
+    from werkzeug.security import generate_password_hash
+
+    password_hash = generate_password_hash(PASSWORD)
+    now = '2025-01-01T00:00:00'
+    conn.executemany(
+        'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+        ((f'load{i}@example.com', password_hash, f'Load {i}', now) for i in range(users))
+    )
+    conn.executemany(
+        'INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
+        ((user_id, 10 ** 12, now) for user_id in range(1, users + 1))
+    )
+    rng = random.Random(seed_value)
+    conn.executemany('''
+        INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
+        VALUES (?, ?, ?, ?, 'completed', 'transfer', 'load test')
+    ''', (
+        (rng.randint(1, users), rng.randint(1, users), rng.randint(100, 50000), f'2025-01-{1 + i % 28:02d}T{i % 24:02d}:00:00')
+        for i in range(users * history)
+    ))
+    conn.commit()
+
+
+class Client:
+    def __init__(self, port, token, user_index, users, rng, latencies, statuses):
+        self.port = port
+        self.token = token
+        self.user_index = user_index
+        self.users = users
+        self.rng = rng
+        self.latencies = latencies
+        self.statuses = statuses
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    async def request(self, endpoint, method, path, body=None):
+        payload = b'' if body is None else json.dumps(body).encode()
+        head = (f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                f'Authorization: Bearer {self.token}\r\n')
+        if body is not None:
+            head += f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n'
+        started = time.perf_counter()
+        self.writer.write(head.encode() + b'\r\n' + payload)
+        status, close = await read_response(self.reader)
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+        statuses = self.statuses.setdefault(endpoint, {})
+        statuses[status.decode()] = statuses.get(status.decode(), 0) + 1
+        if close:
+            # The threaded development server closes after every response
+            self.close()
+            await self.connect()
+
+    def other_user(self):
+        receiver = self.rng.randrange(self.users - 1)
+        return receiver + (receiver >= self.user_index)
+
+
+async def op_login(client):
+    await client.request('login', 'POST', '/api/login',
+                         {'email': f'load{client.user_index}@example.com', 'password': PASSWORD})
+
+
+async def op_wallet(client):
+    await client.request('wallet', 'GET', '/api/wallet')
+
+
+async def op_transactions(client):
+    await client.request('transactions', 'GET', f'/api/transactions?per_page={client.rng.choice([10, 20, 50])}')
+
+
+async def op_transact(client):
+    await client.request('transact', 'POST', '/api/transact', {
+        'receiver_email': f'load{client.other_user()}@example.com',
+        'amount': client.rng.randint(100, 50000) / 100,
+        'description': 'load test',
+    })
+
+
+async def op_generate_qr(client):
+    await client.request('generate_qr', 'POST', '/api/generate_qr', {
+        'amount': client.rng.randint(1, 200) * 50,
+        'description': client.rng.choice(['Lunch', 'Rent', 'Airtime', 'Stock']),
+    })
+
+
+async def op_sync_offline(client):
+    receiver = client.other_user()
+    await client.request('offline_queue', 'POST', '/api/offline_transactions', {
+        'receiver_email': f'load{receiver}@example.com',
+        'amount': client.rng.randint(100, 50000) / 100,
+        'description': 'offline load test',
+        'qr_data': {'user_id': receiver + 1},
+    })
+    await client.request('sync_offline', 'POST', '/api/sync_offline_transactions', {})
+
+
+OPERATIONS = {
+    'login': op_login,
+    'wallet': op_wallet,
+    'transactions': op_transactions,
+    'transact': op_transact,
+    'generate_qr': op_generate_qr,
+    'sync_offline': op_sync_offline,
+}
+
+
+async def drive(port, tokens, mix, concurrency, seed_value, requests=None, duration=None):
+    latencies, statuses = {}, {}
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def run_client(index):
+        # One user per connection, so concurrent transfers contend like real senders
+        user_index = index % len(tokens)
+        client = Client(port, tokens[user_index], user_index, len(tokens), random.Random(seed_value * 1000003 + index),
+                        latencies, statuses)
+        await client.connect()
+        try:
+            done = 0
+            quota = requests // concurrency + (index < requests % concurrency) if requests else None
+            while (quota is None or done < quota) and (deadline is None or time.perf_counter() < deadline):
+                await OPERATIONS[client.rng.choices(names, weights)[0]](client)
+                done += 1
+        finally:
+            client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(index) for index in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def scrape_metrics(port):
+    """Sums of span_duration sum/count per span, and sqlite busy errors, across routes."""
+    async def fetch():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n')
+        data = await reader.read()
+        writer.close()
+        return data.decode().partition('\r\n\r\n')[2]
+
+    text = asyncio.run(fetch())
+    totals = {span: {'sum': 0.0, 'count': 0} for span in SPANS}
+    busy = 0
+    for line in text.splitlines():
+        match = re.match(r'wallet_span_duration_seconds_(sum|count)\{.*span="([^"]+)".*\} (\S+)', line)
+        if match and match.group(2) in totals:
+            totals[match.group(2)][match.group(1)] += float(match.group(3))
+        elif line.startswith('wallet_sqlite_busy_total{'):
+            busy += float(line.rsplit(' ', 1)[1])
+    return totals, busy
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(latencies, statuses, elapsed):
+    def stats(values, codes):
+        values = sorted(values)
+        errors = sum(count for status, count in codes.items() if not status.startswith('2'))
+        return {
+            'requests': len(values),
+            'throughput': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'errors': errors,
+            'statuses': dict(sorted(codes.items())),
+        }
+
+    endpoints = {name: stats(latencies[name], statuses[name]) for name in sorted(latencies)}
+    combined = {}
+    for codes in statuses.values():
+        for status, count in codes.items():
+            combined[status] = combined.get(status, 0) + count
+    overall = stats([value for values in latencies.values() for value in values], combined)
+    return endpoints, overall
+
+
+def db_waits(before, after, busy_before, busy_after, elapsed):
+    waits = {}
+    for span in SPANS:
+        total = after[span]['sum'] - before[span]['sum']
+        count = int(after[span]['count'] - before[span]['count'])
+        key = span.replace('db.', '')
+        waits[key] = {
+            'total_s': round(total, 4),
+            'count': count,
+            'mean_ms': round(total / count * 1000, 3) if count else 0.0,
+            # Share of wall time some request spent waiting, summed over requests
+            'per_second': round(total / elapsed, 4),
+        }
+    waits['sqlite_busy'] = int(busy_after - busy_before)
+    return waits
+
+
+def stop_server(server):
+    # The app's worker pools fork children; stop the whole group so none outlive the run
+    os.killpg(server.pid, signal.SIGTERM)
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    server.wait()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline, tolerance):
+    print(f'\nAgainst {baseline["git"] or "baseline"} ({baseline["created"]}), tolerance {tolerance:.0%}:')
+    print(f'{"endpoint":>14}{"req/s":>10}{"base":>10}{"delta":>9}{"p99 ms":>10}{"base":>10}{"delta":>9}')
+    regressions = []
+    rows = dict(result['endpoints'], overall=result['overall'])
+    base_rows = dict(baseline['endpoints'], overall=baseline['overall'])
+    for name, row in rows.items():
+        base = base_rows.get(name)
+        if base is None:
+            continue
+        throughput = row['throughput'] / base['throughput'] - 1 if base['throughput'] else 0.0
+        p99 = row['p99_ms'] / base['p99_ms'] - 1 if base['p99_ms'] else 0.0
+        flag = ''
+        if throughput < -tolerance or p99 > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:>14}{row["throughput"]:>10.1f}{base["throughput"]:>10.1f}{throughput:>+9.1%}'
+              f'{row["p99_ms"]:>10.2f}{base["p99_ms"]:>10.2f}{p99:>+9.1%}{flag}')
+    lock, base_lock = result['db']['lock_wait'], baseline['db']['lock_wait']
+    print(f'{"lock wait":>14} mean {lock["mean_ms"]:.3f} ms vs {base_lock["mean_ms"]:.3f} ms, '
+          f'{lock["per_second"]:.3f} vs {base_lock["per_second"]:.3f} s/s')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', default='threaded', choices=list(SERVERS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, help='Total operations to run (default: run for --duration)')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of load before measuring')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=20, help='Seeded transactions per user')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f'Operation weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON')
+    parser.add_argument('--compare', help='Earlier --output file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+    mix = args.mix
+
+    scratch = tempfile.mkdtemp(prefix='bench_load_')
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(scratch, 'bench.db'),
+        RATELIMIT_ENABLED='false',
+        METRICS='true',
+        LEDGER_SNAPSHOT_INTERVAL='0',
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'bench-secret'),
+    )
+    os.environ.update(env)
+    sys.path.insert(0, BACKEND_DIR)
+
+    import app as wallet_app
+    from db import get_db_connection
+
+    print(f'Seeding {args.users} users and {args.users * args.history} transactions in {scratch}')
+    wallet_app.init_db()
+    conn = get_db_connection()
+    seed(conn, args.users, args.history, args.seed)
+    conn.close()
+    with wallet_app.app.app_context():
+        tokens = [wallet_app.generate_token(user_id) for user_id in range(1, args.users + 1)]
+
+    port = free_port()
+    command = [part.format(port=port) for part in SERVERS[args.server]]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=dict(env, PORT=str(port)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_for_port(port)
+        if args.warmup:
+            asyncio.run(drive(port, tokens, mix, args.concurrency, args.seed + 1, duration=args.warmup))
+        before, busy_before = scrape_metrics(port)
+        latencies, statuses, elapsed = asyncio.run(drive(
+            port, tokens, mix, args.concurrency, args.seed, requests=args.requests,
+            duration=None if args.requests else args.duration,
+        ))
+        after, busy_after = scrape_metrics(port)
+    finally:
+        stop_server(server)
+
+    endpoints, overall = summarize(latencies, statuses, elapsed)
+    result = {
+        'version': RESULTS_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': dict(vars(args), mix=mix, output=None, compare=None),
+        'elapsed_s': round(elapsed, 3),
+        'endpoints': endpoints,
+        'overall': overall,
+        'db': db_waits(before, after, busy_before, busy_after, elapsed),
+    }
+
+    print(f'{args.server} server, {args.concurrency} connections, {elapsed:.1f}s')
+    print(f'{"endpoint":>14}{"requests":>10}{"req/s":>10}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    for name, row in dict(endpoints, overall=overall).items():
+        print(f'{name:>14}{row["requests"]:>10}{row["throughput"]:>10.1f}{row["p50_ms"]:>9.2f}'
+              f'{row["p95_ms"]:>9.2f}{row["p99_ms"]:>9.2f}{row["errors"]:>8}')
+    for name, wait in result['db'].items():
+        if isinstance(wait, dict):
+            print(f'{name:>14} n={wait["count"]}, mean {wait["mean_ms"]:.3f} ms, {wait["total_s"]:.3f}s total')
+    print(f'{"sqlite busy":>14} {result["db"]["sqlite_busy"]}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'Wrote {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('config', {}).get('mix') != mix or baseline.get('config', {}).get('concurrency') != args.concurrency:
+            print('Warning: baseline was run with a different mix or concurrency')
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Cost of the /metrics instrumentation, off vs on.
+
+Runs the same request loop with METRICS=false and METRICS=true in fresh
+interpreters (the switch is read at import). The loop is GET /api/wallet
+with the balance cache off, so every request does auth and a query, plus
+POST /api/transact, which adds the write lock, commit and fraud spans.
+Reports microseconds per request. A bare span() enter/exit is timed too.
+
+    python benchmarks/bench_metrics.py --requests 5000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_requests(count):
+    sys.path.insert(0, BACKEND_DIR)
+    import app as wallet_app
+    from db import get_db_connection
+    from metrics import span
+
+    wallet_app.limiter.enabled = False
+    wallet_app.init_db()
+    conn = get_db_connection()
+    now = '2025-01-01T00:00:00'
+    for i in range(2):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'metrics{i}@example.com', 'x', f'Metrics {i}', now)
+        ).lastrowid
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)', (user_id, 10 ** 12, now))
+    conn.commit()
+    conn.close()
+    with wallet_app.app.app_context():
+        headers = {'Authorization': f'Bearer {wallet_app.generate_token(1)}'}
+    client = wallet_app.app.test_client()
+
+    results = {}
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get('/api/wallet', headers=headers)
+    results['wallet_us'] = (time.perf_counter() - started) / count * 1e6
+
+    transfers = max(count // 5, 1)
+    started = time.perf_counter()
+    for _ in range(transfers):
+        client.post('/api/transact', json={'receiver_email': 'metrics1@example.com', 'amount': 1}, headers=headers)
+    results['transact_us'] = (time.perf_counter() - started) / transfers * 1e6
+
+    started = time.perf_counter()
+    for _ in range(100000):
+        with span('bench'):
+            pass
+    results['span_ns'] = (time.perf_counter() - started) / 100000 * 1e9
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_requests(args.run)
+        return
+
+    print(f'{"METRICS":>8}{"wallet us":>11}{"transact us":>13}{"span() ns":>11}')
+    for enabled in ('false', 'true'):
+        env = dict(os.environ, METRICS=enabled, BALANCE_CACHE='false', LEDGER_SNAPSHOT_INTERVAL='0',
+                   DATABASE_PATH=os.path.join(tempfile.mkdtemp(prefix='bench_metrics_'), 'bench.db'))
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', str(args.requests)],
+                                cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f'{enabled:>8}{result["wallet_us"]:>11.1f}{result["transact_us"]:>13.1f}{result["span_ns"]:>11.0f}')
+
+
+if __name__ == '__main__':
+    main()
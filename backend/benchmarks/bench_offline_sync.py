@@ -0,0 +1,108 @@
+"""Offline sync throughput: set-based pipeline vs the original per-row loop.
+
+For each queue size, seeds a scratch database with that many queued offline
+transfers and times POST /api/sync_offline_transactions against a replay of
+the pre-batching loop (two SELECTs, one fraud call, two UPDATEs, one INSERT
+and one DELETE per row).
+
+    python benchmarks/bench_offline_sync.py --sizes 10 100 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_sync(conn, sender_id, detect_fraud, transfer_features):
+    offline_txs = conn.execute('SELECT * FROM offline_transactions WHERE sender_id = ?', (sender_id,)).fetchall()
+    synced = failed = 0
+    for tx in offline_txs:
+        sender_wallet = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (sender_id,)).fetchone()
+        receiver_wallet = conn.execute('SELECT balance FROM wallets WHERE user_id = ?', (tx['receiver_id'],)).fetchone()
+        if not sender_wallet or sender_wallet['balance'] < tx['amount']:
+            failed += 1
+            continue
+        fraud_result = detect_fraud(transfer_features(tx['amount'], sender_wallet['balance'], receiver_wallet['balance']))
+        if fraud_result['is_fraud'] and fraud_result['confidence'] > 0.7:
+            failed += 1
+            continue
+        conn.execute('UPDATE wallets SET balance = balance - ? WHERE user_id = ?', (tx['amount'], sender_id))
+        conn.execute('UPDATE wallets SET balance = balance + ? WHERE user_id = ?', (tx['amount'], tx['receiver_id']))
+        conn.execute('''
+            INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (sender_id, tx['receiver_id'], tx['amount'], tx['timestamp'], 'completed', 'offline_sync', tx['description']))
+        conn.execute('DELETE FROM offline_transactions WHERE id = ?', (tx['id'],))
+        synced += 1
+    conn.commit()
+    return synced, failed
+
+
+def seed(conn, size, receivers, rng):
+    conn.execute('DELETE FROM offline_transactions')
+    conn.execute('UPDATE wallets SET balance = 100000000')
+    conn.executemany('''
+        INSERT INTO offline_transactions (sender_id, receiver_id, amount, timestamp, description, qr_data)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        (1, rng.choice(receivers), rng.randint(100, 15000), f'2025-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}', 'bench', '')
+        for i in range(size)
+    ])
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 10000])
+    parser.add_argument('--receivers', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench_sync_'), 'bench.db')
+    sys.path.insert(0, BACKEND_DIR)
+
+    import app as wallet_app
+    from db import get_db_connection
+    from fraud import transfer_features
+
+    wallet_app.limiter.enabled = False
+    wallet_app.init_db()
+    conn = get_db_connection()
+    now = '2025-01-01T00:00:00'
+    for i in range(args.receivers + 1):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'bench{i}@example.com', 'x', f'Bench {i}', now)
+        ).lastrowid
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)', (user_id, 0, now))
+    conn.commit()
+    conn.close()
+    receivers = list(range(2, args.receivers + 2))
+    with wallet_app.app.app_context():
+        token = wallet_app.generate_token(1)
+    client = wallet_app.app.test_client()
+
+    print(f'{"queued":>8}{"legacy s":>12}{"legacy rows/s":>16}{"batched s":>12}{"batched rows/s":>16}{"speedup":>10}')
+    for size in args.sizes:
+        conn = get_db_connection()
+        seed(conn, size, receivers, random.Random(size))
+        started = time.perf_counter()
+        legacy_sync(conn, 1, wallet_app.detect_fraud, transfer_features)
+        legacy = time.perf_counter() - started
+
+        seed(conn, size, receivers, random.Random(size))
+        conn.close()
+        started = time.perf_counter()
+        response = client.post('/api/sync_offline_transactions', headers={'Authorization': f'Bearer {token}'})
+        batched = time.perf_counter() - started
+        assert response.status_code == 200, response.get_json()
+        assert len(response.get_json()['synced']) + len(response.get_json()['failed']) == size
+
+        print(f'{size:>8}{legacy:>12.4f}{size / legacy:>16.1f}{batched:>12.4f}{size / batched:>16.1f}{legacy / batched:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
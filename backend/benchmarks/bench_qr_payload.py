@@ -0,0 +1,85 @@
+"""Signed QR payloads (qr.py) vs the original str(dict) / eval() format.
+
+For a few descriptions, times building and parsing one payload each way,
+then reports the payload length, the QR version qrcode picks for it (each
+version is 4 modules wider, so lower renders faster and scans from further
+away) and the PNG and SVG render time. The legacy payload is the dict
+generate_qr used to build, rendered with str() and read back with eval().
+
+    python benchmarks/bench_qr_payload.py --iterations 20000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qr import decode_qr_payload, encode_qr_payload, qr_signing_key, render_qr  # noqa: E402
+
+DESCRIPTIONS = ['', 'Lunch', 'Invoice 2025-0042 for stock supplies']
+
+
+def legacy_encode(user_id, amount, expires_at, description):
+    return str({
+        'user_id': user_id,
+        'amount': amount / 100,
+        'description': description,
+        'timestamp': datetime.utcfromtimestamp(expires_at).isoformat()
+    })
+
+
+def legacy_decode(text):
+    return eval(text)
+
+
+def per_call(fn, iterations, *args):
+    best = float('inf')
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e6
+
+
+def qr_version(payload):
+    import qrcode
+
+    qr = qrcode.QRCode(box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.version
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--renders', type=int, default=50)
+    args = parser.parse_args()
+
+    key = qr_signing_key('benchmark secret')
+    user_id, amount = 48213, 1250050
+    expires_at = int(time.time()) + 300
+
+    print(f'{"description":<12}{"format":<8}{"encode µs":>11}{"decode µs":>11}{"chars":>7}{"version":>9}'
+          f'{"png ms":>9}{"svg ms":>9}')
+    for description in DESCRIPTIONS:
+        formats = {
+            'legacy': (lambda: legacy_encode(user_id, amount, expires_at, description), legacy_decode),
+            'signed': (lambda: encode_qr_payload(key, user_id, amount, expires_at, description),
+                       lambda text: decode_qr_payload(key, text)),
+        }
+        for name, (encode, decode) in formats.items():
+            payload = encode()
+            encode_us = per_call(encode, args.iterations)
+            decode_us = per_call(decode, args.iterations, payload)
+            png_ms = per_call(render_qr, args.renders, payload, 'png') / 1000
+            svg_ms = per_call(render_qr, args.renders, payload, 'svg') / 1000
+            print(f'{len(description.encode()):>4} bytes   {name:<8}{encode_us:>11.2f}{decode_us:>11.2f}{len(payload):>7}'
+                  f'{qr_version(payload):>9}{png_ms:>9.2f}{svg_ms:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
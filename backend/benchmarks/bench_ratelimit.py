@@ -0,0 +1,79 @@
+"""Rate-limit check latency and cross-worker enforcement.
+
+Drives the sliding-window-counter strategy directly, the way Flask-Limiter
+does for each request, against memory:// and the SQLite storage from
+ratelimit.py. Each of --workers processes hammers --clients distinct keys
+(think client IPs), flat out or paced to --rate checks/s each; the report shows per-check p50/p99
+latency, aggregate checks per second, and how many hits were granted on one
+hot key whose limit is --limit. Per-process memory counters grant
+limit * workers; the shared SQLite counters grant the limit.
+
+    python benchmarks/bench_ratelimit.py --workers 1 4 8 --checks 20000
+    python benchmarks/bench_ratelimit.py --workers 8 --rate 1000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_worker(uri, checks, clients, limit, rate):
+    sys.path.insert(0, BACKEND_DIR)
+    import ratelimit  # noqa: F401 registers sqlite://
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import SlidingWindowCounterRateLimiter
+
+    strategy = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    route = parse('1000000 per minute')
+    hot = parse(f'{limit} per minute')
+    latencies = []
+    loop_started = time.perf_counter()
+    for i in range(checks):
+        if rate:
+            delay = loop_started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        started = time.perf_counter()
+        strategy.hit(route, f'10.0.{i % clients // 256}.{i % 256}', 'transact')
+        latencies.append(time.perf_counter() - started)
+    elapsed = time.perf_counter() - loop_started
+    granted = sum(strategy.hit(hot, 'hot-client', 'login') for _ in range(limit * 2))
+    return latencies, elapsed, granted
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--checks', type=int, default=20000, help='Checks per worker')
+    parser.add_argument('--clients', type=int, default=5000, help='Distinct keys per worker')
+    parser.add_argument('--rate', type=float, default=0, help='Checks/s per worker (0 = unthrottled)')
+    parser.add_argument('--limit', type=int, default=100, help='Limit on the shared hot key')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_ratelimit_')
+    print(f'{"storage":>10}{"workers":>9}{"checks/s":>12}{"p50 us":>9}{"p99 us":>9}{"hot key granted":>17}')
+    for workers in args.workers:
+        for name in ('memory', 'sqlite'):
+            uri = 'memory://' if name == 'memory' else f'sqlite:///{scratch}/ratelimit-{workers}.db'
+            with multiprocessing.Pool(workers) as pool:
+                collected = pool.starmap(run_worker, [(uri, args.checks, args.clients, args.limit, args.rate)] * workers)
+            # Workers run concurrently; throughput is bounded by the slowest one
+            elapsed = max(worker_elapsed for _, worker_elapsed, _ in collected)
+            latencies = sorted(latency for worker_latencies, _, _ in collected for latency in worker_latencies)
+            granted = sum(worker_granted for _, _, worker_granted in collected)
+            print(f'{name:>10}{workers:>9}{len(latencies) / elapsed:>12.0f}'
+                  f'{percentile(latencies, 0.5) * 1e6:>9.1f}{percentile(latencies, 0.99) * 1e6:>9.1f}'
+                  f'{granted:>11}/{args.limit:<5}')
+
+
+if __name__ == '__main__':
+    main()
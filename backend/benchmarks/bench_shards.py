@@ -0,0 +1,140 @@
+"""Transfer throughput as the number of shards grows.
+
+For each shard count, seeds a scratch set of shard files with --users funded
+wallets, then starts --processes writer processes that call
+ShardSet.transfer() between random pairs of users for --duration seconds, as
+/api/transact does after its checks (HTTP, auth and fraud scoring are left
+out so the storage layer is what is measured). With N shards about (N-1)/N
+of the pairs cross shards and go through the outbox; --local-share picks
+that share of receivers from the sender's own shard instead (customers
+banked next to the merchants they pay).
+
+SQLite lets one writer at a time into a file, so with one shard every
+commit, and its WAL sync under DB_SYNCHRONOUS=FULL, queues behind the
+others; with N shards up to N commits are in flight at once. Reports
+transfers per second, the cross-shard share and "database is locked" errors.
+
+    python benchmarks/bench_shards.py --shards 1 2 4 --processes 8 --duration 10
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(users):
+    sys.path.insert(0, BACKEND_DIR)
+    import app as wallet_app
+
+    wallet_app.init_db()
+    shards = wallet_app.shard_set
+    conn = shards.connect_shard(0)
+    now = '2025-01-01T00:00:00'
+    for i in range(users):
+        user_id = conn.execute(
+            'INSERT INTO users (email, password, name, created_at) VALUES (?, ?, ?, ?)',
+            (f'shard{i}@example.com', 'x', f'Shard {i}', now)
+        ).lastrowid
+        shards.add_user(conn, user_id, f'shard{i}@example.com', f'Shard {i}', now)
+    conn.commit()
+    conn.close()
+    for shard in range(shards.count):
+        shard_conn = shards.connect_shard(shard)
+        shard_conn.execute('UPDATE wallets SET balance = ?', (10 ** 12,))
+        shard_conn.commit()
+        shard_conn.close()
+
+
+def run_writer(users, start_at, duration, seed_value, local_share):
+    sys.path.insert(0, BACKEND_DIR)
+    import sqlite3
+
+    from shards import shard_set as shards
+
+    shards.load_map()
+    rng = random.Random(seed_value)
+    by_shard = {}
+    for user_id in range(1, users + 1):
+        by_shard.setdefault(shards.shard_of(user_id), []).append(user_id)
+    pairs = []
+    while len(pairs) < 4096:
+        sender_id, receiver_id = rng.sample(range(1, users + 1), 2)
+        if local_share is not None and rng.random() < local_share:
+            receiver_id = rng.choice(by_shard[shards.shard_of(sender_id)])
+        if receiver_id != sender_id:
+            pairs.append((sender_id, receiver_id))
+    done = cross = busy = 0
+    time.sleep(max(start_at - time.time(), 0))
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        sender_id, receiver_id = pairs[done % len(pairs)]
+        conn = shards.connect(sender_id)
+        try:
+            shards.transfer(conn, sender_id, receiver_id, 1)
+        except sqlite3.OperationalError:
+            # busy_timeout ran out waiting for the write lock
+            busy += 1
+            continue
+        finally:
+            conn.close()
+        done += 1
+        cross += shards.shard_of(sender_id) != shards.shard_of(receiver_id)
+    print(json.dumps({'transfers': done, 'cross_shard': cross, 'busy': busy}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--local-share', type=float,
+                        help='Share of transfers kept within the sender\'s shard (default: uniform pairs)')
+    parser.add_argument('--synchronous', default='FULL', help='DB_SYNCHRONOUS for the run (default FULL)')
+    parser.add_argument('--seed', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--writer', nargs=3, type=float, metavar=('USERS', 'START_AT', 'SEED'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+        return
+    if args.writer:
+        users, start_at, seed_value = args.writer
+        run_writer(int(users), start_at, args.duration, int(seed_value), args.local_share)
+        return
+
+    print(f'{args.processes} writer processes, {args.users} users, {args.duration:.0f}s, '
+          f'DB_SYNCHRONOUS={args.synchronous}')
+    print(f'{"shards":>7}{"transfers/s":>13}{"speed-up":>10}{"cross-shard":>13}{"busy":>7}')
+    baseline = None
+    for count in args.shards:
+        env = dict(os.environ, DB_SHARDS=str(count), DB_SYNCHRONOUS=args.synchronous, LEDGER_SNAPSHOT_INTERVAL='0',
+                   BALANCE_CACHE='false', DATABASE_PATH=os.path.join(tempfile.mkdtemp(prefix='bench_shards_'), 'bench.db'))
+        script = os.path.abspath(__file__)
+        subprocess.run([sys.executable, script, '--seed', str(args.users)], cwd=BACKEND_DIR, env=env, check=True)
+        # Writers start together once they have all imported
+        start_at = time.time() + 3
+        writers = [
+            subprocess.Popen([sys.executable, script, '--duration', str(args.duration),
+                              '--writer', str(args.users), str(start_at), str(index + 1)]
+                             + (['--local-share', str(args.local_share)] if args.local_share is not None else []),
+                             cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, text=True)
+            for index in range(args.processes)
+        ]
+        results = [json.loads(writer.communicate()[0].strip().splitlines()[-1]) for writer in writers]
+        transfers = sum(result['transfers'] for result in results)
+        throughput = transfers / args.duration
+        baseline = baseline or throughput
+        cross = sum(result['cross_shard'] for result in results) / max(transfers, 1)
+        busy = sum(result['busy'] for result in results)
+        print(f'{count:>7}{throughput:>13.0f}{throughput / baseline:>9.2f}x{cross:>13.0%}{busy:>7}')
+
+
+if __name__ == '__main__':
+    main()
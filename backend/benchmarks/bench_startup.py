@@ -0,0 +1,119 @@
+"""Start-up time and per-worker memory: fast start vs APP_PRELOAD.
+
+Import time: runs `import app` in fresh interpreters and reports the median
+wall time and RSS. It also reports how long the first fraud-scored request
+then takes, because in fast-start mode that request loads the model.
+
+Workers: imports app in a master process, forks --workers children the way
+`gunicorn --preload` does, has each child score a transfer, and reports each
+child's private (USS) and proportional (PSS) memory while all of them are
+alive. With APP_PRELOAD=true the model pages are loaded once and shared;
+in fast-start mode every worker unpickles its own copy.
+
+Uses backend/fraud_model.pkl when present, otherwise a synthetic
+notebook-equivalent RandomForest (see bench_fraud.py).
+
+    python benchmarks/bench_startup.py --runs 5 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import psutil
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {'fast-start': 'false', 'preload': 'true'}
+
+IMPORT_PROBE = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+import psutil
+rss = psutil.Process().memory_info().rss
+started = time.perf_counter()
+app.detect_fraud(app.transfer_features(500000, 10000000, 2000000))
+first_score = time.perf_counter() - started
+print(json.dumps({'import_s': imported, 'rss': rss, 'first_score_s': first_score}))
+'''
+
+
+def probe_import(env):
+    output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def worker(barrier, results):
+    import app
+    app.detect_fraud(app.transfer_features(500000, 10000000, 2000000))
+    # Measure only once every sibling is alive and has loaded what it needs
+    barrier.wait()
+    memory = psutil.Process().memory_full_info()
+    results.put({'uss': memory.uss, 'pss': memory.pss, 'rss': memory.rss})
+    barrier.wait()
+
+
+def measure_workers(workers):
+    """Runs inside a fresh interpreter with APP_PRELOAD already set."""
+    sys.path.insert(0, BACKEND_DIR)
+    import app  # noqa: F401 the "master" import, as under gunicorn --preload
+
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    children = [context.Process(target=worker, args=(barrier, results)) for _ in range(workers)]
+    for child in children:
+        child.start()
+    stats = [results.get() for _ in children]
+    for child in children:
+        child.join()
+    print(json.dumps(stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--measure-workers', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure_workers:
+        measure_workers(args.measure_workers)
+        return
+
+    scratch = tempfile.mkdtemp(prefix='bench_startup_')
+    env = dict(os.environ, DATABASE_PATH=os.path.join(scratch, 'bench.db'), LEDGER_SNAPSHOT_INTERVAL='0')
+    if not os.path.exists(os.path.join(BACKEND_DIR, 'fraud_model.pkl')) and 'FRAUD_MODEL_PATH' not in env:
+        import joblib
+        from bench_fraud import load_or_train_model
+        env['FRAUD_MODEL_PATH'] = os.path.join(scratch, 'fraud_model.pkl')
+        model = load_or_train_model(env['FRAUD_MODEL_PATH'])
+        model.n_jobs = 1
+        joblib.dump(model, env['FRAUD_MODEL_PATH'])
+
+    print(f'{"mode":>12}{"import ms":>11}{"RSS MB":>9}{"1st score ms":>14}'
+          f'{"worker USS MB":>15}{"worker PSS MB":>15}{"total PSS MB":>14}')
+    for mode, preload in MODES.items():
+        mode_env = dict(env, APP_PRELOAD=preload)
+        probes = [probe_import(mode_env) for _ in range(args.runs)]
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure-workers', str(args.workers)],
+                                cwd=BACKEND_DIR, env=mode_env, capture_output=True, text=True, check=True).stdout
+        workers = json.loads(output.strip().splitlines()[-1])
+        mb = 2 ** 20
+        print(f'{mode:>12}'
+              f'{statistics.median(p["import_s"] for p in probes) * 1000:>11.0f}'
+              f'{statistics.median(p["rss"] for p in probes) / mb:>9.1f}'
+              f'{statistics.median(p["first_score_s"] for p in probes) * 1000:>14.1f}'
+              f'{statistics.mean(w["uss"] for w in workers) / mb:>15.1f}'
+              f'{statistics.mean(w["pss"] for w in workers) / mb:>15.1f}'
+              f'{sum(w["pss"] for w in workers) / mb:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
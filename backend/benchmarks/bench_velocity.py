@@ -0,0 +1,122 @@
+"""Velocity feature store (velocity.py): update, lookup and rebuild cost.
+
+Seeds a scratch database with --users wallets and --history transfers
+spread over the last --days days, then measures:
+
+- record(): folding one committed transfer into the store;
+- features(): the read the scoring path does per transfer;
+- the rebuild: VelocityStore.sync() streaming the whole history;
+- for comparison, the same three features computed with SQL per request
+  (transfers in the last hour, distinct receivers today, mean and variance
+  of log(amount) over the sender's history), as detect_fraud() would need
+  without the store.
+
+    python benchmarks/bench_velocity.py --users 2000 --history 200000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(conn, users, history, days, rng):
+    now = datetime.utcnow()
+    created = now.isoformat()
+    conn.executemany('INSERT INTO users (id, email, password, name, created_at) VALUES (?, ?, ?, ?, ?)',
+                     [(i, f'velocity{i}@example.com', 'x', f'Velocity {i}', created) for i in range(1, users + 1)])
+    conn.executemany('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
+                     [(i, 10 ** 12, created) for i in range(1, users + 1)])
+    rows = []
+    for _ in range(history):
+        sender_id, receiver_id = rng.sample(range(1, users + 1), 2)
+        moment = now - timedelta(seconds=rng.random() * days * 86400)
+        rows.append((sender_id, receiver_id, int(rng.lognormvariate(10, 1.5)) + 1, moment.isoformat()))
+    # In time order, as they would have been posted
+    rows.sort(key=lambda row: row[3])
+    conn.executemany('''
+        INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type)
+        VALUES (?, ?, ?, ?, 'completed', 'transfer')
+    ''', rows)
+    conn.commit()
+    return rows
+
+
+def sql_features(conn, sender_id, amount, now):
+    hour_ago = (now - timedelta(hours=1)).isoformat()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+    hourly = conn.execute(
+        'SELECT COUNT(*) FROM transactions WHERE sender_id = ? AND timestamp >= ?', (sender_id, hour_ago)
+    ).fetchone()[0]
+    receivers = conn.execute(
+        'SELECT COUNT(DISTINCT receiver_id) FROM transactions WHERE sender_id = ? AND timestamp >= ?',
+        (sender_id, midnight)
+    ).fetchone()[0]
+    amounts = [math.log(row[0]) for row in conn.execute(
+        'SELECT amount FROM transactions WHERE sender_id = ? ORDER BY id', (sender_id,))]
+    mean = sum(amounts) / len(amounts) if amounts else 0.0
+    variance = sum((value - mean) ** 2 for value in amounts) / len(amounts) if amounts else 0.0
+    zscore = (math.log(amount) - mean) / max(math.sqrt(variance), 0.5) if len(amounts) >= 20 else 0.0
+    return hourly, receivers, zscore
+
+
+def per_call(fn, calls):
+    started = time.perf_counter()
+    for args in calls:
+        fn(*args)
+    return (time.perf_counter() - started) / len(calls) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--history', type=int, default=200000)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench_velocity_'), 'bench.db')
+    os.environ['DB_SHARDS'] = '1'
+    sys.path.insert(0, BACKEND_DIR)
+    import app as wallet_app
+    from velocity import VelocityStore
+
+    wallet_app.init_db()
+    rng = random.Random(42)
+    conn = wallet_app.get_db_connection()
+    started = time.perf_counter()
+    seed(conn, args.users, args.history, args.days, rng)
+    print(f'Seeded {args.users} users, {args.history} transfers over {args.days:.0f} days '
+          f'in {time.perf_counter() - started:.1f}s')
+
+    store = VelocityStore()
+    started = time.perf_counter()
+    folded = store.sync(conn, 0)
+    rebuild = time.perf_counter() - started
+    print(f'Rebuild: {folded} transfers in {rebuild * 1000:.0f} ms ({folded / rebuild:,.0f} rows/s), '
+          f'{store.stats()["senders"]} senders')
+
+    now = datetime.utcnow()
+    lookups = [(rng.randint(1, args.users), int(rng.lognormvariate(10, 1.5)) + 1) for _ in range(args.lookups)]
+    timestamp = now.isoformat()
+    records = [(0, args.history + index + 1, sender_id, rng.randint(1, args.users), amount, timestamp)
+               for index, (sender_id, amount) in enumerate(lookups)]
+    record_us = per_call(store.record, records)
+    features_us = per_call(store.features, lookups)
+    sql_calls = lookups[:max(args.lookups // 20, 100)]
+    sql_us = per_call(lambda sender_id, amount: sql_features(conn, sender_id, amount, now), sql_calls)
+    conn.close()
+
+    print(f'{"":<28}{"µs/call":>10}')
+    print(f'{"record() per transfer":<28}{record_us:>10.2f}')
+    print(f'{"features() per lookup":<28}{features_us:>10.2f}')
+    print(f'{"SQL per lookup":<28}{sql_us:>10.2f}  ({sql_us / features_us:,.0f}x features())')
+
+
+if __name__ == '__main__':
+    main()
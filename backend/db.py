@@ -0,0 +1,264 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS_ENABLED, observe_span, record_sqlite_error
+
+# Database configuration (overridable through environment variables)
+DB_CONFIG = {
+    'path': os.getenv('DATABASE_PATH', 'sme_wallet.db'),
+    'pool_size': int(os.getenv('DB_POOL_SIZE', 8)),
+    'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 5.0)),
+    'busy_timeout_ms': int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000)),
+    'journal_mode': os.getenv('DB_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.getenv('DB_CACHE_SIZE', -16000)),
+    'mmap_size': int(os.getenv('DB_MMAP_SIZE', 268435456)),
+    'statement_cache_size': int(os.getenv('DB_STATEMENT_CACHE_SIZE', 256)),
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """Thin proxy around a pooled sqlite3 connection.
+
+    Handlers keep calling ``conn.close()`` as before; closing hands the
+    connection back to the pool instead of tearing it down.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._depth = 0
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        self._pool.release(self)
+
+
+class InstrumentedConnection(PooledConnection):
+    """PooledConnection that reports statement, commit and write-lock timings.
+
+    Only used with METRICS=true. BEGIN IMMEDIATE is timed as db.lock_wait,
+    since that is where a writer waits out busy_timeout for the lock.
+    """
+
+    def _timed(self, method, sql, *args):
+        head = sql.lstrip()[:15].upper()
+        name = 'db.lock_wait' if head.startswith('BEGIN') else 'db.commit' if head.startswith('COMMIT') else 'db.execute'
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        except sqlite3.OperationalError as e:
+            record_sqlite_error(e, name)
+            raise
+        finally:
+            observe_span(name, time.perf_counter() - started)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(self._raw.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(self._raw.executemany, sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self._raw.commit()
+        except sqlite3.OperationalError as e:
+            record_sqlite_error(e, 'db.commit')
+            raise
+        finally:
+            observe_span('db.commit', time.perf_counter() - started)
+
+
+class ConnectionPool:
+    def __init__(self, path, pool_size=8, timeout=5.0, busy_timeout_ms=5000,
+                 journal_mode='WAL', synchronous='NORMAL', cache_size=-16000,
+                 mmap_size=268435456, statement_cache_size=256):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._local = threading.local()
+        self._all = []
+        self._metrics = {
+            'created': 0,
+            'acquired': 0,
+            'reused_by_thread': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+        }
+
+    def _connect(self):
+        # cached_statements keeps compiled statements around per connection,
+        # so the same SQL text is only prepared once for the pool's lifetime.
+        raw = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        raw.row_factory = sqlite3.Row
+        raw.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        raw.execute(f'PRAGMA synchronous={self.synchronous}')
+        raw.execute(f'PRAGMA cache_size={self.cache_size}')
+        raw.execute(f'PRAGMA mmap_size={self.mmap_size}')
+        raw.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+        raw.execute('PRAGMA temp_store=MEMORY')
+        self._metrics['created'] += 1
+        conn = (InstrumentedConnection if METRICS_ENABLED else PooledConnection)(self, raw)
+        self._all.append(conn)
+        return conn
+
+    def acquire(self):
+        # A thread that already holds a connection gets the same one back,
+        # so helpers called from inside a request share its transaction.
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            held._depth += 1
+            self._metrics['reused_by_thread'] += 1
+            return held
+
+        started = time.perf_counter()
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO keeps the most recently used (warmest) connection busy
+                    conn = self._idle.pop()
+                    break
+                if len(self._all) < self.pool_size:
+                    conn = self._connect()
+                    break
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No database connection available after {self.timeout}s '
+                        f'(pool_size={self.pool_size})'
+                    )
+                self._cond.wait(remaining)
+
+            self._metrics['acquired'] += 1
+            if waited:
+                elapsed = time.perf_counter() - started
+                self._metrics['waits'] += 1
+                self._metrics['wait_time_total'] += elapsed
+                self._metrics['wait_time_max'] = max(self._metrics['wait_time_max'], elapsed)
+                if METRICS_ENABLED:
+                    observe_span('db.pool_wait', elapsed)
+
+        conn._depth = 1
+        self._local.conn = conn
+        return conn
+
+    def release(self, conn):
+        if getattr(self._local, 'conn', None) is conn:
+            conn._depth -= 1
+            if conn._depth > 0:
+                return
+            self._local.conn = None
+
+        # Never hand a connection with a half-finished transaction to the next caller
+        if conn._raw.in_transaction:
+            conn._raw.rollback()
+
+        with self._cond:
+            if conn not in self._idle:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def release_thread_connection(self):
+        """Return whatever the current thread still holds, e.g. after an exception."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn._depth = 1
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            for conn in self._all:
+                conn._raw.close()
+            self._all.clear()
+            self._idle.clear()
+        self._local = threading.local()
+
+    def stats(self):
+        with self._cond:
+            acquired = self._metrics['acquired']
+            return {
+                'pool_size': self.pool_size,
+                'open': len(self._all),
+                'idle': len(self._idle),
+                'in_use': len(self._all) - len(self._idle),
+                'created': self._metrics['created'],
+                'acquired': acquired,
+                'reused_by_thread': self._metrics['reused_by_thread'],
+                'waits': self._metrics['waits'],
+                'timeouts': self._metrics['timeouts'],
+                'wait_time_total_ms': round(self._metrics['wait_time_total'] * 1000, 3),
+                'wait_time_avg_ms': round(self._metrics['wait_time_total'] * 1000 / acquired, 3) if acquired else 0.0,
+                'wait_time_max_ms': round(self._metrics['wait_time_max'] * 1000, 3),
+            }
+
+
+# Every pool opened through open_pool(), so request teardown can return the
+# connections a thread holds in any of them (see shards.py)
+pools = []
+
+
+def open_pool(path):
+    opened = ConnectionPool(
+        path,
+        pool_size=DB_CONFIG['pool_size'],
+        timeout=DB_CONFIG['pool_timeout'],
+        busy_timeout_ms=DB_CONFIG['busy_timeout_ms'],
+        journal_mode=DB_CONFIG['journal_mode'],
+        synchronous=DB_CONFIG['synchronous'],
+        cache_size=DB_CONFIG['cache_size'],
+        mmap_size=DB_CONFIG['mmap_size'],
+        statement_cache_size=DB_CONFIG['statement_cache_size'],
+    )
+    pools.append(opened)
+    return opened
+
+
+pool = open_pool(DB_CONFIG['path'])
+
+
+def get_db_connection():
+    return pool.acquire()
+
+
+def release_thread_connection(exc=None):
+    for opened in pools:
+        opened.release_thread_connection()
+
+
+def pool_stats():
+    return pool.stats()
@@ -0,0 +1,204 @@
+"""Flat, array-backed evaluator for the RandomForest fraud model.
+
+``export_forest`` flattens every tree of a fitted RandomForestClassifier into
+contiguous arrays (feature, threshold, left/right child, leaf probability)
+and writes them to an uncompressed ``.npz``. ``CompiledForest`` scores rows
+straight from those arrays, optionally memory-mapped, without unpickling
+sklearn objects or going through its input validation.
+
+    python forest.py fraud_model.pkl fraud_model.npz
+"""
+import argparse
+import zipfile
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def export_forest(model, path):
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    positive = list(model.classes_).index(1)
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        left = tree.children_left.astype(np.int32)
+        right = tree.children_right.astype(np.int32)
+        is_leaf = left == -1
+
+        # Same normalisation DecisionTreeClassifier.predict_proba applies
+        value = tree.value[:, 0, :].astype(np.float64)
+        normalizer = value.sum(axis=1)
+        normalizer[normalizer == 0.0] = 1.0
+        value = value[:, positive] / normalizer
+
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, -1, left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, -1, right + offset).astype(np.int32))
+        values.append(value)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    # Raw-column caps set by ml/train.py travel with the trees
+    extra = {}
+    if getattr(model, 'feature_caps_', None) is not None:
+        extra['feature_caps'] = np.asarray(model.feature_caps_, dtype=np.float64)
+
+    np.savez(
+        path,
+        version=np.array(FORMAT_VERSION),
+        n_features=np.array(model.n_features_in_),
+        max_depth=np.array(max_depth),
+        roots=np.array(roots, dtype=np.int64),
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts),
+        right=np.concatenate(rights),
+        value=np.concatenate(values),
+        **extra,
+    )
+
+
+def _mmap_npz(path):
+    # np.load ignores mmap_mode for .npz archives. Members written by np.savez
+    # are stored uncompressed, so each .npy payload can be mapped in place.
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as raw:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{path}: {info.filename} is compressed and cannot be memory-mapped')
+            raw.seek(info.header_offset)
+            local_header = raw.read(30)
+            name_length = int.from_bytes(local_header[26:28], 'little')
+            extra_length = int.from_bytes(local_header[28:30], 'little')
+            raw.seek(info.header_offset + 30 + name_length + extra_length)
+            major, _ = np.lib.format.read_magic(raw)
+            if major == 1:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(raw)
+            name = info.filename[:-len('.npy')]
+            if shape == ():
+                arrays[name] = np.frombuffer(raw.read(dtype.itemsize), dtype=dtype).reshape(())
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=raw.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
+class CompiledForest:
+    classes_ = np.array([0, 1])
+    feature_caps_ = None
+
+    def __init__(self, arrays):
+        if int(arrays['version']) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled forest version {int(arrays['version'])}")
+        self.n_features_in_ = int(arrays['n_features'])
+        self.max_depth = int(arrays['max_depth'])
+        self.roots = np.asarray(arrays['roots'])
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        if 'feature_caps' in arrays:
+            self.feature_caps_ = np.asarray(arrays['feature_caps'])
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        if mmap:
+            return cls(_mmap_npz(path))
+        with np.load(path) as archive:
+            return cls({name: archive[name] for name in archive.files})
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def fraud_probability(self, X):
+        # sklearn evaluates splits on float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f'Expected input of shape (n, {self.n_features_in_}), got {X.shape}')
+
+        n_rows, n_trees = X.shape[0], len(self.roots)
+        flat_X = X.ravel()
+        # One slot per (row, tree) pair; only pairs still on an internal node
+        # are advanced, so the work shrinks as paths reach their leaves
+        nodes = np.tile(self.roots, n_rows)
+        row_offset = np.repeat(np.arange(n_rows) * self.n_features_in_, n_trees)
+        active = np.arange(n_rows * n_trees)
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            left = self.left[current]
+            internal = left != -1
+            active, current, left = active[internal], current[internal], left[internal]
+            if not active.size:
+                break
+            go_left = flat_X[row_offset[active] + self.feature[current]] <= self.threshold[current]
+            nodes[active] = np.where(go_left, left, self.right[current])
+
+        # Accumulate tree by tree, in estimator order, exactly like RandomForest.predict_proba
+        leaf_values = self.value[nodes].reshape(n_rows, n_trees)
+        total = np.zeros(n_rows, dtype=np.float64)
+        for tree in range(leaf_values.shape[1]):
+            total += leaf_values[:, tree]
+        return total / len(self.roots)
+
+    def predict_proba(self, X):
+        positive = self.fraud_probability(X)
+        return np.column_stack([1.0 - positive, positive])
+
+    def predict(self, X):
+        return (self.fraud_probability(X) > 0.5).astype(np.int64)
+
+
+def verify(model, compiled, X):
+    """True when the compiled forest reproduces predict_proba bit for bit on X."""
+    # With n_jobs != 1, predict_proba adds up the trees in whatever order the
+    # threads finish, which is not bit-identical; the compiled forest sums
+    # them in estimator order, as a single thread does
+    n_jobs = getattr(model, 'n_jobs', None)
+    if n_jobs is not None:
+        model.n_jobs = 1
+    try:
+        expected = model.predict_proba(X)[:, list(model.classes_).index(1)]
+    finally:
+        if n_jobs is not None:
+            model.n_jobs = n_jobs
+    return np.array_equal(expected, compiled.fraud_probability(X))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='Path to the joblib-pickled RandomForestClassifier')
+    parser.add_argument('output', help='Path of the .npz file to write')
+    parser.add_argument('--verify-rows', type=int, default=10000,
+                        help='Random rows to check against predict_proba (0 to skip)')
+    args = parser.parse_args()
+
+    import joblib
+    model = joblib.load(args.model)
+    export_forest(model, args.output)
+    compiled = CompiledForest.load(args.output)
+    print(f'Exported {compiled.n_estimators} trees, {len(compiled.feature)} nodes to {args.output}')
+
+    if args.verify_rows:
+        rng = np.random.default_rng(0)
+        X = rng.lognormal(mean=8, sigma=3, size=(args.verify_rows, compiled.n_features_in_))
+        X[rng.random(X.shape) < 0.2] = 0.0
+        # Put some values exactly on split thresholds to exercise the <= boundary
+        internal = np.flatnonzero(np.asarray(compiled.left) != -1)
+        picked = rng.choice(internal, size=args.verify_rows)
+        X[np.arange(args.verify_rows), compiled.feature[picked]] = compiled.threshold[picked]
+        if not verify(model, compiled, X):
+            raise SystemExit('Compiled forest does not match predict_proba')
+        print(f'Verified bit-for-bit against predict_proba on {args.verify_rows} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from metrics import record_error
+from money import to_major
+from velocity import velocity_result
+
+logger = logging.getLogger(__name__)
+
+# Column order the fraud model was trained on
+FEATURE_COLUMNS = [
+    'amount',
+    'oldbalanceOrg',
+    'newbalanceOrig',
+    'oldbalanceDest',
+    'newbalanceDest',
+    'type_TRANSFER',
+    'type_PAYMENT',
+    'type_CASH_OUT',
+    'type_CASH_IN',
+    'amountToOldBalanceOrg',
+    'amountToOldBalanceDest',
+    'balanceChangeOrig',
+    'balanceChangeDest',
+    'hour',
+    'day',
+]
+
+# predict() on a binary RandomForest picks class 1 only when its probability
+# beats class 0, i.e. p(fraud) > 0.5; deriving the label from the same
+# probabilities saves the second forest traversal.
+LABEL_THRESHOLD = 0.5
+
+
+# PaySim columns the features are derived from, in naira
+RAW_COLUMNS = ['amount', 'oldbalanceOrg', 'newbalanceOrig', 'oldbalanceDest', 'newbalanceDest']
+TYPE_COLUMNS = ['type_TRANSFER', 'type_PAYMENT', 'type_CASH_OUT', 'type_CASH_IN']
+INPUT_COLUMNS = RAW_COLUMNS + TYPE_COLUMNS + ['hour', 'day']
+
+
+def transfer_features(amount, sender_balance, receiver_balance, now=None, velocity=None):
+    """Raw model inputs for a transfer; takes minor units, the model was trained on naira.
+
+    ``velocity`` is VelocityStore.features() for the sender; the model does
+    not read those keys, the velocity rules in score_transactions() do.
+    """
+    amount, sender_balance, receiver_balance = to_major(amount), to_major(sender_balance), to_major(receiver_balance)
+    now = now or datetime.utcnow()
+    return {
+        'amount': amount,
+        'oldbalanceOrg': sender_balance,
+        'newbalanceOrig': sender_balance - amount,
+        'oldbalanceDest': receiver_balance,
+        'newbalanceDest': receiver_balance + amount,
+        'type_TRANSFER': 1,
+        'hour': now.hour,
+        'day': now.day,
+        **(velocity or {})
+    }
+
+
+def engineer_features(columns, caps=None):
+    """(N, 15) float64 matrix in FEATURE_COLUMNS order from INPUT_COLUMNS arrays.
+
+    Serving (build_feature_matrix) and training (ml/train.py) both call this,
+    so there is one definition of every derived feature. ``caps`` is the
+    model's ``feature_caps_``: per-column upper bounds, aligned with
+    FEATURE_COLUMNS, applied to the raw columns before ratios are taken.
+    """
+    # Only needed once a model is loaded; keeps numpy out of app start-up
+    import numpy as np
+
+    values = {name: np.asarray(columns[name], dtype=np.float64) for name in INPUT_COLUMNS}
+    if caps is not None:
+        for name in RAW_COLUMNS:
+            values[name] = np.minimum(values[name], caps[FEATURE_COLUMNS.index(name)])
+    values['amountToOldBalanceOrg'] = values['amount'] / (values['oldbalanceOrg'] + 1)
+    values['amountToOldBalanceDest'] = values['amount'] / (values['oldbalanceDest'] + 1)
+    values['balanceChangeOrig'] = values['newbalanceOrig'] - values['oldbalanceOrg']
+    values['balanceChangeDest'] = values['newbalanceDest'] - values['oldbalanceDest']
+    return np.column_stack([values[name] for name in FEATURE_COLUMNS])
+
+
+def build_feature_matrix(transactions, caps=None):
+    now = datetime.utcnow()
+    defaults = {'hour': now.hour, 'day': now.day}
+    columns = {
+        name: [tx.get(name, defaults.get(name, 0)) for tx in transactions]
+        for name in INPUT_COLUMNS
+    }
+    return engineer_features(columns, caps)
+
+
+def rule_based_result(amount):
+    if amount > 100000:
+        return {'is_fraud': True, 'confidence': 0.8, 'reason': 'Large amount'}
+    elif amount <= 0:
+        return {'is_fraud': True, 'confidence': 0.9, 'reason': 'Invalid amount'}
+    else:
+        return {'is_fraud': False, 'confidence': 0.1, 'reason': 'Normal transaction'}
+
+
+def with_velocity(transaction, result):
+    # A tripped velocity rule wins unless the result already flags with more confidence
+    flagged = velocity_result(transaction)
+    if flagged is None or (result['is_fraud'] and result['confidence'] >= flagged['confidence']):
+        return result
+    return flagged
+
+
+def fraud_probabilities(model, features):
+    """Single predict_proba pass over an (N, 15) matrix; returns p(fraud) per row."""
+    proba = model.predict_proba(features)
+    return proba[:, list(model.classes_).index(1)]
+
+
+def score_transactions(model, transactions, threshold=LABEL_THRESHOLD):
+    if not transactions:
+        return []
+    if model is None:
+        return [with_velocity(tx, rule_based_result(tx.get('amount', 0))) for tx in transactions]
+
+    try:
+        features = build_feature_matrix(transactions, getattr(model, 'feature_caps_', None))
+        probabilities = fraud_probabilities(model, features)
+    except Exception:
+        logger.exception('Fraud model scoring failed; answering %d transactions as not fraud', len(transactions))
+        record_error('fraud')
+        return [with_velocity(tx, {'is_fraud': False, 'confidence': 0.1, 'reason': 'Model error'}) for tx in transactions]
+
+    return [
+        with_velocity(tx, {
+            'is_fraud': bool(probability > threshold),
+            'confidence': float(probability),
+            'reason': 'ML model prediction'
+        })
+        for tx, probability in zip(transactions, probabilities)
+    ]
+
+
+class FraudBatcher:
+    """Coalesces concurrent single-transaction fraud checks into one model call.
+
+    Request threads submit a feature dict and wait on a future. A worker
+    thread collects submissions for up to ``max_wait_ms`` (or until
+    ``max_batch_size`` are queued), scores them with one predict_proba pass
+    and resolves every future. A caller that waits longer than
+    ``latency_budget_ms`` falls back to the rule-based check instead.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=2.0, latency_budget_ms=50.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.latency_budget = latency_budget_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._metrics = {
+            'requests': 0,
+            'batches': 0,
+            'batched_items': 0,
+            'max_batch_size_seen': 0,
+            'fallbacks': 0,
+            'cancelled': 0,
+        }
+
+    def _ensure_worker(self):
+        # Started lazily so a pre-fork server does not fork a running thread
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='fraud-batcher', daemon=True)
+                    self._worker.start()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def submit(self, transaction_data):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((transaction_data, future))
+        return future
+
+    def score(self, transaction_data):
+        self._count('requests')
+        future = self.submit(transaction_data)
+        try:
+            return future.result(timeout=self.latency_budget)
+        except FutureTimeout:
+            if not future.cancel() and future.done():
+                return future.result()
+            self._count('fallbacks')
+            result = rule_based_result(transaction_data.get('amount', 0))
+            result['reason'] = f"{result['reason']} (rule-based fallback)"
+            return with_velocity(transaction_data, result)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Skip callers that already gave up and took the fallback
+            live = [(tx, future) for tx, future in batch if future.set_running_or_notify_cancel()]
+            with self._lock:
+                self._metrics['cancelled'] += len(batch) - len(live)
+                if live:
+                    self._metrics['batches'] += 1
+                    self._metrics['batched_items'] += len(live)
+                    self._metrics['max_batch_size_seen'] = max(self._metrics['max_batch_size_seen'], len(live))
+            if not live:
+                continue
+
+            try:
+                results = score_transactions(self.model, [tx for tx, _ in live])
+            except Exception as e:
+                for _, future in live:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(live, results):
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        batches = metrics['batches']
+        return dict(
+            metrics,
+            queued=self._queue.qsize(),
+            avg_batch_size=round(metrics['batched_items'] / batches, 2) if batches else 0.0,
+        )
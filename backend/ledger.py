@@ -0,0 +1,325 @@
+import argparse
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+# Stay well below SQLite's host-parameter limit for IN (...) lists
+IN_CHUNK_SIZE = 500
+
+# Upper bound for entry ids when a balance query has no later snapshot
+_MAX_ENTRY_ID = 2 ** 63 - 1
+
+# Latest snapshot per wallet (entry 0, balance 0 before the first one), for
+# the set-based snapshot and reconcile passes
+_LATEST_SNAPSHOTS = '''
+    latest AS MATERIALIZED (
+        SELECT w.id AS wallet_id, COALESCE(s.entry_id, 0) AS entry_id, COALESCE(s.balance, 0) AS balance
+        FROM wallets w
+        LEFT JOIN ledger_snapshots s ON s.wallet_id = w.id
+            AND s.entry_id = (SELECT MAX(entry_id) FROM ledger_snapshots WHERE wallet_id = w.id)
+    )
+'''
+
+
+class TransferError(Exception):
+    status_code = 400
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class InsufficientFunds(TransferError):
+    def __init__(self):
+        super().__init__('Insufficient balance')
+
+
+class WalletNotFound(TransferError):
+    status_code = 404
+
+    def __init__(self):
+        super().__init__('Receiver not found')
+
+
+def get_balances(conn, *user_ids):
+    """{user_id: balance} for the given users, one query per 500 ids; missing wallets are omitted."""
+    user_ids = list(dict.fromkeys(user_ids))
+    balances = {}
+    for start in range(0, len(user_ids), IN_CHUNK_SIZE):
+        chunk = user_ids[start:start + IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(
+            f'SELECT user_id, balance FROM wallets WHERE user_id IN ({placeholders})', chunk
+        ).fetchall()
+        balances.update((row[0], row[1]) for row in rows)
+    return balances
+
+
+def transfer(conn, sender_id, receiver_id, amount, transaction_type='transfer', description='', timestamp=None):
+    """Move ``amount`` minor units from sender to receiver and record the transaction atomically.
+
+    The debit is a conditional UPDATE, so the balance check and the write are
+    one statement and can never overdraw a wallet, whatever else is running.
+    Opens its own BEGIN IMMEDIATE transaction and commits it; when the caller
+    already has a transaction open, runs inside a savepoint and leaves the
+    commit to the caller. Raises InsufficientFunds or WalletNotFound.
+    """
+    timestamp = timestamp or datetime.utcnow().isoformat()
+    own_transaction = not conn.in_transaction
+    conn.execute('BEGIN IMMEDIATE' if own_transaction else 'SAVEPOINT transfer')
+    try:
+        debited = conn.execute(
+            'UPDATE wallets SET balance = balance - ?, version = version + 1 '
+            'WHERE user_id = ? AND balance >= ? RETURNING id, balance, version',
+            (amount, sender_id, amount)
+        ).fetchone()
+        if debited is None:
+            raise InsufficientFunds()
+
+        credited = conn.execute(
+            'UPDATE wallets SET balance = balance + ?, version = version + 1 WHERE user_id = ? RETURNING id, balance, version',
+            (amount, receiver_id)
+        ).fetchone()
+        if credited is None:
+            raise WalletNotFound()
+
+        cursor = conn.execute('''
+            INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (sender_id, receiver_id, amount, timestamp, 'completed', transaction_type, description))
+    except Exception:
+        if own_transaction:
+            conn.rollback()
+        else:
+            conn.execute('ROLLBACK TO transfer')
+            conn.execute('RELEASE transfer')
+        raise
+
+    if own_transaction:
+        conn.commit()
+    else:
+        conn.execute('RELEASE transfer')
+
+    return {
+        'transaction_id': cursor.lastrowid,
+        'sender_balance': debited['balance'],
+        'receiver_balance': credited['balance'],
+        'timestamp': timestamp,
+        # (user_id, wallet_id, balance, version) for BalanceCache.write_through
+        'wallets': [
+            (sender_id, debited['id'], debited['balance'], debited['version']),
+            (receiver_id, credited['id'], credited['balance'], credited['version']),
+        ]
+    }
+
+
+def apply_transfers(conn, sender_id, transfers, transaction_type='transfer'):
+    """Post already-validated transfers from one sender with set-based statements.
+
+    ``transfers`` is a list of (receiver_id, amount, description, timestamp).
+    The caller must hold the write transaction (BEGIN IMMEDIATE) and have
+    checked the transfers in order against balances read under that lock.
+    The sender is debited once with the total, guarded like transfer(), and
+    receivers are credited with one executemany. Returns the sender's new
+    balance and the transaction ids, in the order of ``transfers``.
+    """
+    if not transfers:
+        return {'sender_balance': None, 'transaction_ids': []}
+    total = sum(amount for _, amount, _, _ in transfers)
+    debited = conn.execute(
+        'UPDATE wallets SET balance = balance - ?, version = version + 1 WHERE user_id = ? AND balance >= ? RETURNING balance',
+        (total, sender_id, total)
+    ).fetchone()
+    if debited is None:
+        raise InsufficientFunds()
+
+    credits = defaultdict(int)
+    for receiver_id, amount, _, _ in transfers:
+        credits[receiver_id] += amount
+    conn.executemany(
+        'UPDATE wallets SET balance = balance + ?, version = version + 1 WHERE user_id = ?',
+        [(amount, receiver_id) for receiver_id, amount in credits.items()]
+    )
+    conn.executemany('''
+        INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
+        VALUES (?, ?, ?, ?, 'completed', ?, ?)
+    ''', [
+        (sender_id, receiver_id, amount, timestamp, transaction_type, description)
+        for receiver_id, amount, description, timestamp in transfers
+    ])
+    # Under the write lock the rows got consecutive ids ending at the last one
+    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return {
+        'sender_balance': debited['balance'],
+        'transaction_ids': list(range(last_id - len(transfers) + 1, last_id + 1))
+    }
+
+
+def balance_at(conn, wallet_id, as_of=None):
+    """Balance of a wallet computed from its ledger entries, now or as of an ISO timestamp.
+
+    Starts from the latest snapshot posted at or before ``as_of`` and sums only
+    the entries between it and the next snapshot, so the cost depends on the
+    snapshot interval, not on how long the wallet's history is.
+    """
+    as_of = as_of or '9999'
+    snapshot = conn.execute('''
+        SELECT entry_id, balance FROM ledger_snapshots
+        WHERE wallet_id = ? AND posted_at <= ? ORDER BY entry_id DESC LIMIT 1
+    ''', (wallet_id, as_of)).fetchone()
+    start, balance = (snapshot[0], snapshot[1]) if snapshot else (0, 0)
+
+    # posted_at only grows with id, so nothing past the next snapshot can qualify
+    following = conn.execute(
+        'SELECT MIN(entry_id) FROM ledger_snapshots WHERE wallet_id = ? AND entry_id > ?', (wallet_id, start)
+    ).fetchone()[0]
+    delta = conn.execute('''
+        SELECT COALESCE(SUM(amount), 0) FROM ledger_entries
+        WHERE wallet_id = ? AND id > ? AND id <= ? AND posted_at <= ?
+    ''', (wallet_id, start, following or _MAX_ENTRY_ID, as_of)).fetchone()[0]
+    return balance + delta
+
+
+def snapshot_balances(conn, min_entries=1000):
+    """Snapshot each wallet after every ``min_entries`` entries since its last snapshot.
+
+    One set-based statement; the work is proportional to the entries posted
+    since the previous pass, and a long backlog gets a snapshot every
+    ``min_entries`` entries rather than one at the end. Returns the number of
+    snapshots written.
+    """
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    before = conn.total_changes
+    try:
+        conn.execute(f'''
+            WITH {_LATEST_SNAPSHOTS},
+            pending AS (
+                SELECT e.wallet_id, e.id, e.posted_at,
+                       l.balance + SUM(e.amount) OVER running AS balance,
+                       ROW_NUMBER() OVER running AS n
+                -- CROSS JOIN keeps wallets as the outer loop: one index range per wallet
+                FROM latest l
+                CROSS JOIN ledger_entries e ON e.wallet_id = l.wallet_id AND e.id > l.entry_id
+                WINDOW running AS (PARTITION BY e.wallet_id ORDER BY e.id)
+            )
+            INSERT INTO ledger_snapshots (wallet_id, entry_id, balance, posted_at)
+            SELECT wallet_id, id, balance, posted_at FROM pending WHERE n % ? = 0
+        ''', (min_entries,))
+        # cursor.rowcount is not reported for statements starting with WITH
+        written = conn.total_changes - before
+    except Exception:
+        if own_transaction:
+            conn.rollback()
+        raise
+    if own_transaction:
+        conn.commit()
+    return written
+
+
+def reconcile(conn):
+    """Wallets whose stored balance disagrees with their ledger entries.
+
+    Returns [(wallet_id, user_id, stored_balance, ledger_balance)], empty when
+    the books balance. Reads snapshot + delta per wallet, never the full history.
+    """
+    return [tuple(row) for row in conn.execute(f'''
+        WITH {_LATEST_SNAPSHOTS}
+        SELECT * FROM (
+            SELECT w.id, w.user_id, w.balance,
+                   l.balance + COALESCE((
+                       SELECT SUM(e.amount) FROM ledger_entries e
+                       WHERE e.wallet_id = w.id AND e.id > l.entry_id
+                   ), 0) AS ledger_balance
+            FROM wallets w
+            JOIN latest l ON l.wallet_id = w.id
+        ) WHERE balance <> ledger_balance
+    ''')]
+
+
+class SnapshotCompactor:
+    """Background thread that runs snapshot_balances() every ``interval`` seconds.
+
+    ``connect`` returns a connection (get_db_connection), or is a list of
+    such callables, one per shard. An interval of 0 disables the thread and
+    leaves run_once() for cron-style use.
+    """
+
+    def __init__(self, connect, interval=60.0, min_entries=1000):
+        self.connect = connect
+        self.interval = interval
+        self.min_entries = min_entries
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics = {'runs': 0, 'snapshots': 0, 'errors': 0, 'last_run_ms': 0.0, 'last_error': None}
+
+    def start(self):
+        with self._lock:
+            if self.interval <= 0 or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ledger-snapshots', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        started = time.perf_counter()
+        written = 0
+        for connect in self.connect if isinstance(self.connect, list) else [self.connect]:
+            conn = connect()
+            try:
+                written += snapshot_balances(conn, self.min_entries)
+            finally:
+                conn.close()
+        with self._lock:
+            self._metrics['runs'] += 1
+            self._metrics['snapshots'] += written
+            self._metrics['last_run_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return written
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._metrics['errors'] += 1
+                    self._metrics['last_error'] = str(e)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, interval=self.interval, min_entries=self.min_entries,
+                        running=self._thread is not None and self._thread.is_alive())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot and reconcile the SME Wallet ledger')
+    parser.add_argument('--db', default='sme_wallet.db', help='Path to the SQLite database')
+    parser.add_argument('--min-entries', type=int, default=1000,
+                        help='Snapshot wallets with at least this many entries since their last snapshot')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='Compare stored balances with the ledger (non-zero exit on mismatch)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.execute('PRAGMA busy_timeout = 5000')
+    print(f'Wrote {snapshot_balances(conn, args.min_entries)} snapshots')
+    if args.reconcile:
+        mismatches = reconcile(conn)
+        for wallet_id, user_id, stored, ledger_balance in mismatches:
+            print(f'MISMATCH wallet {wallet_id} (user {user_id}): stored {stored}, ledger {ledger_balance}')
+        conn.close()
+        if mismatches:
+            raise SystemExit(1)
+        print('All wallet balances match the ledger')
+        return
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Prometheus text-format metrics for the wallet API.
+
+Off unless METRICS=true. When off, span() hands back one shared no-op
+context manager and no hooks or wrappers are installed, so instrumented code
+pays for a function call and a branch. When on, GET /metrics exposes:
+
+  wallet_request_duration_seconds{route,method,status}  histogram
+  wallet_span_duration_seconds{route,span}              histogram
+      auth, db.execute, db.commit, db.lock_wait (BEGIN IMMEDIATE),
+      db.pool_wait, fraud, qr_render
+  wallet_sqlite_busy_total{operation}                   counter
+  wallet_errors_total{component}                        counter
+
+plus gauges read from the existing stats() dicts at scrape time. Metrics are
+kept per process; with several workers, scrape each one.
+"""
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+METRICS_ENABLED = os.getenv('METRICS', 'false').lower() == 'true'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; SQLite statements sit at the low end, QR renders and fraud batches higher up
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Route template of the request being served, for span labels
+current_route = ContextVar('current_route', default='')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> per-bucket counts (last slot is +Inf), then the sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            snapshot = sorted((values, list(series)) for values, series in self._series.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for values, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, values)} {series[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, values)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{_labels(self.labelnames, values)} {value}' for values, value in snapshot]
+        return lines
+
+
+class GaugeFamily:
+    """Numeric fields of a stats() dict, read at scrape time."""
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.collect().items()):
+            if isinstance(value, (bool, int, float)):
+                values = key if isinstance(key, tuple) else (key,)
+                lines.append(f'{self.name}{_labels(self.labelnames, values)} {float(value)}')
+        return lines
+
+
+request_duration = Histogram('wallet_request_duration_seconds', 'HTTP request latency by route.',
+                             ('route', 'method', 'status'))
+span_duration = Histogram('wallet_span_duration_seconds', 'Time spent in a sub-span of a request.',
+                          ('route', 'span'))
+sqlite_busy = Counter('wallet_sqlite_busy_total', 'SQLite "database is locked" errors after busy_timeout.',
+                      ('operation',))
+errors = Counter('wallet_errors_total', 'Errors that were handled and degraded, by component.', ('component',))
+_families = [request_duration, span_duration, sqlite_busy, errors]
+
+
+def register_gauges(name, documentation, labelnames, collect):
+    _families.append(GaugeFamily(name, documentation, labelnames, collect))
+
+
+def render():
+    lines = []
+    for family in _families:
+        lines += family.render()
+    return '\n'.join(lines) + '\n'
+
+
+def observe_span(name, seconds):
+    span_duration.observe(seconds, current_route.get(), name)
+
+
+def observe_request(route, method, status, seconds):
+    request_duration.observe(seconds, route, method, str(status))
+
+
+def record_error(component):
+    if METRICS_ENABLED:
+        errors.inc(component)
+
+
+def record_sqlite_error(error, operation):
+    if 'locked' in str(error) or 'busy' in str(error):
+        sqlite_busy.inc(operation)
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_span(self.name, time.perf_counter() - self.started)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name):
+    """Times the with-block as sub-span ``name`` of the current request."""
+    return _Span(name) if METRICS_ENABLED else _NOOP
+
+
+def init_app(app):
+    """Per-route latency hooks; installs nothing unless METRICS=true."""
+    if not METRICS_ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        current_route.set(request.url_rule.rule if request.url_rule else 'unmatched')
+
+    @app.after_request
+    def observe_request_duration(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            # Streamed bodies (exports, batch results) are timed until they start
+            observe_request(current_route.get(), request.method, response.status_code,
+                            time.perf_counter() - started)
+        return response
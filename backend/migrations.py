@@ -0,0 +1,393 @@
+import argparse
+import sqlite3
+
+# Indexes and triggers are defined once here: the migration that introduces
+# them and any later table rebuild (which drops them) share the same DDL.
+INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_wallets_user_id ON wallets(user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_sender_ts ON transactions(sender_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_receiver_ts ON transactions(receiver_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_offline_transactions_sender ON offline_transactions(sender_id)',
+]
+
+COUNTER_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS trg_transactions_count_insert AFTER INSERT ON transactions
+       BEGIN
+           INSERT INTO transaction_counters (user_id, status, transaction_type, count)
+           VALUES (NEW.sender_id, NEW.status, NEW.transaction_type, 1)
+           ON CONFLICT (user_id, status, transaction_type) DO UPDATE SET count = count + 1;
+           INSERT INTO transaction_counters (user_id, status, transaction_type, count)
+           SELECT NEW.receiver_id, NEW.status, NEW.transaction_type, 1 WHERE NEW.receiver_id <> NEW.sender_id
+           ON CONFLICT (user_id, status, transaction_type) DO UPDATE SET count = count + 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_transactions_count_delete AFTER DELETE ON transactions
+       BEGIN
+           UPDATE transaction_counters SET count = count - 1
+           WHERE status = OLD.status AND transaction_type = OLD.transaction_type
+             AND (user_id = OLD.sender_id OR user_id = OLD.receiver_id);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_transactions_count_update
+       AFTER UPDATE OF sender_id, receiver_id, status, transaction_type ON transactions
+       BEGIN
+           UPDATE transaction_counters SET count = count - 1
+           WHERE status = OLD.status AND transaction_type = OLD.transaction_type
+             AND (user_id = OLD.sender_id OR user_id = OLD.receiver_id);
+           INSERT INTO transaction_counters (user_id, status, transaction_type, count)
+           VALUES (NEW.sender_id, NEW.status, NEW.transaction_type, 1)
+           ON CONFLICT (user_id, status, transaction_type) DO UPDATE SET count = count + 1;
+           INSERT INTO transaction_counters (user_id, status, transaction_type, count)
+           SELECT NEW.receiver_id, NEW.status, NEW.transaction_type, 1 WHERE NEW.receiver_id <> NEW.sender_id
+           ON CONFLICT (user_id, status, transaction_type) DO UPDATE SET count = count + 1;
+       END''',
+]
+
+# The ledger bumps version itself; this catches any other balance write
+WALLET_VERSION_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS trg_wallets_version AFTER UPDATE OF balance ON wallets
+   WHEN NEW.version = OLD.version
+   BEGIN
+       UPDATE wallets SET version = version + 1 WHERE id = NEW.id;
+   END'''
+
+# Covering, so balance deltas never touch the table itself
+LEDGER_INDEX = 'CREATE INDEX IF NOT EXISTS idx_ledger_entries_wallet ON ledger_entries(wallet_id, id, posted_at, amount)'
+
+LEDGER_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS trg_ledger_entries_no_update BEFORE UPDATE ON ledger_entries
+       BEGIN
+           SELECT RAISE(ABORT, 'ledger_entries is append-only');
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_ledger_entries_no_delete BEFORE DELETE ON ledger_entries
+       BEGIN
+           SELECT RAISE(ABORT, 'ledger_entries is append-only');
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_transactions_post AFTER INSERT ON transactions
+       WHEN NEW.status = 'completed'
+       BEGIN
+           INSERT INTO ledger_entries (wallet_id, transaction_id, entry_type, amount, posted_at)
+           SELECT id, NEW.id, 'debit', -NEW.amount, strftime('%Y-%m-%dT%H:%M:%f', 'now')
+           FROM wallets WHERE user_id = NEW.sender_id;
+           INSERT INTO ledger_entries (wallet_id, transaction_id, entry_type, amount, posted_at)
+           SELECT id, NEW.id, 'credit', NEW.amount, strftime('%Y-%m-%dT%H:%M:%f', 'now')
+           FROM wallets WHERE user_id = NEW.receiver_id;
+       END''',
+    # Balances set outside the ledger (seeding, manual fixes) are posted
+    # as opening/adjustment entries so the entries always add up
+    '''CREATE TRIGGER IF NOT EXISTS trg_wallets_opening AFTER INSERT ON wallets
+       WHEN NEW.balance <> 0
+       BEGIN
+           INSERT INTO ledger_entries (wallet_id, transaction_id, entry_type, amount, posted_at)
+           VALUES (NEW.id, NULL, 'opening', NEW.balance, strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_wallets_adjustment AFTER UPDATE OF balance ON wallets
+       WHEN NEW.version = OLD.version AND NEW.balance <> OLD.balance
+       BEGIN
+           INSERT INTO ledger_entries (wallet_id, transaction_id, entry_type, amount, posted_at)
+           VALUES (NEW.id, NULL, 'adjustment', NEW.balance - OLD.balance, strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+       END''',
+]
+
+ALL_TRIGGERS = [
+    'trg_transactions_count_insert', 'trg_transactions_count_delete', 'trg_transactions_count_update',
+    'trg_wallets_version', 'trg_ledger_entries_no_update', 'trg_ledger_entries_no_delete',
+    'trg_transactions_post', 'trg_wallets_opening', 'trg_wallets_adjustment',
+]
+
+# Money columns move from REAL naira to INTEGER kobo (see money.py). SQLite
+# cannot change a column's type in place, so each table is rebuilt: create
+# the new shape, copy with the conversion, drop the old, rename.
+MINOR_UNIT_TABLES = [
+    ('wallets', '''
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         user_id INTEGER NOT NULL,
+         balance INTEGER NOT NULL DEFAULT 0,
+         created_at TEXT NOT NULL,
+         version INTEGER NOT NULL DEFAULT 0,
+         FOREIGN KEY (user_id) REFERENCES users(id))''',
+     'id, user_id, CAST(ROUND(balance * 100) AS INTEGER), created_at, version'),
+    ('transactions', '''
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         sender_id INTEGER NOT NULL,
+         receiver_id INTEGER NOT NULL,
+         amount INTEGER NOT NULL,
+         timestamp TEXT NOT NULL,
+         status TEXT NOT NULL DEFAULT 'pending',
+         transaction_type TEXT NOT NULL DEFAULT 'transfer',
+         description TEXT,
+         FOREIGN KEY (sender_id) REFERENCES users(id),
+         FOREIGN KEY (receiver_id) REFERENCES users(id))''',
+     'id, sender_id, receiver_id, CAST(ROUND(amount * 100) AS INTEGER), timestamp, status, transaction_type, description'),
+    ('offline_transactions', '''
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         sender_id INTEGER NOT NULL,
+         receiver_id INTEGER NOT NULL,
+         amount INTEGER NOT NULL,
+         timestamp TEXT NOT NULL,
+         description TEXT,
+         qr_data TEXT,
+         FOREIGN KEY (sender_id) REFERENCES users(id),
+         FOREIGN KEY (receiver_id) REFERENCES users(id))''',
+     'id, sender_id, receiver_id, CAST(ROUND(amount * 100) AS INTEGER), timestamp, description, qr_data'),
+    ('ledger_entries', '''
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         wallet_id INTEGER NOT NULL,
+         transaction_id INTEGER,
+         entry_type TEXT NOT NULL,
+         amount INTEGER NOT NULL,
+         posted_at TEXT NOT NULL,
+         FOREIGN KEY (wallet_id) REFERENCES wallets(id),
+         FOREIGN KEY (transaction_id) REFERENCES transactions(id))''',
+     'id, wallet_id, transaction_id, entry_type, CAST(ROUND(amount * 100) AS INTEGER), posted_at'),
+    ('ledger_snapshots', '''
+        (wallet_id INTEGER NOT NULL,
+         entry_id INTEGER NOT NULL,
+         balance INTEGER NOT NULL,
+         posted_at TEXT NOT NULL,
+         PRIMARY KEY (wallet_id, entry_id)) WITHOUT ROWID''',
+     'wallet_id, entry_id, CAST(ROUND(balance * 100) AS INTEGER), posted_at'),
+]
+
+
+def _rebuild_statements(tables):
+    statements = [f'DROP TRIGGER IF EXISTS {name}' for name in ALL_TRIGGERS]
+    for table, columns, select in tables:
+        statements += [
+            f'CREATE TABLE {table}_rebuild {columns}',
+            f'INSERT INTO {table}_rebuild SELECT {select} FROM {table}',
+            f'DROP TABLE {table}',
+            f'ALTER TABLE {table}_rebuild RENAME TO {table}',
+        ]
+    return statements + INDEXES + [LEDGER_INDEX] + COUNTER_TRIGGERS + [WALLET_VERSION_TRIGGER] + LEDGER_TRIGGERS
+
+
+# Versioned schema migrations. Each entry is applied once, in order, and the
+# database's PRAGMA user_version records the last version applied. Statements
+# must be safe to run against a live database (CREATE ... IF NOT EXISTS etc.).
+MIGRATIONS = [
+    (1, 'Secondary indexes for wallet and transaction lookups', INDEXES),
+    (2, 'Per-user transaction counters maintained by triggers', [
+        '''CREATE TABLE IF NOT EXISTS transaction_counters
+           (user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, status, transaction_type)) WITHOUT ROWID''',
+        *COUNTER_TRIGGERS,
+        'DELETE FROM transaction_counters',
+        '''INSERT INTO transaction_counters (user_id, status, transaction_type, count)
+           SELECT user_id, status, transaction_type, COUNT(*) FROM (
+               SELECT sender_id AS user_id, status, transaction_type FROM transactions
+               UNION ALL
+               SELECT receiver_id, status, transaction_type FROM transactions WHERE receiver_id <> sender_id
+           ) GROUP BY user_id, status, transaction_type''',
+    ]),
+    (3, 'Wallet row versions for balance caching and ETags', [
+        'ALTER TABLE wallets ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+        WALLET_VERSION_TRIGGER,
+    ]),
+    (4, 'Append-only ledger entries with per-wallet balance snapshots', [
+        # One row per posting: a completed transaction debits the sender's
+        # wallet and credits the receiver's, so every transaction nets to zero.
+        # posted_at is taken inside the write transaction, so it never goes
+        # backwards as id grows.
+        '''CREATE TABLE IF NOT EXISTS ledger_entries
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            wallet_id INTEGER NOT NULL,
+            transaction_id INTEGER,
+            entry_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            posted_at TEXT NOT NULL,
+            FOREIGN KEY (wallet_id) REFERENCES wallets(id),
+            FOREIGN KEY (transaction_id) REFERENCES transactions(id))''',
+        LEDGER_INDEX,
+        '''CREATE TABLE IF NOT EXISTS ledger_snapshots
+           (wallet_id INTEGER NOT NULL,
+            entry_id INTEGER NOT NULL,
+            balance REAL NOT NULL,
+            posted_at TEXT NOT NULL,
+            PRIMARY KEY (wallet_id, entry_id)) WITHOUT ROWID''',
+        *LEDGER_TRIGGERS,
+        '''INSERT INTO ledger_entries (wallet_id, transaction_id, entry_type, amount, posted_at)
+           SELECT id, NULL, 'opening', balance, strftime('%Y-%m-%dT%H:%M:%f', 'now')
+           FROM wallets WHERE balance <> 0''',
+    ]),
+    (5, 'Store money as integer minor units', _rebuild_statements(MINOR_UNIT_TABLES)),
+    (6, 'Cross-shard transfer keys and outbox', [
+        # A transfer between users on different shards (shards.py) is stored
+        # once on each side; both rows carry the same key, '<shard>:<id>'
+        'ALTER TABLE transactions ADD COLUMN transfer_key TEXT',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_transfer_key
+           ON transactions(transfer_key) WHERE transfer_key IS NOT NULL''',
+        # Credits committed with the sender's debit, waiting to be applied on
+        # the receiver's shard
+        '''CREATE TABLE IF NOT EXISTS transfer_outbox
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transfer_key TEXT NOT NULL UNIQUE,
+            shard INTEGER NOT NULL,
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            description TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT)''',
+    ]),
+    (7, 'Nonces of paid QR codes', [
+        '''CREATE TABLE IF NOT EXISTS qr_nonces
+           (nonce BLOB PRIMARY KEY,
+            expires_at INTEGER NOT NULL) WITHOUT ROWID''',
+    ]),
+]
+
+# Queries on the request path, with representative parameters. Every one of
+# them must be answered through an index, never a full table scan.
+HOT_QUERIES = {
+    'wallet_balance': ('SELECT balance FROM wallets WHERE user_id = ?', (1,)),
+    'wallet_by_user': ('SELECT * FROM wallets WHERE user_id = ?', (1,)),
+    'user_by_email': ('SELECT id FROM users WHERE email = ?', ('a@example.com',)),
+    'transaction_history': ('''
+        SELECT t.*,
+               sender.name as sender_name, sender.email as sender_email,
+               receiver.name as receiver_name, receiver.email as receiver_email
+        FROM transactions t
+        JOIN users sender ON t.sender_id = sender.id
+        JOIN users receiver ON t.receiver_id = receiver.id
+        WHERE t.sender_id = ? OR t.receiver_id = ?
+        ORDER BY t.timestamp DESC LIMIT ? OFFSET ?
+    ''', (1, 1, 10, 0)),
+    'transaction_history_keyset': ('''
+        SELECT t.*,
+               sender.name as sender_name, sender.email as sender_email,
+               receiver.name as receiver_name, receiver.email as receiver_email
+        FROM (
+            SELECT * FROM (SELECT * FROM transactions WHERE sender_id = ?
+                             AND (timestamp < ? OR (timestamp = ? AND id < ?))
+                           ORDER BY timestamp DESC, id DESC LIMIT ?)
+            UNION
+            SELECT * FROM (SELECT * FROM transactions WHERE receiver_id = ?
+                             AND (timestamp < ? OR (timestamp = ? AND id < ?))
+                           ORDER BY timestamp DESC, id DESC LIMIT ?)
+        ) t
+        JOIN users sender ON t.sender_id = sender.id
+        JOIN users receiver ON t.receiver_id = receiver.id
+        ORDER BY t.timestamp DESC, t.id DESC LIMIT ?
+    ''', (1, '9999', '9999', 0, 11, 1, '9999', '9999', 0, 11, 11)),
+    'transaction_total': ('SELECT COALESCE(SUM(count), 0) FROM transaction_counters WHERE user_id = ?', (1,)),
+    'offline_queue': ('SELECT * FROM offline_transactions WHERE sender_id = ?', (1,)),
+    'statement_export': ('''
+        SELECT t.id, t.timestamp, u.name FROM transactions t JOIN users u ON u.id = t.receiver_id
+        WHERE t.sender_id = ? AND t.timestamp >= ? AND t.timestamp < ?
+        UNION ALL
+        SELECT t.id, t.timestamp, u.name FROM transactions t JOIN users u ON u.id = t.sender_id
+        WHERE t.receiver_id = ? AND t.sender_id <> ? AND t.timestamp >= ? AND t.timestamp < ?
+        ORDER BY 2, 1
+    ''', (1, '', '9999', 1, 1, '', '9999')),
+    'ledger_snapshot': ('''
+        SELECT entry_id, balance FROM ledger_snapshots
+        WHERE wallet_id = ? AND posted_at <= ? ORDER BY entry_id DESC LIMIT 1
+    ''', (1, '9999')),
+    'transfer_by_key': ('SELECT 1 FROM transactions WHERE transfer_key = ?', ('0:1',)),
+    'ledger_delta': ('''
+        SELECT COALESCE(SUM(amount), 0) FROM ledger_entries
+        WHERE wallet_id = ? AND id > ? AND id <= ? AND posted_at <= ?
+    ''', (1, 0, 100, '9999')),
+}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _check_preconditions(conn, version):
+    if version == 1:
+        duplicate = conn.execute(
+            'SELECT user_id, COUNT(*) FROM wallets GROUP BY user_id HAVING COUNT(*) > 1 LIMIT 1'
+        ).fetchone()
+        if duplicate:
+            raise MigrationError(
+                f'Cannot add unique index on wallets(user_id): user {duplicate[0]} '
+                f'has {duplicate[1]} wallets'
+            )
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to ``target`` (default: latest). Returns versions applied."""
+    applied = []
+    version = current_version(conn)
+    if conn.in_transaction:
+        conn.commit()
+    for number, description, statements in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        # BEGIN IMMEDIATE takes the write lock up front; readers keep going under WAL
+        conn.execute('BEGIN IMMEDIATE')
+        if current_version(conn) >= number:
+            # Another process starting up at the same time got here first
+            conn.rollback()
+            continue
+        try:
+            _check_preconditions(conn, number)
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((number, description))
+    return applied
+
+
+def query_plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+
+
+def check_query_plans(conn, queries=None):
+    """Return {name: plan} for every hot query whose plan contains a full table scan."""
+    offenders = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        plan = query_plan(conn, sql, params)
+        # Scanning a materialized subquery is fine; scanning a base table is not
+        derived = {step.split()[1] for step in plan if step.startswith(('MATERIALIZE', 'CO-ROUTINE'))}
+        scans = [
+            step for step in plan
+            if step.startswith('SCAN') and not step.split()[1].startswith('(')
+            and step.split()[1] not in derived
+        ]
+        if scans:
+            offenders[name] = plan
+    return offenders
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply SME Wallet schema migrations')
+    parser.add_argument('--db', default='sme_wallet.db', help='Path to the SQLite database')
+    parser.add_argument('--check', action='store_true',
+                        help='Verify that every hot query uses an index (non-zero exit otherwise)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.execute('PRAGMA busy_timeout = 5000')
+    before = current_version(conn)
+    for number, description in migrate(conn):
+        print(f'Applied migration {number}: {description}')
+    print(f'Schema version {before} -> {current_version(conn)}')
+
+    if args.check:
+        offenders = check_query_plans(conn)
+        for name, plan in offenders.items():
+            print(f'FULL SCAN in {name}: {plan}')
+        conn.close()
+        if offenders:
+            raise SystemExit(1)
+        print(f'All {len(HOT_QUERIES)} hot queries use an index')
+        return
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Money as integer minor units.
+
+Balances and amounts are stored, compared and summed as integer kobo
+(1 NGN = 100 kobo). The API keeps speaking decimal naira: to_minor() parses
+amounts coming in and to_major() formats them going out, and nothing in
+between does float arithmetic on money.
+"""
+from decimal import Decimal, DecimalException
+
+MINOR_UNITS = 100
+# Ten trillion naira: far beyond any wallet, and leaves room under SQLite's
+# 64-bit INTEGER for balances and totals summed from such amounts
+MAX_MINOR = 10 ** 15
+_MAX_MAJOR = Decimal(MAX_MINOR) / MINOR_UNITS
+
+
+class InvalidAmount(ValueError):
+    def __init__(self, message='Invalid amount'):
+        super().__init__(message)
+        self.message = message
+
+
+def to_minor(value):
+    """Parse a JSON amount (number or numeric string) into integer minor units.
+
+    Goes through the decimal string, so 0.29 is 29 kobo rather than
+    28.999999999999996. Raises InvalidAmount for non-numbers, for fractions
+    of a minor unit and for amounts beyond MAX_MINOR, which are refused
+    before any arithmetic so "1e999999" costs no more than "1".
+    """
+    if isinstance(value, bool) or value is None:
+        raise InvalidAmount()
+    try:
+        major = Decimal(str(value))
+        if not major.is_finite():
+            raise InvalidAmount()
+        if major.copy_abs() > _MAX_MAJOR:
+            raise InvalidAmount('Amount is too large')
+        minor = major * MINOR_UNITS
+        if minor != minor.to_integral_value():
+            raise InvalidAmount('Amount cannot have more than 2 decimal places')
+    except DecimalException:
+        raise InvalidAmount()
+    return int(minor)
+
+
+def to_major(minor):
+    """Minor units to a naira amount for JSON responses."""
+    return minor / MINOR_UNITS
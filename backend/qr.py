@@ -0,0 +1,199 @@
+import hashlib
+import hmac
+import io
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# Content types for the formats /api/generate_qr can return
+QR_MIMETYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+# Signed payment-request payload, version 1. Fixed-width big-endian fields:
+#   version (1) | user_id (4) | amount in minor units (8) | expires_at, epoch seconds (4) | nonce (8)
+# then the description (UTF-8, at most QR_DESCRIPTION_MAX_BYTES) and the first
+# QR_TAG_BYTES of an HMAC-SHA256 over everything before it. Base45 text
+# (RFC 9285) uses only QR alphanumeric characters, so the code is encoded at
+# 5.5 bits a character instead of 8.
+QR_PAYLOAD_VERSION = 1
+_QR_HEADER = struct.Struct('>BIQI8s')
+QR_TAG_BYTES = 10
+QR_DESCRIPTION_MAX_BYTES = 32
+_BASE45 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+_BASE45_VALUES = {char: value for value, char in enumerate(_BASE45)}
+# Longest text a valid payload can encode to; anything longer is rejected unread
+_QR_TEXT_MAX = (_QR_HEADER.size + QR_DESCRIPTION_MAX_BYTES + QR_TAG_BYTES + 1) // 2 * 3
+
+QRPayload = namedtuple('QRPayload', 'user_id amount expires_at nonce description')
+
+
+class QRPayloadError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def qr_signing_key(secret):
+    # Separate from the JWT key, so a QR tag is never a valid token signature
+    return hmac.new(secret.encode(), b'sme-wallet qr payload', hashlib.sha256).digest()
+
+
+def b45encode(data):
+    chars = []
+    for start in range(0, len(data) - 1, 2):
+        value = data[start] << 8 | data[start + 1]
+        value, c = divmod(value, 45)
+        e, d = divmod(value, 45)
+        chars += (_BASE45[c], _BASE45[d], _BASE45[e])
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        chars += (_BASE45[c], _BASE45[d])
+    return ''.join(chars)
+
+
+def b45decode(text):
+    if len(text) % 3 == 1:
+        raise ValueError('Invalid base45 length')
+    try:
+        values = [_BASE45_VALUES[char] for char in text]
+    except KeyError:
+        raise ValueError('Invalid base45 character') from None
+    data = bytearray()
+    for start in range(0, len(values), 3):
+        group = values[start:start + 3]
+        if len(group) == 3:
+            value = group[0] + group[1] * 45 + group[2] * 2025
+            if value > 0xFFFF:
+                raise ValueError('Invalid base45 group')
+            data.extend((value >> 8, value & 0xFF))
+        else:
+            value = group[0] + group[1] * 45
+            if value > 0xFF:
+                raise ValueError('Invalid base45 group')
+            data.append(value)
+    return bytes(data)
+
+
+def encode_qr_payload(key, user_id, amount, expires_at, description='', nonce=None):
+    """Signed base45 text for a payment request; the description is cut to QR_DESCRIPTION_MAX_BYTES."""
+    if not 0 < amount < 1 << 64:
+        raise QRPayloadError('Amount is too large for a QR code')
+    if not 0 < user_id < 1 << 32:
+        raise QRPayloadError('User id does not fit in a QR code')
+    if not 0 <= int(expires_at) < 1 << 32:
+        raise QRPayloadError('Expiry does not fit in a QR code')
+    nonce = nonce or secrets.token_bytes(8)
+    # Cut on a character boundary so the tail still decodes
+    description = description.encode()[:QR_DESCRIPTION_MAX_BYTES].decode(errors='ignore').encode()
+    body = _QR_HEADER.pack(QR_PAYLOAD_VERSION, user_id, amount, int(expires_at), nonce) + description
+    return b45encode(body + hmac.new(key, body, hashlib.sha256).digest()[:QR_TAG_BYTES])
+
+
+def decode_qr_payload(key, text, now=None):
+    """Verify and unpack encode_qr_payload() text; raises QRPayloadError.
+
+    The tag is checked with hmac.compare_digest before any field is read, so
+    forged or altered codes are rejected without parsing and in constant time.
+    """
+    if not isinstance(text, str) or not 0 < len(text) <= _QR_TEXT_MAX:
+        raise QRPayloadError('Invalid QR code')
+    try:
+        raw = b45decode(text)
+    except ValueError:
+        raise QRPayloadError('Invalid QR code') from None
+    if len(raw) < _QR_HEADER.size + QR_TAG_BYTES or raw[0] != QR_PAYLOAD_VERSION:
+        raise QRPayloadError('Invalid QR code')
+
+    body, tag = raw[:-QR_TAG_BYTES], raw[-QR_TAG_BYTES:]
+    if not hmac.compare_digest(tag, hmac.new(key, body, hashlib.sha256).digest()[:QR_TAG_BYTES]):
+        raise QRPayloadError('Invalid QR code signature')
+
+    _, user_id, amount, expires_at, nonce = _QR_HEADER.unpack_from(body)
+    if expires_at <= (now if now is not None else time.time()):
+        raise QRPayloadError('QR code has expired')
+    try:
+        description = body[_QR_HEADER.size:].decode()
+    except UnicodeDecodeError:
+        raise QRPayloadError('Invalid QR code') from None
+    return QRPayload(user_id, amount, expires_at, nonce, description)
+
+
+class NonceStore:
+    """Nonces of QR codes that have been paid, so each code pays once.
+
+    Rows live in the qr_nonces table, shared by every worker process, until
+    the code expires; after that decode_qr_payload() rejects the code anyway,
+    and expired rows are purged at most every ``purge_interval`` seconds.
+    """
+
+    def __init__(self, connect, purge_interval=60.0):
+        self.connect = connect
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+        self._metrics = {'claims': 0, 'replays': 0, 'releases': 0, 'purged': 0}
+
+    def claim(self, nonce, expires_at):
+        """True if ``nonce`` was unused and is now taken; False for a replay."""
+        now = time.time()
+        conn = self.connect()
+        try:
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_interval
+                purged = conn.execute('DELETE FROM qr_nonces WHERE expires_at <= ?', (int(now),)).rowcount
+                conn.commit()
+                with self._lock:
+                    self._metrics['purged'] += purged
+            try:
+                conn.execute('INSERT INTO qr_nonces (nonce, expires_at) VALUES (?, ?)', (nonce, expires_at))
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                with self._lock:
+                    self._metrics['replays'] += 1
+                return False
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._metrics['claims'] += 1
+        return True
+
+    def release(self, nonce):
+        """Hand a claimed nonce back after the payment did not go through."""
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM qr_nonces WHERE nonce = ?', (nonce,))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._metrics['releases'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, purge_interval=self.purge_interval)
+
+
+def render_qr(payload, image_format='png'):
+    # Imported on first render (usually in a QR pool worker), not at app start-up
+    import qrcode
+    import qrcode.image.svg
+
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    buffer = io.BytesIO()
+    if image_format == 'svg':
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffer)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffer, format='PNG')
+    return buffer.getvalue()
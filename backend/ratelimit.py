@@ -0,0 +1,252 @@
+"""Rate-limit counters shared by every worker on the host.
+
+Flask-Limiter's default memory:// storage keeps counters per process, so under
+gunicorn with N workers a "10 per minute" route really allows 10 * N. The
+SQLiteStorage here keeps them in one small WAL database instead
+(RATELIMIT_STORAGE_URI=sqlite:///ratelimit.db) that every worker opens.
+
+A sliding-window-counter hit is one BEGIN IMMEDIATE transaction: read the
+previous and current window, bump the current one if the weighted count
+allows it. Writers queue on an flock() beside the database rather than
+polling SQLite's busy handler, which starves processes under sustained
+load, and there is no increment-then-revert race. Expired counters are not deleted on the hit
+path; reads ignore them and each process sweeps them in a single DELETE at
+most every purge_interval seconds.
+
+LimiterTimings wraps the limiter's strategy so /api/health can report what
+the checks cost per route.
+"""
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from math import floor
+
+from flask import has_request_context, request
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY,
+        count INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID
+'''
+_EXPIRY_INDEX = 'CREATE INDEX IF NOT EXISTS idx_rate_limits_expires_at ON rate_limits(expires_at)'
+
+# Expired rows restart from this hit instead of adding to a dead window
+_INCR = '''
+    INSERT INTO rate_limits (key, count, expires_at) VALUES (:key, :amount, :expires_at)
+    ON CONFLICT(key) DO UPDATE SET
+        count = CASE WHEN expires_at > :now THEN count + excluded.count ELSE excluded.count END,
+        expires_at = CASE WHEN expires_at > :now THEN expires_at ELSE excluded.expires_at END
+    RETURNING count
+'''
+
+
+# Route name for checks made outside a Flask request (set by asgi.py)
+limiter_route = ContextVar('limiter_route', default=None)
+
+
+class _FileLock:
+    def __init__(self, lock_file):
+        self._lock_file = lock_file
+
+    def __enter__(self):
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """limits storage backed by a local SQLite file.
+
+    sqlite:///ratelimit.db is relative to the working directory,
+    sqlite:////var/run/wallet/ratelimit.db is absolute.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, purge_interval=30, busy_timeout_ms=5000, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri.split('://', 1)[1][1:]
+        self.purge_interval = float(purge_interval)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self._local = threading.local()
+        self._next_purge = 0.0
+        self._purge_lock = threading.Lock()
+        self._metrics = {'purges': 0, 'purged': 0}
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork (gunicorn --preload)
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute(f'PRAGMA busy_timeout = {self.busy_timeout_ms}')
+            conn.execute('PRAGMA journal_mode = WAL')
+            # Counters are advisory; losing the last few hits on power loss is fine
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute(_SCHEMA)
+            conn.execute(_EXPIRY_INDEX)
+            # flock() excludes per open file, so every thread needs its own
+            local.lock_file = open(f'{self.path}.lock', 'a+')
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def _write_lock(self):
+        self._connection()
+        return _FileLock(self._local.lock_file)
+
+    def _maybe_purge(self, conn, now):
+        if now < self._next_purge or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_purge = now + self.purge_interval
+            with self._write_lock():
+                purged = conn.execute('DELETE FROM rate_limits WHERE expires_at <= ?', (now,)).rowcount
+            self._metrics['purges'] += 1
+            self._metrics['purged'] += purged
+        finally:
+            self._purge_lock.release()
+
+    def _incr(self, conn, key, expiry, amount, now):
+        return conn.execute(_INCR, {
+            'key': key, 'amount': amount, 'expires_at': now + expiry, 'now': now
+        }).fetchone()[0]
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        conn = self._connection()
+        with self._write_lock():
+            count = self._incr(conn, key, expiry, amount, now)
+        self._maybe_purge(conn, now)
+        return count
+
+    def decr(self, key, amount=1):
+        conn = self._connection()
+        conn.execute('UPDATE rate_limits SET count = MAX(count - ?, 0) WHERE key = ? AND expires_at > ?',
+                     (amount, key, time.time()))
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            'SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connection().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute('DELETE FROM rate_limits').rowcount
+
+    def clear(self, key):
+        self._connection().execute('DELETE FROM rate_limits WHERE key = ?', (key,))
+
+    def _window(self, conn, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        counts = dict(conn.execute(
+            'SELECT key, count FROM rate_limits WHERE key IN (?, ?) AND expires_at > ?',
+            (previous_key, current_key, now)
+        ).fetchall())
+        previous_count = counts.get(previous_key, 0)
+        current_count = counts.get(current_key, 0)
+        # Same arithmetic as limits' MemoryStorage
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return current_key, previous_count, previous_ttl, current_count, current_ttl
+
+    def get_sliding_window(self, key, expiry):
+        _, previous_count, previous_ttl, current_count, current_ttl = self._window(
+            self._connection(), key, expiry, time.time()
+        )
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        conn = self._connection()
+        with self._write_lock():
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current_key, previous_count, previous_ttl, current_count, _ = self._window(conn, key, expiry, now)
+                acquired = floor(previous_count * previous_ttl / expiry + current_count) + amount <= limit
+                if acquired:
+                    # The current window is still the previous window one period from now
+                    self._incr(conn, current_key, 2 * expiry, amount, now)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        self._maybe_purge(conn, now)
+        return acquired
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self._connection().execute('DELETE FROM rate_limits WHERE key IN (?, ?)', (previous_key, current_key))
+
+    def stats(self):
+        return dict(self._metrics, path=self.path, purge_interval=self.purge_interval)
+
+
+class LimiterTimings:
+    """Per-route time spent in rate-limit checks (hit, test, window stats)."""
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, strategy):
+        for name in ('hit', 'test', 'get_window_stats'):
+            setattr(strategy, name, self._timed(getattr(strategy, name)))
+        return strategy
+
+    def _timed(self, check):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return check(*args, **kwargs)
+            finally:
+                route = request.endpoint if has_request_context() else limiter_route.get()
+                self.record(route, time.perf_counter() - started)
+        return timed
+
+    def record(self, route, seconds):
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {'checks': 0, 'total_s': 0.0, 'max_s': 0.0}
+            entry['checks'] += 1
+            entry['total_s'] += seconds
+            entry['max_s'] = max(entry['max_s'], seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                str(route): {
+                    'checks': entry['checks'],
+                    'mean_us': round(entry['total_s'] / entry['checks'] * 1e6, 1),
+                    'max_us': round(entry['max_s'] * 1e6, 1),
+                    'total_ms': round(entry['total_s'] * 1e3, 3),
+                }
+                for route, entry in self._routes.items()
+            }
@@ -0,0 +1,708 @@
+"""User-sharded storage: wallets and transaction history over DB_SHARDS SQLite files.
+
+Every shard has the full schema (app.init_db). A user's wallet, the
+transactions they took part in, their counters, ledger and offline queue live
+on one shard, picked by hashing user_id into one of SHARD_BUCKETS buckets and
+looking the bucket up in the shard_map table. Shard 0 is DATABASE_PATH
+itself, which stays the home of the users table and the map, so DB_SHARDS=1
+is the single-file layout and every call below falls through to ledger.py.
+The other shards keep a copy of each users row (without the password hash)
+so history queries can join names and emails locally.
+
+A transfer between two users on the same shard is one transaction there, as
+before. When the receiver is on another shard, the sender's shard commits the
+debit, the sender's copy of the transaction and a transfer_outbox row in one
+transaction; that commit is the point of no return. The credit is then applied
+on the receiver's shard together with the receiver's copy of the transaction,
+keyed by the same transfer_key, so applying an outbox row twice is a no-op.
+Delivery runs right after the commit. The receiver's copy is the receipt, so
+deleting delivered rows from the outbox is left to OutboxRelay, in batches,
+together with retrying anything a crash or a busy shard left behind.
+If the receiver's wallet has gone, the sender is refunded with a 'reversal'
+transaction instead.
+
+Rebalancing moves whole buckets: ``python shards.py rebalance --shards N``.
+It copies each bucket's users to the new shard, switches the bucket in the
+map, then deletes the old copies; each step can be re-run after a crash. Run
+it with the app stopped, since running processes only read the map at start.
+Wallet and transaction ids are local to a shard and change when a user moves.
+"""
+import argparse
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime
+
+from db import DB_CONFIG, open_pool, pool
+from ledger import IN_CHUNK_SIZE, WalletNotFound, apply_transfers as apply_local_transfers, \
+    get_balances as get_local_balances, transfer as local_transfer
+
+SHARD_COUNT = int(os.getenv('DB_SHARDS', 1))
+# Shard n > 0 lives at DB_SHARD_PATH.format(n=n), next to DATABASE_PATH by default
+_root, _ext = os.path.splitext(DB_CONFIG['path'])
+SHARD_PATH = os.getenv('DB_SHARD_PATH', _root + '.shard{n}' + (_ext or '.db'))
+# Fixed for the life of a deployment: rebalancing moves buckets, never rehashes
+SHARD_BUCKETS = 1024
+
+DELIVERY_BATCH = 500
+
+
+class ShardMapError(Exception):
+    pass
+
+
+def bucket_of(user_id):
+    return zlib.crc32(int(user_id).to_bytes(8, 'little', signed=True)) % SHARD_BUCKETS
+
+
+def _chunks(items, size=IN_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ShardSet:
+    def __init__(self, count=1, path_template=SHARD_PATH, main_pool=pool):
+        if count < 1:
+            raise ValueError('DB_SHARDS must be at least 1')
+        self.count = count
+        self.pools = [main_pool] + [open_pool(path_template.format(n=n)) for n in range(1, count)]
+        self._map = [0] * SHARD_BUCKETS
+        # Called with the user ids whose balances the relay changed (cache invalidation)
+        self.on_delivered = None
+        self._lock = threading.Lock()
+        self._metrics = {'same_shard': 0, 'cross_shard': 0, 'delivered': 0, 'settled': 0,
+                         'reversed': 0, 'delivery_errors': 0, 'last_error': None}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def shard_of(self, user_id):
+        if self.count == 1:
+            return 0
+        return self._map[bucket_of(user_id)]
+
+    def connect(self, user_id):
+        """Pooled connection to the shard holding ``user_id``'s wallet and history."""
+        return self.pools[self.shard_of(user_id)].acquire()
+
+    def connect_shard(self, shard):
+        return self.pools[shard].acquire()
+
+    def load_map(self):
+        """Create the bucket map on first start, then read and validate it."""
+        conn = self.connect_shard(0)
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS shard_map
+                            (bucket INTEGER PRIMARY KEY,
+                             shard INTEGER NOT NULL)''')
+            conn.commit()
+            # Under the write lock, so workers starting together create the map once
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT COUNT(*) FROM shard_map').fetchone()[0] == 0:
+                # Existing data is all on shard 0 until a rebalance moves it
+                spread = self.count if conn.execute('SELECT 1 FROM wallets LIMIT 1').fetchone() is None else 1
+                conn.executemany('INSERT INTO shard_map (bucket, shard) VALUES (?, ?)',
+                                 [(bucket, bucket % spread) for bucket in range(SHARD_BUCKETS)])
+            conn.commit()
+            rows = conn.execute('SELECT bucket, shard FROM shard_map').fetchall()
+        finally:
+            conn.close()
+
+        shard_map = [0] * SHARD_BUCKETS
+        for bucket, shard in rows:
+            shard_map[bucket] = shard
+        highest = max(shard_map)
+        if highest >= self.count:
+            raise ShardMapError(
+                f'shard_map uses shard {highest} but DB_SHARDS={self.count}; '
+                f'start with DB_SHARDS={highest + 1} and run `python shards.py rebalance --shards {self.count}`'
+            )
+        self._map = shard_map
+        return shard_map
+
+    def add_user(self, conn, user_id, email, name, created_at):
+        """Copy a new user to every shard and open their wallet on its home shard.
+
+        ``conn`` is the shard 0 connection holding the uncommitted users row;
+        the caller commits it. Other shards commit here, and INSERT OR REPLACE
+        makes a retry after a failed registration overwrite the stale copy.
+        """
+        home = self.shard_of(user_id)
+        for shard in range(1, self.count):
+            shard_conn = self.connect_shard(shard)
+            try:
+                shard_conn.execute(
+                    'INSERT OR REPLACE INTO users (id, email, password, name, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (user_id, email, '', name, created_at)
+                )
+                if shard == home:
+                    shard_conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
+                                       (user_id, 0, created_at))
+                shard_conn.commit()
+            finally:
+                shard_conn.close()
+        if home == 0:
+            conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
+                         (user_id, 0, created_at))
+
+    def get_balances(self, conn, sender_id, *user_ids):
+        """ledger.get_balances across shards; ``conn`` is the connection for ``sender_id``'s shard."""
+        if self.count == 1:
+            return get_local_balances(conn, sender_id, *user_ids)
+        home = self.shard_of(sender_id)
+        by_shard = defaultdict(list)
+        for user_id in (sender_id, *user_ids):
+            by_shard[self.shard_of(user_id)].append(user_id)
+        balances = {}
+        for shard, ids in by_shard.items():
+            if shard == home:
+                balances.update(get_local_balances(conn, *ids))
+                continue
+            shard_conn = self.connect_shard(shard)
+            try:
+                balances.update(get_local_balances(shard_conn, *ids))
+            finally:
+                shard_conn.close()
+        return balances
+
+    def transfer(self, conn, sender_id, receiver_id, amount, transaction_type='transfer', description='',
+                 timestamp=None):
+        """ledger.transfer for users on any shards; ``conn`` is the connection for the sender's shard.
+
+        Same result dict. A cross-shard transfer commits on its own, so call it
+        without a transaction open; 'receiver_balance' is None (and the
+        receiver is missing from 'wallets') if the credit was left to the relay.
+        """
+        shard = self.shard_of(sender_id)
+        target = self.shard_of(receiver_id)
+        if shard == target:
+            if self.count > 1:
+                self._count('same_shard')
+            return local_transfer(conn, sender_id, receiver_id, amount, transaction_type, description, timestamp)
+
+        receiver_conn = self.connect_shard(target)
+        try:
+            if receiver_conn.execute('SELECT 1 FROM wallets WHERE user_id = ?', (receiver_id,)).fetchone() is None:
+                raise WalletNotFound()
+        finally:
+            receiver_conn.close()
+
+        timestamp = timestamp or datetime.utcnow().isoformat()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            posted = self._post(conn, shard, sender_id, [(receiver_id, amount, description, timestamp)],
+                                transaction_type)
+            sender = conn.execute('SELECT id, balance, version FROM wallets WHERE user_id = ?', (sender_id,)).fetchone()
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        self._count('cross_shard')
+
+        # Saves a commit per transfer: the relay deletes the delivered row later.
+        # The debit is committed by now, so a failure here must not fail the
+        # transfer: the outbox row stays and the relay finishes the credit
+        try:
+            credited, _ = self._deliver(shard, posted['outbox'], notify=False, settle=False)
+        except Exception as e:
+            credited = {}
+            self._count('delivery_errors')
+            with self._lock:
+                self._metrics['last_error'] = str(e)
+            # The credit may have landed before the failure; drop any cached balance
+            if self.on_delivered:
+                self.on_delivered(receiver_id)
+        receiver = credited.get(posted['outbox'][0]['transfer_key'])
+        wallets = [(sender_id, sender['id'], sender['balance'], sender['version'])]
+        if receiver is not None:
+            wallets.append(receiver)
+        return {
+            'transaction_id': posted['transaction_ids'][0],
+            'sender_balance': sender['balance'],
+            'receiver_balance': receiver[2] if receiver is not None else None,
+            'timestamp': timestamp,
+            'wallets': wallets
+        }
+
+    def apply_transfers(self, conn, sender_id, transfers, transaction_type='transfer'):
+        """ledger.apply_transfers for receivers on any shards.
+
+        Same contract: the caller holds BEGIN IMMEDIATE on the sender's shard and
+        commits. Credits for other shards go to the outbox in that transaction;
+        call deliver_pending(sender_id) after the commit. Also returns the
+        number of outbox rows written as 'outbox'.
+        """
+        if self.count == 1:
+            return dict(apply_local_transfers(conn, sender_id, transfers, transaction_type), outbox=0)
+        posted = self._post(conn, self.shard_of(sender_id), sender_id, transfers, transaction_type)
+        remote = len(posted['outbox'])
+        self._count('cross_shard', remote)
+        self._count('same_shard', len(transfers) - remote)
+        return dict(posted, outbox=remote)
+
+    def _post(self, conn, shard, sender_id, transfers, transaction_type):
+        # Receivers on other shards have no wallet here, so apply_transfers'
+        # credit and the ledger trigger skip them; the outbox carries the credit
+        posted = apply_local_transfers(conn, sender_id, transfers, transaction_type)
+        outbox = []
+        for transaction_id, (receiver_id, amount, description, timestamp) in zip(posted['transaction_ids'], transfers):
+            target = self.shard_of(receiver_id)
+            if target != shard:
+                outbox.append({
+                    'transaction_id': transaction_id, 'transfer_key': f'{shard}:{transaction_id}', 'shard': target,
+                    'sender_id': sender_id, 'receiver_id': receiver_id, 'amount': amount, 'timestamp': timestamp,
+                    'transaction_type': transaction_type, 'description': description
+                })
+        if outbox:
+            conn.executemany('UPDATE transactions SET transfer_key = ? WHERE id = ?',
+                             [(row['transfer_key'], row['transaction_id']) for row in outbox])
+            for row in outbox:
+                row['id'] = conn.execute('''
+                    INSERT INTO transfer_outbox
+                        (transfer_key, shard, sender_id, receiver_id, amount, timestamp, transaction_type, description)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (row['transfer_key'], row['shard'], sender_id, row['receiver_id'], row['amount'],
+                      row['timestamp'], transaction_type, row['description'])).lastrowid
+        return dict(posted, outbox=outbox)
+
+    def deliver_pending(self, user_id):
+        """Deliver the outbox of ``user_id``'s shard; returns the number of rows settled."""
+        return self.deliver(self.shard_of(user_id))
+
+    def deliver(self, shard, limit=DELIVERY_BATCH):
+        """Deliver up to ``limit`` outbox rows of ``shard``; returns the number settled."""
+        conn = self.connect_shard(shard)
+        try:
+            rows = [dict(row) for row in conn.execute(
+                'SELECT * FROM transfer_outbox ORDER BY id LIMIT ?', (limit,)
+            ).fetchall()]
+        finally:
+            conn.close()
+        if not rows:
+            return 0
+        return self._deliver(shard, rows, notify=True)[1]
+
+    def _deliver(self, shard, rows, notify, settle=True):
+        """Apply outbox ``rows`` of ``shard`` on their target shards, then settle them at the source.
+
+        Returns ({transfer_key: (user_id, wallet_id, balance, version)} for the
+        receivers credited, rows settled). Rows whose target shard fails stay
+        in the outbox with the error recorded, for the next attempt. With
+        ``settle`` off, delivered rows stay in the outbox for the relay to
+        delete; refunds and errors are still recorded at once.
+        """
+        credited = {}
+        settled = []
+        rejected = []
+        failed = []
+        by_target = defaultdict(list)
+        for row in rows:
+            by_target[row['shard']].append(row)
+
+        for target, group in by_target.items():
+            group_credited = {}
+            group_settled = []
+            group_rejected = []
+            conn = self.connect_shard(target)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for row in group:
+                    # The receiver's copy doubles as the delivery receipt
+                    if conn.execute('SELECT 1 FROM transactions WHERE transfer_key = ?',
+                                    (row['transfer_key'],)).fetchone():
+                        group_settled.append(row)
+                        continue
+                    wallet = conn.execute(
+                        'UPDATE wallets SET balance = balance + ?, version = version + 1 '
+                        'WHERE user_id = ? RETURNING id, balance, version',
+                        (row['amount'], row['receiver_id'])
+                    ).fetchone()
+                    if wallet is None:
+                        group_rejected.append(row)
+                        continue
+                    conn.execute('''
+                        INSERT INTO transactions
+                            (sender_id, receiver_id, amount, timestamp, status, transaction_type, description, transfer_key)
+                        VALUES (?, ?, ?, ?, 'completed', ?, ?, ?)
+                    ''', (row['sender_id'], row['receiver_id'], row['amount'], row['timestamp'],
+                          row['transaction_type'], row['description'], row['transfer_key']))
+                    group_credited[row['transfer_key']] = (row['receiver_id'], wallet['id'], wallet['balance'],
+                                                           wallet['version'])
+                    group_settled.append(row)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                failed.append((group, str(e)))
+                continue
+            finally:
+                conn.close()
+            credited.update(group_credited)
+            settled += group_settled
+            rejected += group_rejected
+
+        refunded = self._settle(shard, settled if settle else [], rejected, failed)
+        self._count('delivered', len(credited))
+        if self.on_delivered:
+            touched = set(refunded)
+            if notify:
+                touched.update(user_id for user_id, _, _, _ in credited.values())
+            if touched:
+                self.on_delivered(*touched)
+        return credited, len(settled) + len(rejected)
+
+    def _settle(self, shard, settled, rejected, failed):
+        refunded = []
+        if not (settled or rejected or failed):
+            return refunded
+        conn = self.connect_shard(shard)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('DELETE FROM transfer_outbox WHERE id = ?', [(row['id'],) for row in settled])
+            for row in rejected:
+                # Deleting the row first makes the refund happen once, whoever gets here first
+                if conn.execute('DELETE FROM transfer_outbox WHERE id = ?', (row['id'],)).rowcount == 0:
+                    continue
+                conn.execute('UPDATE wallets SET balance = balance + ?, version = version + 1 WHERE user_id = ?',
+                             (row['amount'], row['sender_id']))
+                conn.execute('''
+                    INSERT INTO transactions (sender_id, receiver_id, amount, timestamp, status, transaction_type, description)
+                    VALUES (?, ?, ?, ?, 'completed', 'reversal', ?)
+                ''', (row['receiver_id'], row['sender_id'], row['amount'], datetime.utcnow().isoformat(),
+                      'Reversal: receiver wallet not found'))
+                refunded.append(row['sender_id'])
+            for group, error in failed:
+                conn.executemany('UPDATE transfer_outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                                 [(error, row['id']) for row in group])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self._count('settled', len(settled) + len(refunded))
+        self._count('reversed', len(refunded))
+        if failed:
+            self._count('delivery_errors', sum(len(group) for group, _ in failed))
+            with self._lock:
+                self._metrics['last_error'] = failed[-1][1]
+        return refunded
+
+    def pending(self):
+        """{shard: outbox rows not yet settled}."""
+        counts = {}
+        for shard in range(self.count):
+            conn = self.connect_shard(shard)
+            try:
+                counts[shard] = conn.execute('SELECT COUNT(*) FROM transfer_outbox').fetchone()[0]
+            finally:
+                conn.close()
+        return counts
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        buckets = [0] * self.count
+        for shard in self._map:
+            buckets[shard] += 1
+        return dict(metrics, shards=self.count, buckets=buckets,
+                    pools=[shard_pool.stats() for shard_pool in self.pools[1:]])
+
+    # Rebalancing
+
+    def rebalance(self, target_count=None, dry_run=False, log=print):
+        """Spread the buckets evenly over the first ``target_count`` shards, moving their users.
+
+        Every bucket is moved in three steps: copy its users to the new shard,
+        point the bucket at it, delete the old copies. A bucket that was copied
+        but not switched is detected by its wallets already being on the new
+        shard; one that was switched but not cleaned up is caught by the sweep
+        at the end. Returns {(from, to): users moved}.
+        """
+        target_count = target_count or self.count
+        if not 1 <= target_count <= self.count:
+            raise ShardMapError(f'--shards must be between 1 and DB_SHARDS={self.count}')
+        for shard in range(self.count):
+            while self.deliver(shard) == DELIVERY_BATCH:
+                pass
+        pending = {shard: rows for shard, rows in self.pending().items() if rows}
+        if pending:
+            raise ShardMapError(f'Outbox rows could not be delivered on shards {pending}; see `python shards.py status`')
+
+        conn = self.connect_shard(0)
+        users = [tuple(row) for row in conn.execute('SELECT id, email, name, created_at FROM users ORDER BY id')]
+        conn.close()
+        by_bucket = defaultdict(list)
+        for user in users:
+            by_bucket[bucket_of(user[0])].append(user[0])
+
+        moves = [(bucket, self._map[bucket], bucket % target_count) for bucket in range(SHARD_BUCKETS)
+                 if self._map[bucket] != bucket % target_count]
+        summary = defaultdict(int)
+        for bucket, source, target in moves:
+            summary[(source, target)] += len(by_bucket[bucket])
+        for (source, target), moved in sorted(summary.items()):
+            log(f'shard {source} -> {target}: {moved} users')
+        if dry_run:
+            return dict(summary)
+
+        # New shard files start without the user directory
+        for shard in range(1, self.count):
+            shard_conn = self.connect_shard(shard)
+            try:
+                shard_conn.executemany(
+                    'INSERT OR REPLACE INTO users (id, email, password, name, created_at) VALUES (?, ?, ?, ?, ?)',
+                    [(user_id, email, '', name, created_at) for user_id, email, name, created_at in users]
+                )
+                shard_conn.commit()
+            finally:
+                shard_conn.close()
+
+        started = time.perf_counter()
+        for index, (bucket, source, target) in enumerate(moves, 1):
+            user_ids = by_bucket[bucket]
+            for chunk in _chunks(user_ids):
+                self._copy_users(source, target, chunk)
+            conn = self.connect_shard(0)
+            conn.execute('UPDATE shard_map SET shard = ? WHERE bucket = ?', (target, bucket))
+            conn.commit()
+            conn.close()
+            self._map[bucket] = target
+            for chunk in _chunks(user_ids):
+                self._remove_users(source, chunk)
+            if index % 64 == 0:
+                log(f'{index}/{len(moves)} buckets moved ({time.perf_counter() - started:.1f}s)')
+
+        for shard in range(self.count):
+            shard_conn = self.connect_shard(shard)
+            strays = [user_id for (user_id,) in shard_conn.execute('SELECT user_id FROM wallets')
+                      if self.shard_of(user_id) != shard]
+            shard_conn.close()
+            for chunk in _chunks(strays):
+                self._remove_users(shard, chunk)
+        log(f'Moved {len(moves)} buckets in {time.perf_counter() - started:.1f}s')
+        return dict(summary)
+
+    def _history(self, conn, user_ids):
+        rows = {}
+        for chunk in _chunks(user_ids):
+            placeholders = ', '.join('?' for _ in chunk)
+            for row in conn.execute(f'''
+                SELECT * FROM transactions WHERE sender_id IN ({placeholders})
+                UNION
+                SELECT * FROM transactions WHERE receiver_id IN ({placeholders})
+            ''', chunk + chunk):
+                rows[row['id']] = row
+        return [rows[key] for key in sorted(rows)]
+
+    def _copy_users(self, source, target, user_ids):
+        """Copy wallets, history, ledger and offline queue of ``user_ids`` in one target transaction."""
+        source_conn = self.connect_shard(source)
+        target_conn = self.connect_shard(target)
+        try:
+            placeholders = ', '.join('?' for _ in user_ids)
+            copied = {row[0] for row in target_conn.execute(
+                f'SELECT user_id FROM wallets WHERE user_id IN ({placeholders})', user_ids)}
+            user_ids = [user_id for user_id in user_ids if user_id not in copied]
+            if not user_ids:
+                return
+            moving_ids = set(user_ids)
+            placeholders = ', '.join('?' for _ in user_ids)
+            wallets = source_conn.execute(
+                f'SELECT * FROM wallets WHERE user_id IN ({placeholders})', user_ids).fetchall()
+
+            target_conn.execute('BEGIN IMMEDIATE')
+            # History goes first, while the moved wallets do not exist here yet,
+            # so the posting trigger leaves their ledger to the copy below
+            transaction_ids = {}
+            for row in self._history(source_conn, user_ids):
+                key = row['transfer_key']
+                moving = row['sender_id'] in moving_ids and row['receiver_id'] in moving_ids
+                if key is None and not moving:
+                    # The other side stays behind; _remove_users keys that copy the same way
+                    key = f'{source}:{row["id"]}'
+                cursor = target_conn.execute('''
+                    INSERT OR IGNORE INTO transactions
+                        (sender_id, receiver_id, amount, timestamp, status, transaction_type, description, transfer_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (row['sender_id'], row['receiver_id'], row['amount'], row['timestamp'], row['status'],
+                      row['transaction_type'], row['description'], key))
+                if cursor.rowcount:
+                    transaction_ids[row['id']] = cursor.lastrowid
+                else:
+                    transaction_ids[row['id']] = target_conn.execute(
+                        'SELECT id FROM transactions WHERE transfer_key = ?', (key,)).fetchone()[0]
+
+            for wallet in wallets:
+                # Opened at zero so no 'opening' entry is posted; the entries are copied instead
+                wallet_id = target_conn.execute(
+                    'INSERT INTO wallets (user_id, balance, created_at, version) VALUES (?, 0, ?, ?)',
+                    (wallet['user_id'], wallet['created_at'], wallet['version'])
+                ).lastrowid
+                target_conn.executemany('''
+                    INSERT INTO ledger_entries (wallet_id, transaction_id, entry_type, amount, posted_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [
+                    (wallet_id, transaction_ids.get(entry['transaction_id']), entry['entry_type'], entry['amount'],
+                     entry['posted_at'])
+                    for entry in source_conn.execute(
+                        'SELECT * FROM ledger_entries WHERE wallet_id = ? ORDER BY id', (wallet['id'],))
+                ])
+                # Bumping version with the balance keeps the adjustment trigger quiet
+                target_conn.execute('UPDATE wallets SET balance = ?, version = version + 1 WHERE id = ?',
+                                    (wallet['balance'], wallet_id))
+
+            # Counters are recounted: rows already here were not inserted again
+            target_conn.execute(f'DELETE FROM transaction_counters WHERE user_id IN ({placeholders})', user_ids)
+            target_conn.execute(f'''
+                INSERT INTO transaction_counters (user_id, status, transaction_type, count)
+                SELECT user_id, status, transaction_type, COUNT(*) FROM (
+                    SELECT sender_id AS user_id, status, transaction_type FROM transactions
+                    WHERE sender_id IN ({placeholders})
+                    UNION ALL
+                    SELECT receiver_id, status, transaction_type FROM transactions
+                    WHERE receiver_id IN ({placeholders}) AND receiver_id <> sender_id
+                ) GROUP BY user_id, status, transaction_type
+            ''', user_ids + user_ids)
+
+            target_conn.executemany('''
+                INSERT INTO offline_transactions (sender_id, receiver_id, amount, timestamp, description, qr_data)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (row['sender_id'], row['receiver_id'], row['amount'], row['timestamp'], row['description'],
+                 row['qr_data'])
+                for row in source_conn.execute(
+                    f'SELECT * FROM offline_transactions WHERE sender_id IN ({placeholders}) ORDER BY id', user_ids)
+            ])
+            target_conn.commit()
+        except Exception:
+            target_conn.rollback()
+            raise
+        finally:
+            source_conn.close()
+            target_conn.close()
+
+    def _remove_users(self, shard, user_ids):
+        """Drop ``shard``'s copies of users that now live elsewhere.
+
+        Transactions with a party still on this shard stay, keyed like the copy
+        made by _copy_users. Ledger entries are append-only and stay too, under
+        the old wallet id.
+        """
+        conn = self.connect_shard(shard)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            placeholders = ', '.join('?' for _ in user_ids)
+            deleted = []
+            keyed = []
+            for row in self._history(conn, user_ids):
+                if self.shard_of(row['sender_id']) != shard and self.shard_of(row['receiver_id']) != shard:
+                    deleted.append((row['id'],))
+                elif row['transfer_key'] is None:
+                    keyed.append((f'{shard}:{row["id"]}', row['id']))
+            conn.executemany('DELETE FROM transactions WHERE id = ?', deleted)
+            conn.executemany('UPDATE transactions SET transfer_key = ? WHERE id = ?', keyed)
+            conn.execute(f'DELETE FROM wallets WHERE user_id IN ({placeholders})', user_ids)
+            conn.execute(f'DELETE FROM transaction_counters WHERE user_id IN ({placeholders})', user_ids)
+            conn.execute(f'DELETE FROM offline_transactions WHERE sender_id IN ({placeholders})', user_ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+class OutboxRelay:
+    """Background thread that delivers every shard's outbox every ``interval`` seconds.
+
+    Transfers deliver their own rows right after committing; this picks up
+    whatever a crash or a busy shard left behind. An interval of 0 disables
+    the thread and leaves run_once() for cron-style use.
+    """
+
+    def __init__(self, shards, interval=5.0):
+        self.shards = shards
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics = {'runs': 0, 'delivered': 0, 'errors': 0, 'last_run_ms': 0.0, 'last_error': None}
+
+    def start(self):
+        with self._lock:
+            if self.interval <= 0 or self.shards.count == 1 or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='outbox-relay', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        started = time.perf_counter()
+        delivered = 0
+        for shard in range(self.shards.count):
+            # A short batch means the outbox is drained or a target shard is failing
+            while True:
+                settled = self.shards.deliver(shard)
+                delivered += settled
+                if settled < DELIVERY_BATCH:
+                    break
+        with self._lock:
+            self._metrics['runs'] += 1
+            self._metrics['delivered'] += delivered
+            self._metrics['last_run_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return delivered
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._metrics['errors'] += 1
+                    self._metrics['last_error'] = str(e)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, interval=self.interval,
+                        running=self._thread is not None and self._thread.is_alive())
+
+
+shard_set = ShardSet(SHARD_COUNT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and rebalance the SME Wallet shards')
+    parser.add_argument('command', choices=['status', 'deliver', 'rebalance'])
+    parser.add_argument('--shards', type=int, help='rebalance: spread buckets over this many shards '
+                                                   '(default DB_SHARDS; lower it to drain the last shards)')
+    parser.add_argument('--dry-run', action='store_true', help='rebalance: only print what would move')
+    args = parser.parse_args()
+
+    # The schema is created by app.init_db; use the ShardSet instance app imported
+    import app as wallet_app
+    wallet_app.init_db()
+    shards = wallet_app.shard_set
+
+    if args.command == 'rebalance':
+        shards.rebalance(args.shards, dry_run=args.dry_run)
+    elif args.command == 'deliver':
+        print(f'Delivered {OutboxRelay(shards, interval=0).run_once()} outbox rows')
+
+    pending = shards.pending()
+    for shard in range(shards.count):
+        conn = shards.connect_shard(shard)
+        wallets = conn.execute('SELECT COUNT(*) FROM wallets').fetchone()[0]
+        transactions = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+        conn.close()
+        print(f'shard {shard}: {shards.stats()["buckets"][shard]} buckets, {wallets} wallets, '
+              f'{transactions} transactions, {pending[shard]} pending outbox rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Point the app at scratch files before anything imports db.py or app.py
+_scratch = tempfile.mkdtemp(prefix='sme_wallet_tests_')
+os.environ.setdefault('DATABASE_PATH', os.path.join(_scratch, 'wallet.db'))
+os.environ.setdefault('RATELIMIT_STORAGE_URI', 'memory://')
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,19 @@
+from balance_cache import BalanceCache
+
+
+def test_commit_in_one_worker_invalidates_the_others(tmp_path):
+    # Two caches on one board file stand in for two worker processes
+    board = str(tmp_path / 'wallet.db-gen')
+    first = BalanceCache(slots=64, board_path=board)
+    second = BalanceCache(slots=64, board_path=board)
+
+    generation = second.generation(7)
+    second.put(7, 70, 5000, 1, generation)
+    assert second.get(7)['balance'] == 5000
+
+    generations = first.generations(7, 8)
+    first.write_through([(7, 70, 4000, 2), (8, 80, 1000, 2)], generations)
+
+    assert second.get(7) is None
+    assert first.get(7)['balance'] == 4000
+    assert second.stats()['shared']
@@ -0,0 +1,75 @@
+import random
+import sqlite3
+import threading
+
+from app import create_tables
+from ledger import TransferError, reconcile, transfer
+
+WALLETS = 10
+INITIAL_BALANCE = 10000
+THREADS = 8
+TRANSFERS_PER_THREAD = 150
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def test_concurrent_transfers_never_overdraw_or_lose_money(tmp_path):
+    path = tmp_path / 'ledger.db'
+    conn = connect(path)
+    create_tables(conn)
+    for user_id in range(1, WALLETS + 1):
+        conn.execute('INSERT INTO users (id, email, password, name, created_at) VALUES (?, ?, ?, ?, ?)',
+                     (user_id, f'user{user_id}@example.com', 'x', f'User {user_id}', '2025-01-01T00:00:00'))
+        conn.execute('INSERT INTO wallets (user_id, balance, created_at) VALUES (?, ?, ?)',
+                     (user_id, INITIAL_BALANCE, '2025-01-01T00:00:00'))
+    conn.commit()
+
+    succeeded = []
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        worker_conn = connect(path)
+        try:
+            for _ in range(TRANSFERS_PER_THREAD):
+                sender_id, receiver_id = rng.sample(range(1, WALLETS + 1), 2)
+                # Often more than the sender holds, so the overdraft check is exercised
+                amount = rng.randint(1, INITIAL_BALANCE)
+                try:
+                    transfer(worker_conn, sender_id, receiver_id, amount)
+                    succeeded.append((sender_id, receiver_id, amount))
+                except TransferError:
+                    pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            worker_conn.close()
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert succeeded
+
+    balances = dict(conn.execute('SELECT user_id, balance FROM wallets').fetchall())
+    assert min(balances.values()) >= 0
+    assert sum(balances.values()) == WALLETS * INITIAL_BALANCE
+
+    # No lost updates: every stored balance is the opening balance plus what the
+    # successful transfers moved
+    expected = {user_id: INITIAL_BALANCE for user_id in balances}
+    for sender_id, receiver_id, amount in succeeded:
+        expected[sender_id] -= amount
+        expected[receiver_id] += amount
+    assert balances == expected
+    assert conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0] == len(succeeded)
+    assert reconcile(conn) == []
+    conn.close()
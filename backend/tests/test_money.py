@@ -0,0 +1,15 @@
+import pytest
+
+from money import MAX_MINOR, InvalidAmount, to_minor
+
+
+@pytest.mark.parametrize('value, expected', [(0.29, 29), ('1250.75', 125075), ('1E+2', 10000), (MAX_MINOR // 100, MAX_MINOR)])
+def test_to_minor(value, expected):
+    assert to_minor(value) == expected
+
+
+@pytest.mark.parametrize('value', ['abc', 'NaN', 'Infinity', True, None, '12.345',
+                                   '1e19', 1e19, '1e999990', '1e5000000', '-1e5000000'])
+def test_to_minor_rejects(value):
+    with pytest.raises(InvalidAmount):
+        to_minor(value)
@@ -0,0 +1,14 @@
+import sqlite3
+
+from app import create_tables
+from migrations import HOT_QUERIES, MIGRATIONS, check_query_plans, current_version
+
+
+def test_every_hot_query_uses_an_index(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'plans.db')
+    create_tables(conn)
+
+    assert current_version(conn) == MIGRATIONS[-1][0]
+    assert HOT_QUERIES
+    assert check_query_plans(conn) == {}
+    conn.close()
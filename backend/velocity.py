@@ -0,0 +1,337 @@
+"""Per-user velocity features for fraud scoring, kept in memory.
+
+For every sender the store keeps rolling aggregates of their outgoing
+transfers:
+
+- transfers in the last hour, as VELOCITY_BUCKETS five-minute counters in a
+  ring (so "the last hour" is the current bucket and the eleven before it);
+- distinct receivers since midnight UTC, as a set (capped at
+  VELOCITY_MAX_TRACKED_RECEIVERS);
+- an exponentially decayed mean and variance of log(amount), so a 10x jump
+  scores the same for a market trader as for a wholesaler.
+
+record() folds one committed transfer in O(1); features() reads them for the
+scoring path without touching SQLite. VelocitySync builds the store from
+history in one streaming pass over each shard's transactions (by id) and then
+tails new rows, which picks up transfers committed by other worker processes.
+Rows this process already recorded are skipped, so nothing is counted twice.
+Only each transfer's copy on the sender's home shard is counted; receipts of
+cross-shard transfers and 'reversal' refunds are not.
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+VELOCITY_BUCKET_SECONDS = 300
+VELOCITY_BUCKETS = 12
+VELOCITY_MAX_TRACKED_RECEIVERS = 1024
+# Transfers it takes for an old amount's weight in the mean to halve
+VELOCITY_HALF_LIFE = float(os.getenv('VELOCITY_HALF_LIFE', 50))
+# Fewer transfers than this and the z-score is reported as 0
+VELOCITY_MIN_HISTORY = int(os.getenv('VELOCITY_MIN_HISTORY', 20))
+# Floor on the standard deviation, in log units, for senders who always pay the same
+VELOCITY_MIN_STDDEV = 0.5
+
+# Optional rule thresholds applied by fraud.score_transactions(). All are 0
+# (off) by default: the features are always computed and passed to scoring,
+# but nothing is refused on them unless a deployment opts in.
+VELOCITY_MAX_HOURLY = int(os.getenv('VELOCITY_MAX_HOURLY', 0))
+VELOCITY_MAX_RECEIVERS = int(os.getenv('VELOCITY_MAX_RECEIVERS', 0))
+VELOCITY_MAX_ZSCORE = float(os.getenv('VELOCITY_MAX_ZSCORE', 0))
+
+SYNC_BATCH = 5000
+
+
+def _epoch(timestamp):
+    """Seconds since the epoch for an ISO timestamp; naive ones are UTC, as datetime.utcnow() writes them."""
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class _Sender:
+    __slots__ = ('slot', 'counts', 'hourly', 'day', 'receivers', 'transfers', 'mean', 'variance')
+
+    def __init__(self):
+        self.slot = 0
+        self.counts = None
+        self.hourly = 0
+        self.day = 0
+        self.receivers = None
+        self.transfers = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def advance(self, slot):
+        # Zeroes the buckets that fell out of the hour; at most VELOCITY_BUCKETS steps
+        if self.counts is None or slot <= self.slot:
+            return
+        if slot - self.slot >= VELOCITY_BUCKETS:
+            # Idle for an hour: drop the ring until the next transfer
+            self.counts = None
+            self.hourly = 0
+        else:
+            for step in range(self.slot + 1, slot + 1):
+                index = step % VELOCITY_BUCKETS
+                self.hourly -= self.counts[index]
+                self.counts[index] = 0
+        self.slot = slot
+
+    def add(self, receiver_id, value, moment):
+        if moment is not None:
+            slot = int(moment // VELOCITY_BUCKET_SECONDS)
+            self.advance(slot)
+            if self.counts is None:
+                self.counts = [0] * VELOCITY_BUCKETS
+                self.slot = slot
+            if slot > self.slot - VELOCITY_BUCKETS:
+                self.counts[slot % VELOCITY_BUCKETS] += 1
+                self.hourly += 1
+
+            day = int(moment // 86400)
+            if day > self.day:
+                self.day = day
+                self.receivers = set()
+            if day == self.day and len(self.receivers) < VELOCITY_MAX_TRACKED_RECEIVERS:
+                self.receivers.add(receiver_id)
+
+        # West's incremental update of an exponentially weighted mean and variance
+        if self.transfers == 0:
+            self.mean = value
+        else:
+            alpha = 1 - 0.5 ** (1 / VELOCITY_HALF_LIFE)
+            delta = value - self.mean
+            self.mean += alpha * delta
+            self.variance = (1 - alpha) * (self.variance + alpha * delta * delta)
+        self.transfers += 1
+
+    def copy(self):
+        sender = _Sender()
+        for name in self.__slots__:
+            setattr(sender, name, getattr(self, name))
+        sender.counts = list(self.counts) if self.counts is not None else None
+        sender.receivers = set(self.receivers) if self.receivers is not None else None
+        return sender
+
+    def features(self, amount, now):
+        self.advance(int(now // VELOCITY_BUCKET_SECONDS))
+        receivers = len(self.receivers) if self.day == int(now // 86400) and self.receivers else 0
+        zscore = 0.0
+        if self.transfers >= VELOCITY_MIN_HISTORY:
+            stddev = max(math.sqrt(self.variance), VELOCITY_MIN_STDDEV)
+            zscore = (math.log(max(amount, 1)) - self.mean) / stddev
+        return {
+            'transfersLastHour': self.hourly,
+            'receiversToday': receivers,
+            'amountZScore': round(zscore, 3),
+            'transferHistory': self.transfers
+        }
+
+
+class VelocityProjection:
+    """A sender's aggregates plus transfers that are planned but not committed.
+
+    Scores the items of a batch or offline sync one by one, each seeing the
+    ones before it; add() touches only this private copy, never the store.
+    """
+
+    def __init__(self, sender):
+        self._sender = sender
+
+    def features(self, amount, now=None):
+        return self._sender.features(amount, now if now is not None else time.time())
+
+    def add(self, receiver_id, amount, now=None):
+        self._sender.add(receiver_id, math.log(max(amount, 1)), now if now is not None else time.time())
+
+
+class VelocityStore:
+    """Rolling per-sender aggregates; see the module docstring.
+
+    ``home_shard`` maps a user id to the shard holding their own copy of
+    their transfers (ShardSet.shard_of).
+    """
+
+    def __init__(self, home_shard=lambda user_id: 0):
+        self.home_shard = home_shard
+        self._senders = {}
+        self._lock = threading.Lock()
+        # Per shard: highest transaction id folded by sync(), and ids above it
+        # that record() already folded; only kept while something tails
+        self._cursors = {}
+        self._recorded = {}
+        self.tailing = True
+        self._metrics = {'recorded': 0, 'synced': 0, 'lookups': 0, 'projections': 0}
+
+    def record(self, shard, transaction_id, sender_id, receiver_id, amount, timestamp):
+        """Fold one committed transfer, as posted on ``shard`` under ``transaction_id``."""
+        with self._lock:
+            self._record(shard, transaction_id, sender_id, receiver_id, amount, timestamp)
+
+    def record_many(self, shard, sender_id, transaction_ids, transfers):
+        """record() for an apply_transfers() batch: ``transfers`` are its (receiver_id, amount, description, timestamp)."""
+        with self._lock:
+            for transaction_id, (receiver_id, amount, _, timestamp) in zip(transaction_ids, transfers):
+                self._record(shard, transaction_id, sender_id, receiver_id, amount, timestamp)
+
+    def _record(self, shard, transaction_id, sender_id, receiver_id, amount, timestamp):
+        recorded = self._recorded.setdefault(shard, set())
+        if transaction_id <= self._cursors.get(shard, 0) or transaction_id in recorded:
+            return
+        if self.tailing:
+            recorded.add(transaction_id)
+        self._fold(sender_id, receiver_id, amount, timestamp)
+        self._metrics['recorded'] += 1
+
+    def _fold(self, sender_id, receiver_id, amount, timestamp):
+        sender = self._senders.get(sender_id)
+        if sender is None:
+            sender = self._senders[sender_id] = _Sender()
+        sender.add(receiver_id, math.log(max(amount, 1)), _epoch(timestamp))
+
+    def sync(self, conn, shard, batch=SYNC_BATCH):
+        """Fold ``shard``'s transactions newer than the last sync, streamed in id order; returns rows folded.
+
+        The first call for a shard is the full rebuild.
+        """
+        folded = 0
+        while True:
+            with self._lock:
+                cursor = self._cursors.get(shard, 0)
+            rows = conn.execute('''
+                SELECT id, sender_id, receiver_id, amount, timestamp FROM transactions
+                WHERE id > ? AND status = 'completed' AND transaction_type <> 'reversal'
+                ORDER BY id LIMIT ?
+            ''', (cursor, batch)).fetchall()
+            if not rows:
+                return folded
+            with self._lock:
+                recorded = self._recorded.setdefault(shard, set())
+                for transaction_id, sender_id, receiver_id, amount, timestamp in rows:
+                    if transaction_id in recorded:
+                        recorded.discard(transaction_id)
+                    elif self.home_shard(sender_id) == shard:
+                        self._fold(sender_id, receiver_id, amount, timestamp)
+                        folded += 1
+                self._cursors[shard] = rows[-1][0]
+                self._metrics['synced'] += folded
+            if len(rows) < batch:
+                return folded
+
+    def stop_tailing(self):
+        with self._lock:
+            self.tailing = False
+            self._recorded.clear()
+
+    def features(self, sender_id, amount, now=None):
+        """Velocity inputs for scoring a transfer of ``amount`` (minor units) by ``sender_id``, as of ``now``."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._metrics['lookups'] += 1
+            sender = self._senders.get(sender_id)
+            if sender is None:
+                return {'transfersLastHour': 0, 'receiversToday': 0, 'amountZScore': 0.0, 'transferHistory': 0}
+            return sender.features(amount, now)
+
+    def projection(self, sender_id):
+        """VelocityProjection starting from ``sender_id``'s current aggregates."""
+        with self._lock:
+            self._metrics['projections'] += 1
+            sender = self._senders.get(sender_id)
+            return VelocityProjection(sender.copy() if sender is not None else _Sender())
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._metrics,
+                senders=len(self._senders),
+                pending_ids=sum(len(ids) for ids in self._recorded.values()),
+                cursors=dict(self._cursors)
+            )
+
+
+def velocity_result(transaction):
+    """Rule-based verdict from the velocity inputs of a scored transaction, or None if no rule trips."""
+    if 'transfersLastHour' not in transaction:
+        return None
+    if VELOCITY_MAX_HOURLY and transaction['transfersLastHour'] >= VELOCITY_MAX_HOURLY:
+        return {'is_fraud': True, 'confidence': 0.8, 'reason': 'Unusually many transfers in the last hour'}
+    if VELOCITY_MAX_RECEIVERS and transaction['receiversToday'] >= VELOCITY_MAX_RECEIVERS:
+        return {'is_fraud': True, 'confidence': 0.8, 'reason': 'Unusually many receivers today'}
+    if VELOCITY_MAX_ZSCORE and transaction['amountZScore'] > VELOCITY_MAX_ZSCORE:
+        return {'is_fraud': True, 'confidence': 0.8, 'reason': 'Amount far above this sender\'s usual'}
+    return None
+
+
+class VelocitySync:
+    """Background thread that keeps a VelocityStore in step with the database.
+
+    The first run streams every shard's history into the store; later runs,
+    every ``interval`` seconds, fold rows committed since (by other worker
+    processes; this one records its own on commit). ``connect`` is a list of
+    callables returning a connection, one per shard. An interval of 0 runs
+    the rebuild only.
+    """
+
+    def __init__(self, store, connect, interval=5.0):
+        self.store = store
+        self.connect = connect
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics = {'runs': 0, 'folded': 0, 'errors': 0, 'rebuild_ms': None, 'last_run_ms': 0.0,
+                         'last_error': None}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='velocity-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        started = time.perf_counter()
+        folded = 0
+        for shard, connect in enumerate(self.connect):
+            conn = connect()
+            try:
+                folded += self.store.sync(conn, shard)
+            finally:
+                conn.close()
+        elapsed = round((time.perf_counter() - started) * 1000, 2)
+        with self._lock:
+            self._metrics['runs'] += 1
+            self._metrics['folded'] += folded
+            self._metrics['last_run_ms'] = elapsed
+            if self._metrics['rebuild_ms'] is None:
+                self._metrics['rebuild_ms'] = elapsed
+        return folded
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._metrics['errors'] += 1
+                    self._metrics['last_error'] = str(e)
+            if self.interval <= 0:
+                self.store.stop_tailing()
+                return
+            if self._stop.wait(self.interval):
+                return
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, interval=self.interval,
+                        running=self._thread is not None and self._thread.is_alive())
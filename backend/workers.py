@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+class PoolSaturated(Exception):
+    def __init__(self, pool_name, retry_after):
+        super().__init__(f'{pool_name} worker pool is saturated')
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """Executor for CPU-bound work with a bounded backlog.
+
+    At most ``max_workers + max_queue`` calls may be in flight; anything beyond
+    that is rejected immediately with PoolSaturated instead of piling up
+    behind the request threads. A call the caller gave up on (timeout) keeps
+    its slot until it has actually finished running. ``kind`` is 'process' (default, sidesteps
+    the GIL), 'thread', or 'inline' (run on the caller, e.g. in development).
+    """
+
+    def __init__(self, name, max_workers=2, max_queue=16, kind='process', timeout=10.0, retry_after=1):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._executor = None
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._latencies = deque(maxlen=1024)
+        self._metrics = {
+            'submitted': 0,
+            'completed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'in_flight': 0,
+            'latency_max_ms': 0.0,
+        }
+
+    def _get_executor(self):
+        # Created on first use so workers are never forked from a pre-fork master.
+        # First use is a request thread, with the fraud batcher, velocity sync,
+        # compactor and relay threads already running; a fork could copy one of
+        # their locks into a worker while held, so workers are spawned instead
+        # (spawn, unlike forkserver, also hands them the parent's sys.path)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == 'process':
+                        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                             mp_context=multiprocessing.get_context('spawn'))
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                            thread_name_prefix=f'{self.name}-pool')
+        return self._executor
+
+    def _count(self, name, amount=1):
+        with self._metrics_lock:
+            self._metrics[name] += amount
+
+    def _release(self, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._metrics_lock:
+            self._latencies.append(elapsed_ms)
+            self._metrics['latency_max_ms'] = max(self._metrics['latency_max_ms'], round(elapsed_ms, 3))
+            self._metrics['in_flight'] -= 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise PoolSaturated(self.name, self.retry_after)
+
+        started = time.perf_counter()
+        with self._metrics_lock:
+            self._metrics['submitted'] += 1
+            self._metrics['in_flight'] += 1
+        if self.kind == 'inline':
+            try:
+                result = fn(*args)
+            except Exception:
+                self._count('errors')
+                raise
+            finally:
+                self._release(started)
+            self._count('completed')
+            return result
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._count('errors')
+            self._release(started)
+            raise
+        # The slot is handed back when the task finishes (or is cancelled),
+        # not when the caller stops waiting for it
+        future.add_done_callback(lambda _: self._release(started))
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Still queued: drop it; already running: it keeps its slot until done
+            future.cancel()
+            self._count('timeouts')
+            raise PoolSaturated(self.name, self.retry_after)
+        except Exception:
+            self._count('errors')
+            raise
+        self._count('completed')
+        return result
+
+    def shutdown(self):
+        # Forked workers otherwise outlive a server that exits on SIGTERM
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            metrics = dict(self._metrics)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        return dict(
+            metrics,
+            kind=self.kind,
+            max_workers=self.max_workers,
+            max_queue=self.max_queue,
+            latency_p50_ms=percentile(0.50),
+            latency_p95_ms=percentile(0.95),
+            latency_p99_ms=percentile(0.99),
+        )
+
+
+def pool_from_env(name, default_workers, default_queue):
+    prefix = name.upper()
+    return WorkerPool(
+        name,
+        max_workers=int(os.getenv(f'{prefix}_POOL_WORKERS', default_workers)),
+        max_queue=int(os.getenv(f'{prefix}_POOL_QUEUE', default_queue)),
+        kind=os.getenv(f'{prefix}_POOL_KIND', os.getenv('WORKER_POOL_KIND', 'process')),
+        timeout=float(os.getenv(f'{prefix}_POOL_TIMEOUT', 10.0)),
+        retry_after=int(os.getenv(f'{prefix}_POOL_RETRY_AFTER', 1)),
+    )
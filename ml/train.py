@@ -0,0 +1,417 @@
+"""Out-of-core training pipeline for the fraud model.
+
+Replaces the in-memory run in fraud_detection.ipynb. The stages are listed
+below, and each one reports wall time and peak RSS.
+
+  convert   Converts the PaySim CSV, once, into one .npy column file per field
+            under --store: float32 money columns, int16 step, int8 type code
+            and label. Re-runs reuse the store while the CSV's size and
+            mtime are unchanged.
+  split     Builds a stratified train/test split (--test-size, --seed).
+  sample    Keeps every fraud row of the training split plus
+            --negatives-per-positive non-fraud rows. With --resample smote,
+            SMOTE is applied to this bounded sample, not to the whole split.
+  caps      Computes approximate --cap-quantile caps for the money columns
+            from a --quantile-sample row sample of the training split.
+  features  Streams --chunk-rows rows at a time through
+            fraud.engineer_features, the same function the API scores with,
+            into the fit matrix and a memory-mapped test matrix.
+  train     Fits a RandomForest with the notebook's hyperparameters.
+  evaluate  Runs chunked predict_proba over the whole test split.
+  save      Writes a joblib pickle with feature_caps_ attached. --compile
+            also writes the flat .npz forest (backend/forest.py).
+
+Columns are read through short-lived memory maps that are dropped after each
+chunk. Peak RSS therefore follows --chunk-rows, not the size of the dataset.
+The same CSV, seed and options give the same model.
+
+    python ml/train.py --csv ml/data/PS_20174392719_1491204439457_log.csv --output backend/fraud_model.pkl --compile
+    python ml/train.py --synthetic 2000000   # try the pipeline without the dataset
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(ML_DIR), 'backend'))
+
+from fraud import FEATURE_COLUMNS, LABEL_THRESHOLD, RAW_COLUMNS, TYPE_COLUMNS, engineer_features  # noqa: E402
+
+PAYSIM_TYPES = ['CASH_IN', 'CASH_OUT', 'DEBIT', 'PAYMENT', 'TRANSFER']
+STORE_DTYPES = {
+    'step': np.int16,
+    'type': np.int8,
+    'amount': np.float32,
+    'oldbalanceOrg': np.float32,
+    'newbalanceOrig': np.float32,
+    'oldbalanceDest': np.float32,
+    'newbalanceDest': np.float32,
+    'isFraud': np.int8,
+}
+STORE_VERSION = 1
+
+# Row roles assigned by the split and sample stages
+UNUSED, FIT, TEST = 0, 1, 2
+
+
+def reset_peak_rss():
+    # Linux resets VmHWM to the current RSS on "5"; elsewhere peaks are cumulative
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stages:
+    def __init__(self):
+        self.results = []
+
+    def run(self, name, fn, *args):
+        reset_peak_rss()
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        rss = peak_rss()
+        self.results.append({'stage': name, 'seconds': round(elapsed, 3), 'peak_rss_mb': round(rss / 2 ** 20, 1)})
+        print(f'{name:>10}{elapsed:>10.2f}s{rss / 2 ** 20:>10.1f} MB', flush=True)
+        return result
+
+
+def column(store, name):
+    return np.load(os.path.join(store, f'{name}.npy'), mmap_mode='r')
+
+
+def read_rows(store, name, start, stop):
+    # Copy out and drop the map, so touched pages do not stay in this process's RSS
+    mapped = column(store, name)
+    rows = np.array(mapped[start:stop])
+    del mapped
+    return rows
+
+
+def gather(store, name, rows):
+    mapped = column(store, name)
+    values = np.array(mapped[rows])
+    del mapped
+    return values
+
+
+def open_npy(path, dtype, shape):
+    f = open(path, 'wb')
+    np.lib.format.write_array_header_1_0(f, {
+        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        'fortran_order': False,
+        'shape': shape,
+    })
+    return f
+
+
+def count_rows(path):
+    newlines, last = 0, b''
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1 << 24)
+            if not block:
+                break
+            newlines += block.count(b'\n')
+            last = block[-1:]
+    # Minus the header line; a last line without a newline still counts
+    return newlines - 1 + (last not in (b'\n', b''))
+
+
+def source_info(csv_path):
+    stat = os.stat(csv_path)
+    return {'path': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def convert(csv_path, store, chunk_rows):
+    import pandas as pd
+
+    meta_path = os.path.join(store, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('version') == STORE_VERSION and meta.get('source') == source_info(csv_path):
+            print(f'Reusing column store {store} ({meta["rows"]} rows)')
+            return meta
+
+    os.makedirs(store, exist_ok=True)
+    rows = count_rows(csv_path)
+    files = {name: open_npy(os.path.join(store, f'{name}.npy'), dtype, (rows,)) for name, dtype in STORE_DTYPES.items()}
+    written = positives = 0
+    try:
+        reader = pd.read_csv(csv_path, usecols=list(STORE_DTYPES), chunksize=chunk_rows,
+                             dtype={name: 'float64' for name in RAW_COLUMNS})
+        for chunk in reader:
+            codes = pd.Categorical(chunk['type'], categories=PAYSIM_TYPES).codes
+            if (codes < 0).any():
+                raise ValueError(f'{csv_path}: unknown transaction type near row {written + int(np.argmax(codes < 0))}')
+            chunk['type'] = codes
+            for name, dtype in STORE_DTYPES.items():
+                chunk[name].to_numpy().astype(dtype).tofile(files[name])
+            written += len(chunk)
+            positives += int(chunk['isFraud'].sum())
+    finally:
+        for f in files.values():
+            f.close()
+    if written != rows:
+        raise ValueError(f'{csv_path}: counted {rows} rows but parsed {written}')
+
+    meta = {'version': STORE_VERSION, 'rows': rows, 'positives': positives, 'types': PAYSIM_TYPES,
+            'dtypes': {name: np.dtype(dtype).name for name, dtype in STORE_DTYPES.items()},
+            'source': source_info(csv_path)}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def split(store, test_size, seed):
+    labels = np.array(column(store, 'isFraud'))
+    rng = np.random.default_rng(seed)
+    roles = np.full(len(labels), UNUSED, dtype=np.int8)
+    for label in (0, 1):
+        rows = np.flatnonzero(labels == label)
+        rng.shuffle(rows)
+        roles[rows[:int(round(len(rows) * test_size))]] = TEST
+    return roles, labels
+
+
+def sample(roles, labels, negatives_per_positive, seed):
+    rng = np.random.default_rng(seed + 1)
+    training = roles != TEST
+    positives = np.flatnonzero(training & (labels == 1))
+    negatives = np.flatnonzero(training & (labels == 0))
+    if negatives_per_positive:
+        keep = min(len(negatives), negatives_per_positive * max(len(positives), 1))
+        negatives = rng.choice(negatives, size=keep, replace=False)
+    roles[positives] = FIT
+    roles[negatives] = FIT
+    return int((roles == FIT).sum())
+
+
+def quantile_caps(store, roles, quantile, sample_rows, seed):
+    """Caps from a uniform row sample: ranks are within ~1/sqrt(sample_rows) of exact."""
+    rng = np.random.default_rng(seed + 2)
+    training = np.flatnonzero(roles != TEST)
+    rows = np.sort(rng.choice(training, size=min(sample_rows, len(training)), replace=False))
+    caps = np.full(len(FEATURE_COLUMNS), np.inf)
+    for name in RAW_COLUMNS:
+        caps[FEATURE_COLUMNS.index(name)] = float(np.quantile(gather(store, name, rows).astype(np.float64), quantile))
+    return caps
+
+
+def chunk_inputs(store, start, stop):
+    """INPUT_COLUMNS for a row range, in the shape transfer_features gives the API."""
+    columns = {name: read_rows(store, name, start, stop) for name in RAW_COLUMNS}
+    codes = read_rows(store, 'type', start, stop)
+    for name in TYPE_COLUMNS:
+        columns[name] = (codes == PAYSIM_TYPES.index(name[len('type_'):])).astype(np.int8)
+    step = read_rows(store, 'step', start, stop)
+    # PaySim steps are hours from the start of a 30-day month; the API uses the UTC hour and day of month
+    columns['hour'] = step % 24
+    columns['day'] = step // 24 + 1
+    return columns
+
+
+def build_features(store, roles, labels, caps, chunk_rows):
+    counts = {role: int((roles == role).sum()) for role in (FIT, TEST)}
+    outputs = {
+        role: (open_npy(os.path.join(store, f'X_{name}.npy'), np.float32, (counts[role], len(FEATURE_COLUMNS))),
+               open_npy(os.path.join(store, f'y_{name}.npy'), np.int8, (counts[role],)))
+        for role, name in ((FIT, 'fit'), (TEST, 'test'))
+    }
+    try:
+        for start in range(0, len(roles), chunk_rows):
+            stop = min(start + chunk_rows, len(roles))
+            chunk_roles = roles[start:stop]
+            if not (chunk_roles != UNUSED).any():
+                continue
+            # Trees split on float32, so storing the matrix as float32 loses nothing
+            matrix = engineer_features(chunk_inputs(store, start, stop), caps).astype(np.float32)
+            for role, (X_file, y_file) in outputs.items():
+                selected = chunk_roles == role
+                matrix[selected].tofile(X_file)
+                labels[start:stop][selected].tofile(y_file)
+    finally:
+        for X_file, y_file in outputs.values():
+            X_file.close()
+            y_file.close()
+    return counts
+
+
+def train(store, args):
+    from sklearn.ensemble import RandomForestClassifier
+
+    X = np.load(os.path.join(store, 'X_fit.npy'))
+    y = np.load(os.path.join(store, 'y_fit.npy'))
+    if args.resample == 'smote':
+        try:
+            from imblearn.over_sampling import SMOTE
+        except ImportError:
+            raise SystemExit('--resample smote needs imbalanced-learn (pip install imbalanced-learn)')
+        X, y = SMOTE(random_state=args.seed).fit_resample(X, y)
+
+    model = RandomForestClassifier(n_estimators=args.n_estimators, max_depth=20, min_samples_split=2,
+                                   random_state=args.seed, n_jobs=args.n_jobs)
+    model.fit(X, y)
+    return model, len(y)
+
+
+def evaluate(store, model, chunk_rows):
+    from sklearn.metrics import average_precision_score, confusion_matrix, precision_recall_fscore_support, roc_auc_score
+
+    y = np.load(os.path.join(store, 'y_test.npy'))
+    positive = list(model.classes_).index(1)
+    probabilities = np.empty(len(y), dtype=np.float64)
+    for start in range(0, len(y), chunk_rows):
+        X = read_rows(store, 'X_test', start, start + chunk_rows)
+        probabilities[start:start + len(X)] = model.predict_proba(X)[:, positive]
+
+    predicted = probabilities > LABEL_THRESHOLD
+    precision, recall, f1, _ = precision_recall_fscore_support(y, predicted, average='binary', zero_division=0)
+    tn, fp, fn, tp = confusion_matrix(y, predicted, labels=[0, 1]).ravel()
+    return {
+        'rows': int(len(y)),
+        'positives': int(y.sum()),
+        'roc_auc': float(roc_auc_score(y, probabilities)) if 0 < y.sum() < len(y) else None,
+        'average_precision': float(average_precision_score(y, probabilities)),
+        'threshold': LABEL_THRESHOLD,
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1': float(f1),
+        'confusion_matrix': {'tn': int(tn), 'fp': int(fp), 'fn': int(fn), 'tp': int(tp)},
+    }
+
+
+def save(store, model, caps, output, compile_forest):
+    import joblib
+
+    # Serving reads these back; build_feature_matrix applies the caps before scoring
+    model.feature_caps_ = caps
+    model.feature_columns_ = list(FEATURE_COLUMNS)
+    joblib.dump(model, output)
+    written = [output]
+    if compile_forest:
+        from forest import CompiledForest, export_forest, verify
+        compiled_path = os.path.splitext(output)[0] + '.npz'
+        export_forest(model, compiled_path)
+        if not verify(model, CompiledForest.load(compiled_path), read_rows(store, 'X_test', 0, 10000)):
+            raise SystemExit('Compiled forest does not match predict_proba')
+        written.append(compiled_path)
+    return written
+
+
+def write_synthetic_csv(path, rows, seed, chunk_rows):
+    """PaySim-shaped data: fraud empties the origin account via TRANSFER or CASH_OUT."""
+    import pandas as pd
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    weights = [0.22, 0.35, 0.01, 0.34, 0.08]
+    with open(path, 'w', newline='') as f:
+        for start in range(0, rows, chunk_rows):
+            n = min(chunk_rows, rows - start)
+            kind = rng.choice(len(PAYSIM_TYPES), size=n, p=weights)
+            fraud = np.isin(kind, [1, 4]) & (rng.random(n) < 0.008)
+            old_org = np.round(rng.lognormal(9, 2.5, n), 2) * (rng.random(n) > 0.3)
+            amount = np.where(fraud, old_org, np.round(rng.lognormal(10, 1.5, n), 2))
+            outgoing = kind != 0
+            new_org = np.where(outgoing, np.maximum(old_org - amount, 0), old_org + amount)
+            old_dest = np.round(rng.lognormal(11, 2.5, n), 2) * (rng.random(n) > 0.4)
+            # Fraudulent destinations often never show the credit
+            credited = ~fraud | (rng.random(n) < 0.5)
+            new_dest = np.where(np.isin(kind, [1, 4]) & credited, old_dest + amount, old_dest)
+            pd.DataFrame({
+                'step': np.sort(rng.integers(1, 744, n)),
+                'type': np.array(PAYSIM_TYPES)[kind],
+                'amount': amount,
+                'nameOrig': 'C0',
+                'oldbalanceOrg': old_org,
+                'newbalanceOrig': np.round(new_org, 2),
+                'nameDest': 'C1',
+                'oldbalanceDest': old_dest,
+                'newbalanceDest': np.round(new_dest, 2),
+                'isFraud': fraud.astype(np.int8),
+                'isFlaggedFraud': 0,
+            }).to_csv(f, header=start == 0, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default=os.path.join(ML_DIR, 'data', 'PS_20174392719_1491204439457_log.csv'))
+    parser.add_argument('--store', help='Column store directory (default: next to the CSV)')
+    parser.add_argument('--output', default=os.path.join(ML_DIR, 'fraud_model.pkl'))
+    parser.add_argument('--report', help='Where to write the JSON report (default: <output>.report.json)')
+    parser.add_argument('--compile', action='store_true', help='Also write the flat .npz forest')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--test-size', type=float, default=0.3)
+    parser.add_argument('--chunk-rows', type=int, default=500000)
+    parser.add_argument('--cap-quantile', type=float, default=0.95)
+    parser.add_argument('--quantile-sample', type=int, default=1000000)
+    parser.add_argument('--negatives-per-positive', type=int, default=20,
+                        help='Non-fraud training rows kept per fraud row (0 keeps them all)')
+    parser.add_argument('--resample', choices=['none', 'smote'], default='none')
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--synthetic', type=int, metavar='ROWS',
+                        help='Generate a PaySim-shaped CSV at --csv first, if it does not exist')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        if args.csv == parser.get_default('csv'):
+            args.csv = os.path.join(ML_DIR, 'data', f'synthetic_paysim_{args.synthetic}.csv')
+        if not os.path.exists(args.csv):
+            print(f'Writing {args.synthetic} synthetic rows to {args.csv}')
+            write_synthetic_csv(args.csv, args.synthetic, args.seed, args.chunk_rows)
+    store = args.store or os.path.splitext(args.csv)[0] + '_columns'
+
+    print(f'{"stage":>10}{"wall":>11}{"peak RSS":>13}')
+    stages = Stages()
+    meta = stages.run('convert', convert, args.csv, store, args.chunk_rows)
+    roles, labels = stages.run('split', split, store, args.test_size, args.seed)
+    fit_rows = stages.run('sample', sample, roles, labels, args.negatives_per_positive, args.seed)
+    caps = stages.run('caps', quantile_caps, store, roles, args.cap_quantile, args.quantile_sample, args.seed)
+    stages.run('features', build_features, store, roles, labels, caps, args.chunk_rows)
+    model, trained_rows = stages.run('train', train, store, args)
+    metrics = stages.run('evaluate', evaluate, store, model, args.chunk_rows)
+    written = stages.run('save', save, store, model, caps, args.output, args.compile)
+
+    report = {
+        'source': meta['source'],
+        'rows': meta['rows'],
+        'positives': meta['positives'],
+        'params': {name: value for name, value in vars(args).items() if name not in ('report', 'synthetic')},
+        'fit_rows': fit_rows,
+        'trained_rows': trained_rows,
+        'caps': {name: caps[FEATURE_COLUMNS.index(name)] for name in RAW_COLUMNS},
+        'stages': stages.results,
+        'test': metrics,
+        'outputs': written,
+    }
+    report_path = args.report or os.path.splitext(args.output)[0] + '.report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Test split: ROC AUC {metrics["roc_auc"]}, average precision {metrics["average_precision"]:.4f}, '
+          f'precision {metrics["precision"]:.3f}, recall {metrics["recall"]:.3f}')
+    print(f'Wrote {", ".join(written)} and {report_path}')
+
+
+if __name__ == '__main__':
+    main()